@@ -0,0 +1,93 @@
+"""
+Concurrency Benchmark
+
+Compares how throughput and latency scale with the number of concurrent
+requests between the WSGI app (``service:app`` on sync gunicorn workers)
+and the ASGI app (``service.asgi:app`` on uvicorn workers), with the same
+number of workers and the same seeded Customers.
+
+Usage:
+    python -m bench.bench_concurrency [--count 10000] [--requests 1000]
+                                      [--workers 2] [--levels 1 8 32 64]
+                                      [--output concurrency.json]
+
+DATABASE_URI selects the database (a SQLite file by default). Use a local
+Postgres to see the effect of waiting on the network: SQLite serializes
+writers and answers reads without any I/O wait.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+from datetime import datetime, timezone
+
+from bench.run import DEFAULT_DATABASE_URI, GunicornClient, build_requests, run_scenario, seed
+
+SERVERS = {
+    "wsgi": {"app": "service:app", "worker_class": "sync"},
+    "asgi": {"app": "service.asgi:app", "worker_class": "uvicorn.workers.UvicornWorker"},
+}
+
+
+def main():
+    """Runs every scenario at every concurrency level against both servers"""
+    parser = argparse.ArgumentParser(description="Concurrency scaling of WSGI and ASGI")
+    parser.add_argument("--count", type=int, default=10000, help="Customers to seed")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario and level")
+    parser.add_argument("--workers", type=int, default=2, help="Workers of each server")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32, 64], help="Concurrent requests")
+    parser.add_argument("--scenarios", nargs="+", default=["get_by_id", "list", "email_filter"])
+    parser.add_argument("--servers", nargs="+", choices=SERVERS, default=list(SERVERS))
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--seed", type=int, default=2023, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ.setdefault("DATABASE_URI", DEFAULT_DATABASE_URI)
+    from service import app  # pylint: disable=import-outside-toplevel
+
+    app.logger.setLevel("WARNING")
+    with app.app_context():
+        customers = seed(args.count)
+    results = {
+        "commit": subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=False
+        ).stdout.strip() or "unknown",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: getattr(args, key) for key in ("count", "requests", "workers", "levels")},
+        "database": os.environ["DATABASE_URI"].split("@")[-1],
+        "results": {},
+    }
+
+    for server in args.servers:
+        client = GunicornClient(args.workers, **SERVERS[server])
+        try:
+            results["results"][server] = {
+                scenario: {
+                    str(level): run_scenario(
+                        client, build_requests(scenario, customers, args.requests), level
+                    )
+                    for level in args.levels
+                }
+                for scenario in args.scenarios
+            }
+        finally:
+            client.close()
+
+    print(f"{'scenario':14} {'level':>5} " + " ".join(f"{s + ' rps':>10} {s + ' p99':>10}" for s in args.servers))
+    for scenario in args.scenarios:
+        for level in map(str, args.levels):
+            cells = [results["results"][server][scenario][level] for server in args.servers]
+            print(
+                f"{scenario:14} {level:>5} "
+                + " ".join(f"{cell['throughput_rps']:>10} {cell['p99_ms']:>10}" for cell in cells)
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Serialization Benchmark
+
+Compares the list serialization path that loaded ORM objects, called
+serialize() and marshal_list_with, with the row serializer that selects
+column tuples and encodes them straight to JSON bytes.
+
+Usage:
+    python -m bench.bench_serialization [--count 10000] [--repeat 5]
+
+DATABASE_URI defaults to an in-memory SQLite database.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+
+# pylint: disable=wrong-import-position
+from flask_restx import marshal  # noqa: E402
+from service import app  # noqa: E402
+from service.models import Customer, db  # noqa: E402
+from service.routes import customer_columns, customer_model, customer_rows  # noqa: E402
+from tests.factories import CustomerFactory  # noqa: E402
+
+
+def marshal_path(limit: int) -> bytes:
+    """The original path: ORM objects -> serialize() -> marshal -> json"""
+    customers = Customer.query.order_by(Customer.id).limit(limit).all()
+    results = [customer.serialize() for customer in customers]
+    return json.dumps(marshal(results, customer_model)).encode()
+
+
+def row_path(limit: int) -> bytes:
+    """The fast path: column tuples -> RowSerializer -> JSON bytes"""
+    rows = Customer.query.with_entities(*customer_columns).order_by(Customer.id).limit(limit).all()
+    return customer_rows.dumps(rows)
+
+
+def measure(func, limit: int, repeat: int) -> dict:
+    """Times a serialization path and returns its statistics in ms"""
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        func(limit)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "rows_per_second": round(limit / (statistics.median(timings) / 1000)),
+    }
+
+
+def main():
+    """Seeds Customers and prints both paths' timings as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all(CustomerFactory.build_batch(args.count, id=None))
+        db.session.commit()
+        assert json.loads(marshal_path(args.count)) == json.loads(row_path(args.count))
+        old = measure(marshal_path, args.count, args.repeat)
+        new = measure(row_path, args.count, args.repeat)
+    print(json.dumps({
+        "count": args.count,
+        "marshal_list_with": old,
+        "row_serializer": new,
+        "speedup": round(old["median_ms"] / new["median_ms"], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Customer Service Benchmark
+
+Seeds Customers with tests.factories.CustomerFactory and measures the
+throughput and p50/p99 latency of the hot paths (create, get by id, list,
+email filter, update and deactivate), both through the Flask test client
+and through a real gunicorn process. Results are written as JSON so runs
+on different commits can be compared.
+
+Usage:
+    python -m bench.run [--count 10000] [--requests 500] [--mode both]
+                        [--workers 2] [--concurrency 4] [--output results.json]
+                        [--compare baseline.json] [--tolerance 0.10]
+
+DATABASE_URI selects the database (a SQLite file by default). It must not
+be an in-memory database when gunicorn is used, since the workers need to
+see the seeded rows.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+DEFAULT_DATABASE_URI = "sqlite:////tmp/customers-bench.db"
+SCENARIOS = ["create", "get_by_id", "list", "email_filter", "update", "deactivate"]
+
+
+######################################################################
+#  C L I E N T S
+######################################################################
+class TestClient:  # pylint: disable=too-few-public-methods
+    """Sends requests through the Flask test client"""
+
+    name = "test_client"
+
+    def __init__(self):
+        from service import app  # pylint: disable=import-outside-toplevel
+
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, payload=None) -> int:
+        """Sends one request and returns the status code"""
+        return self.client.open(path, method=method, json=payload).status_code
+
+
+class GunicornClient:
+    """Sends requests to a gunicorn process started for the run
+
+    ``worker_class`` selects the gunicorn worker, such as
+    uvicorn.workers.UvicornWorker to serve the ASGI ``service.asgi:app``.
+    """
+
+    name = "gunicorn"
+
+    def __init__(self, workers: int, app: str = "service:app", worker_class: str = "sync"):
+        import requests  # pylint: disable=import-outside-toplevel
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=256)
+        self.session.mount("http://", adapter)
+        port = _free_port()
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                sys.executable, "-m", "gunicorn",
+                "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers),
+                "--worker-class", worker_class,
+                "--log-level", "warning",
+                app,
+            ],
+            env=os.environ.copy(),
+        )
+        self._wait_until_healthy()
+
+    def _wait_until_healthy(self, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if self.session.get(f"{self.base_url}/health", timeout=1).ok:
+                    return
+            except Exception:  # pylint: disable=broad-except
+                time.sleep(0.2)
+        self.close()
+        raise RuntimeError("gunicorn did not become healthy")
+
+    def request(self, method: str, path: str, payload=None) -> int:
+        """Sends one request and returns the status code"""
+        return self.session.request(method, self.base_url + path, json=payload).status_code
+
+    def close(self):
+        """Stops the gunicorn process"""
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+######################################################################
+#  S C E N A R I O S
+######################################################################
+def seed(count: int) -> list:
+    """Replaces the Customers with count new ones and returns them"""
+    # pylint: disable=import-outside-toplevel
+    from service.common import bulk
+    from service.models import Customer, db
+    from tests.factories import CustomerFactory
+
+    db.session.query(Customer).delete()
+    db.session.commit()
+    Customer.cache.clear()
+    customers = CustomerFactory.build_batch(count)
+    payloads = [_payload(customer) for customer in customers]
+    ids = bulk.create_customers(customers, chunk_size=5000, atomic=True)
+    return [dict(payload, id=by_id) for by_id, payload in zip(ids, payloads)]
+
+
+def _payload(customer) -> dict:
+    data = customer.serialize()
+    del data["id"], data["version"]
+    return data
+
+
+def build_requests(scenario: str, customers: list, count: int) -> list:
+    """Returns the (method, path, payload) requests of a scenario"""
+    # pylint: disable=import-outside-toplevel
+    from tests.factories import PASSWORD, CustomerFactory
+
+    picks = [random.choice(customers) for _ in range(count)]
+    if scenario == "create":
+        return [
+            ("POST", "/api/customers", dict(_payload(c), password=PASSWORD))
+            for c in CustomerFactory.build_batch(count)
+        ]
+    if scenario == "get_by_id":
+        return [("GET", f"/api/customers/{c['id']}", None) for c in picks]
+    if scenario == "list":
+        return [("GET", "/api/customers?limit=100", None) for _ in picks]
+    if scenario == "email_filter":
+        return [("GET", f"/api/customers?email={c['email']}", None) for c in picks]
+    if scenario == "update":
+        return [("PUT", f"/api/customers/{c['id']}", dict(c, last_name="Bench")) for c in picks]
+    if scenario == "deactivate":
+        return [("PUT", f"/api/customers/{c['id']}/deactivate", None) for c in picks]
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def run_scenario(client, requests: list, concurrency: int) -> dict:
+    """Sends the requests and returns throughput and latency statistics"""
+
+    def timed(req):
+        start = time.perf_counter()
+        code = client.request(*req)
+        return (time.perf_counter() - start) * 1000, code < 400
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(timed, requests))
+    else:
+        samples = [timed(req) for req in requests]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, ok in samples if not ok),
+        "throughput_rps": round(len(samples) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+    }
+
+
+def _percentile(ordered: list, percent: float) -> float:
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+######################################################################
+#  R E P O R T I N G
+######################################################################
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns the scenarios whose p50 latency regressed beyond tolerance"""
+    regressions = []
+    for mode, scenarios in results["results"].items():
+        for scenario, stats in scenarios.items():
+            old = baseline.get("results", {}).get(mode, {}).get(scenario)
+            if not old:
+                continue
+            change = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"]
+            print(f"{mode:12} {scenario:14} p50 {old['p50_ms']:9.3f} -> {stats['p50_ms']:9.3f} ms ({change:+.1%})")
+            if change > tolerance:
+                regressions.append(f"{mode}/{scenario}")
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    """Runs the benchmark and writes the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=10000, help="Customers to seed")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--mode", choices=["client", "gunicorn", "both"], default="both")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent requests against gunicorn")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 regression")
+    parser.add_argument("--seed", type=int, default=2023, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ.setdefault("DATABASE_URI", DEFAULT_DATABASE_URI)
+    from service import app  # pylint: disable=import-outside-toplevel
+
+    app.logger.setLevel("WARNING")
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: getattr(args, key) for key in ("count", "requests", "workers", "concurrency")},
+        "database": os.environ["DATABASE_URI"].split("@")[-1],
+        "results": {},
+    }
+
+    modes = ["client", "gunicorn"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        with app.app_context():
+            customers = seed(args.count)
+        client = TestClient() if mode == "client" else GunicornClient(args.workers)
+        concurrency = args.concurrency if mode == "gunicorn" else 1
+        try:
+            results["results"][client.name] = {
+                scenario: run_scenario(client, build_requests(scenario, customers, args.requests), concurrency)
+                for scenario in args.scenarios
+            }
+        finally:
+            if mode == "gunicorn":
+                client.close()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
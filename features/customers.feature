@@ -5,10 +5,10 @@ Feature: The customer service back-end
 
 Background:
     Given the following customers
-        | firstName     | lastName      | email                   | address                                              | active |               salt               |                             password                             |
-        | William       | Dixon         | will.dixon@hotmail.com  | PSC 4115, Box 7815\nAPO AA 41945                     | True   | 6edcc0329c89cb56c6ddfb4dfe451887 | 4f1b60f3fea4f90aacd277108bc646efd7e99ac6590cae4d643da49cc72d174a |
-        | Jonathan      | Richard       | jrich@yahoo.com         | 778 Brown Plaza\nNorth Jenniferfurt, VT 88077        | True   | 6edcc0329c89cb56c6ddfb4dfe451887 | 4f1b60f3fea4f90aacd277108bc646efd7e99ac6590cae4d643da49cc72d174a |
-        | Megan         | Chang         | mchang@gmail.com        | 398 Wallace Ranch Suite 593\nIvanburgh, AZ 80818     | False  | 6edcc0329c89cb56c6ddfb4dfe451887 | 4f1b60f3fea4f90aacd277108bc646efd7e99ac6590cae4d643da49cc72d174a |
+        | firstName     | lastName      | email                   | address                                              | active | password     |
+        | William       | Dixon         | will.dixon@hotmail.com  | PSC 4115, Box 7815\nAPO AA 41945                     | True   | P@ssw0rd!123 |
+        | Jonathan      | Richard       | jrich@yahoo.com         | 778 Brown Plaza\nNorth Jenniferfurt, VT 88077        | True   | P@ssw0rd!123 |
+        | Megan         | Chang         | mchang@gmail.com        | 398 Wallace Ranch Suite 593\nIvanburgh, AZ 80818     | False  | P@ssw0rd!123 |
 
 Scenario: The server is running
     When I visit the "Home Page"
@@ -27,7 +27,6 @@ Scenario: Read a Customer
     And the "Last Name" field should be empty
     And the "Email" field should be empty
     And the "Address" field should be empty
-    And the "Salt" field should be empty
     And the "Password" field should be empty
     When I paste the "Id" field
     And I press the "Retrieve" button
@@ -36,8 +35,6 @@ Scenario: Read a Customer
     And I should see "Dixon" in the "Last Name" field
     And I should see "will.dixon@hotmail.com" in the "Email" field
     And I should see "PSC 4115, Box 7815\nAPO AA 41945" in the "Address" field
-    And I should see "6edcc0329c89cb56c6ddfb4dfe451887" in the "Salt" field
-    And I should see "4f1b60f3fea4f90aacd277108bc646efd7e99ac6590cae4d643da49cc72d174a" in the "Password" field
     And I should see "True" in the "Active" dropdown
 
 Scenario: Create a Customer
@@ -46,8 +43,7 @@ Scenario: Create a Customer
     And I set the "Last Name" to "Fisher"
     And I set the "Email" to "kfisher@example.org"
     And I set the "Address" to "3513 John Divide Suite 115\nRodriguezside, LA 93111"
-    And I set the "Salt" to "6bce3e2226016eb568e822b09f0ee020"
-    And I set the "Password" to "888f807d45ff6ce47240c7ed4e884a6f9dc7b4fb"
+    And I set the "Password" to "K@therine-2023"
     And I select "True" in the "Active" dropdown
     And I press the "Create" button
     Then I should see the message "Success"
@@ -58,7 +54,6 @@ Scenario: Create a Customer
     And the "Last Name" field should be empty
     And the "Email" field should be empty
     And the "Address" field should be empty
-    And the "Salt" field should be empty
     And the "Password" field should be empty
     And the "Active" field should be empty
     When I paste the "Id" field
@@ -68,8 +63,6 @@ Scenario: Create a Customer
     And I should see "Fisher" in the "Last Name" field
     And I should see "kfisher@example.org" in the "Email" field
     And I should see "3513 John Divide Suite 115\nRodriguezside, LA 93111" in the "Address" field
-    And I should see "6bce3e2226016eb568e822b09f0ee020" in the "Salt" field
-    And I should see "888f807d45ff6ce47240c7ed4e884a6f9dc7b4fb" in the "Password" field
     And I should see "True" in the "Active" dropdown
 
 Scenario: List all Customers
@@ -89,8 +82,6 @@ Scenario: Query a Customer by email
     And I should see "Dixon" in the "Last Name" field
     And I should see "will.dixon@hotmail.com" in the "Email" field
     And I should see "PSC 4115, Box 7815\nAPO AA 41945" in the "Address" field
-    And I should see "6edcc0329c89cb56c6ddfb4dfe451887" in the "Salt" field
-    And I should see "4f1b60f3fea4f90aacd277108bc646efd7e99ac6590cae4d643da49cc72d174a" in the "Password" field
     And I should see "True" in the "Active" dropdown
 
 Scenario: Update a Customer
@@ -130,7 +121,6 @@ Scenario: Deactivate a Customer
     And the "Last Name" field should be empty
     And the "Email" field should be empty
     And the "Address" field should be empty
-    And the "Salt" field should be empty
     And the "Password" field should be empty
     And the "Active" field should be empty
     When I paste the "Id" field
@@ -140,8 +130,6 @@ Scenario: Deactivate a Customer
     And I should see "Richard" in the "Last Name" field
     And I should see "jrich@yahoo.com" in the "Email" field
     And I should see "778 Brown Plaza\nNorth Jenniferfurt, VT 88077" in the "Address" field
-    And I should see "6edcc0329c89cb56c6ddfb4dfe451887" in the "Salt" field
-    And I should see "4f1b60f3fea4f90aacd277108bc646efd7e99ac6590cae4d643da49cc72d174a" in the "Password" field
     And I should see "False" in the "Active" dropdown
 
 Scenario: Delete a Customer
@@ -156,7 +144,6 @@ Scenario: Delete a Customer
     And the "Last Name" field should be empty
     And the "Email" field should be empty
     And the "Address" field should be empty
-    And the "Salt" field should be empty
     And the "Password" field should be empty
     And the "Active" field should be empty
     When I paste the "Id" field
@@ -29,30 +29,37 @@ from behave import given
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
 HTTP_204_NO_CONTENT = 204
+HTTP_207_MULTI_STATUS = 207
 
 
 @given("the following customers")
 def step_impl(context):
     """Delete all Customers and load new ones"""
 
-    # List all of the customers and delete them one by one
+    # List all of the customers and delete them in one batch
     rest_endpoint = f"{context.base_url}/api/customers"
     context.resp = requests.get(rest_endpoint)
     assert context.resp.status_code == HTTP_200_OK
-    for customer in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{customer['id']}")
-        assert context.resp.status_code == HTTP_204_NO_CONTENT
+    ids = [int(customer["id"]) for customer in context.resp.json()]
+    if ids:
+        context.resp = requests.delete(f"{rest_endpoint}/batch", json=ids)
+        assert context.resp.status_code == HTTP_207_MULTI_STATUS
+        for result in context.resp.json():
+            assert result["status"] == HTTP_204_NO_CONTENT
 
-    # load the database with new customers
-    for row in context.table:
-        payload = {
+    # load the database with new customers in one batch
+    payload = [
+        {
             "first_name": row["firstName"],
             "last_name": row["lastName"],
             "email": row["email"],
             "address": row["address"],
             "active": row["active"] in ["True", "true", "1"],
-            "salt": row["salt"],
             "password": row["password"],
         }
-        context.resp = requests.post(rest_endpoint, json=payload)
-        assert context.resp.status_code == HTTP_201_CREATED
+        for row in context.table
+    ]
+    context.resp = requests.post(f"{rest_endpoint}/batch?atomic=true", json=payload)
+    assert context.resp.status_code == HTTP_207_MULTI_STATUS
+    for result in context.resp.json():
+        assert result["status"] == HTTP_201_CREATED
@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration
+
+Gunicorn loads this file from the working directory. The hooks keep the
+Prometheus multiprocess directory consistent across worker restarts and
+make the preloaded app safe to fork.
+
+The app is loaded once by the master and forked into the workers, which
+share its memory until they write to it and start faster. Set
+GUNICORN_PRELOAD=false to have each worker import the app itself.
+
+Workers are threaded (gthread): a client of /customers/events keeps its
+request open, which would take a whole sync worker and be killed at its
+timeout. Each event subscriber holds one of GUNICORN_THREADS threads, so
+serve many subscribers from the ASGI app (service.asgi:app) instead.
+
+With more than one worker the per-worker read cache is turned off unless
+CACHE_TYPE is set.
+"""
+import os
+import shutil
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "1", "yes")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Starts every run with an empty Prometheus multiprocess directory"""
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Keeps a worker from sharing the database connections of the master"""
+    if server.cfg.preload_app:
+        from service.models import dispose_engine  # pylint: disable=import-outside-toplevel
+
+        dispose_engine()
+
+
+def post_worker_init(worker):
+    """Stops caching Customers per worker when there are several workers
+
+    A write only invalidates the LRU cache of the worker that handled it,
+    so the others would serve the old Customer until it expires. Setting
+    CACHE_TYPE (to "redis" to share one cache) overrides this.
+    """
+    if worker.cfg.workers > 1 and "CACHE_TYPE" not in os.environ:
+        # pylint: disable=import-outside-toplevel
+        from service.common.cache import NullCache
+        from service.models import Customer
+
+        worker.log.info("Read cache disabled: %s workers would each keep their own", worker.cfg.workers)
+        Customer.cache = NullCache()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Stops reporting the live gauges of a worker that has exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+        multiprocess.mark_process_dead(worker.pid)
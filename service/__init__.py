@@ -3,28 +3,30 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+create_app() makes the app; ``service:app`` is the one made from the
+configuration of the environment. The routes, error handlers and commands
+register on a blueprint that every app gets. Making an app opens no
+connection and starts no thread that a gunicorn --preload master would
+hand down to its workers (see gunicorn.conf.py).
 """
+# Imported first so the startup clock runs before everything else is imported
+from service.common.startup import startup  # pylint: disable=wrong-import-order
 import sys
 import logging
-from flask import Flask
+from flask import Blueprint, Flask
 from flask_restx import Api
-from service import config
-from service.common import log_handlers
-
-# Create Flask application
-app = Flask(__name__)
+from service import config  # pylint: disable=ungrouped-imports
+from service.common import log_handlers, metrics, profiling
 
-app.url_map.strict_slashes = False
-
-app.config.from_object(config)
-app.config["LOGGING_LEVEL"] = logging.INFO
-app.config["ERROR_404_HELP"] = False
+# cli_group=None keeps the commands at the top level: flask db-init
+blueprint = Blueprint("customers", __name__, cli_group=None)
 
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
 api = Api(
-    app,
+    blueprint,
     version="1.0.0",
     title="Customer API Service",
     description="Customer API Service for an ecommerce site",
@@ -34,25 +36,59 @@ api = Api(
     prefix="/api",
 )
 
-# Dependencies require we import the routes AFTER the Flask app is created
+# Dependencies require we import the routes AFTER the blueprint is created
 # pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models  # noqa: E402, E261
+from service import routes, batch_routes, job_routes, models  # noqa: E402, E261
 
 # pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+from service.common import error_handlers, cli_commands, jobs  # noqa: F401, E402
+
+startup.mark("imports")
+
+
+def create_app(config_object=config) -> Flask:
+    """Creates and configures the Flask app
+
+    :param config_object: the module or object to read the settings from
+
+    """
+    flask_app = Flask(__name__)
+    flask_app.url_map.strict_slashes = False
+    flask_app.config.from_object(config_object)
+    flask_app.config["LOGGING_LEVEL"] = logging.INFO
+    flask_app.config["ERROR_404_HELP"] = False
+
+    # Collect request, SQL and serialization metrics for /metrics
+    metrics.init_metrics(flask_app)
+    flask_app.register_blueprint(blueprint)
+
+    # Set up logging for production
+    log_handlers.init_logging(flask_app, "gunicorn.error")
+
+    # Server-Timing phases and ?_profile=1, only if they are turned on
+    profiling.init_profiling(flask_app)
+
+    flask_app.logger.info(70 * "*")
+    flask_app.logger.info("  C U S T O M E R   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    flask_app.logger.info(70 * "*")
+    startup.mark("app")
+
+    try:
+        models.init_db(flask_app)  # make our SQLAlchemy tables
+    except Exception as error:  # pylint: disable=broad-except
+        flask_app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+    startup.mark("database")
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    # Run queued import and export jobs in this process's threads
+    jobs.init_jobs(flask_app)
+    startup.mark("jobs")
 
-app.logger.info(70 * "*")
-app.logger.info("  C U S T O M E R   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    if startup.finish():
+        metrics.observe_startup(startup.phases)
+    flask_app.logger.info("Service initialized! %s", startup.summary())
+    return flask_app
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+app = create_app()
@@ -0,0 +1,612 @@
+"""
+ASGI Entry Point
+
+Serves the Customer routes with async handlers on an async SQLAlchemy
+engine (psycopg async on Postgres, aiosqlite on SQLite), so a worker
+keeps serving other requests while it waits on the database. Every other
+path (health, stats, metrics, batch, Swagger and the UI) is handed to the
+WSGI ``service:app`` unchanged.
+
+Run it with uvicorn workers under gunicorn:
+
+    gunicorn -k uvicorn.workers.UvicornWorker service.asgi:app
+
+Paths:
+------
+GET /api/customers - Returns a page of Customers (filters, ?sort=&limit=&after=, ?stream=true for NDJSON, ?q= to search)
+HEAD /api/customers - Returns the number of Customers in X-Total-Count (also GET ?count=true)
+POST /api/customers - creates a new Customer record in the database
+GET /api/customers/{id} - Returns the Customer with a given id number
+(both GETs take ?fields=id,email,... to return and select only some fields)
+PUT /api/customers/{id} - updates a Customer record in the database
+DELETE /api/customers/{id} - deletes a Customer record in the database
+PUT /api/customers/{id}/deactivate - deactivates a Customer
+POST /api/customers/{id}/verify-password - checks the password of a Customer
+GET /api/customers/events - Streams Customer changes as they happen (Server-Sent Events)
+"""
+import asyncio
+import functools
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+from service import app as flask_app
+from service.common import queries, status
+from service.common.events import EVENTS_HEADERS, EVENTS_PREAMBLE, change_events, stream_messages
+from service.common.log_handlers import REQUEST_ID_HEADER, log_access, new_request_id, request_id
+from service.common.metrics import LATENCY, REQUESTS
+from service.common.passwords import PasswordHasherBusy
+from service.common.pool import async_database_uri, engine_options
+from service.common.serializers import dumps
+from service.common.singleflight import AsyncSingleFlight
+from service.models import (
+    Customer,
+    DataValidationError,
+    Tombstone,
+    delete_statement,
+    if_match_versions,
+    make_etag,
+    make_list_etag,
+    public_columns,
+    rehash_statement,
+    update_statement,
+)
+from service.routes import (
+    FILTER_ARGS,
+    SEARCH_CONFLICT,
+    customer_fieldset,
+    customer_rows,
+    event_message,
+    query_key,
+    search_conflicts,
+)
+
+table = Customer.__table__
+
+# Identical ?email= list queries in flight at once run once per worker
+email_queries = AsyncSingleFlight("email")
+
+# The async engine is not instrumented, so its access log has no database time
+access_logger = logging.getLogger(f"{flask_app.logger.name}.access")
+
+
+@asynccontextmanager
+async def lifespan(asgi_app):
+    """Creates the async engine of each worker and disposes of it on exit"""
+    config = flask_app.config
+    engine = create_async_engine(
+        async_database_uri(config["SQLALCHEMY_DATABASE_URI"]),
+        **engine_options(config, asyncio=True),
+    )
+    asgi_app.state.engine = engine
+    try:
+        yield
+    finally:
+        await engine.dispose()
+
+
+def observed(resource: str):
+    """Counts, times and logs a handler under the name of its WSGI Resource"""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            start = time.perf_counter()
+            token = request_id.set(new_request_id(request.headers.get(REQUEST_ID_HEADER)))
+            try:
+                response = await handler(request)
+                elapsed = time.perf_counter() - start
+                labels = (resource, request.method)
+                REQUESTS.labels(*labels, response.status_code).inc()
+                LATENCY.labels(*labels).observe(elapsed)
+                response.headers[REQUEST_ID_HEADER] = request_id.get()
+                if flask_app.config["ACCESS_LOG"]:
+                    log_access(
+                        access_logger,
+                        request_id=request_id.get(),
+                        method=request.method,
+                        path=request.url.path,
+                        route=resource,
+                        status=response.status_code,
+                        duration_ms=round(elapsed * 1000, 3),
+                    )
+                return response
+            finally:
+                request_id.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+######################################################################
+#  PATH: /api/customers/{id}
+######################################################################
+@observed("CustomerResource")
+async def get_customer(request):
+    """Returns a single Customer through the read cache"""
+    customer_id = request.path_params["customer_id"]
+    flask_app.logger.info("Request to Retrieve a customer with id [%s]", customer_id)
+    try:
+        serializer, columns = customer_fieldset(request.query_params.get("fields"))
+    except ValueError as error:
+        return _bad_request(error)
+    engine = request.app.state.engine
+    key = str(customer_id)
+    customer = Customer.cache.get(key)
+    if_none_match = parse_etags(request.headers.get("if-none-match"))
+    if if_none_match:
+        if customer is not None:
+            version = customer["version"]
+        else:
+            async with engine.connect() as conn:
+                version = await conn.scalar(select(table.c.version).where(table.c.id == customer_id))
+        if version is not None:
+            etag = make_etag(customer_id, version)
+            if if_none_match.contains_weak(etag):
+                return _not_modified(etag)
+
+    if customer is None:
+        # only a whole Customer is cached, and concurrent misses share one
+        # query; a sparse fieldset selects just its columns
+        if serializer is customer_rows:
+            customer = await Customer.async_lookups.do(key, functools.partial(_load_cached, engine, customer_id))
+        else:
+            customer = await _select_one(engine, select(*columns).where(table.c.id == customer_id))
+        if customer is None:
+            return _error(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
+    return _customer_response(customer, status.HTTP_200_OK, serializer=serializer)
+
+
+@observed("CustomerResource")
+async def update_customer(request):
+    """Updates a Customer from the posted body without reading it first"""
+    customer_id = request.path_params["customer_id"]
+    flask_app.logger.info("Request to Update a customer with id [%s]", customer_id)
+    try:
+        values = await _deserialize(request, password_required=False)
+    except DataValidationError as error:
+        return _bad_request(error)
+    except PasswordHasherBusy as error:
+        return _busy(error)
+    return await _update_in_place(
+        request, customer_id, values, f"Customer with id '{customer_id}' was not found."
+    )
+
+
+@observed("CustomerResource")
+async def delete_customer(request):
+    """Deletes a Customer"""
+    customer_id = request.path_params["customer_id"]
+    flask_app.logger.info("Request to Delete a customer with id [%s]", customer_id)
+    async with request.app.state.engine.begin() as conn:
+        deleted = (await conn.execute(delete_statement(customer_id))).one_or_none()
+        events = []
+        if deleted is not None:
+            await conn.execute(Tombstone.insert_statement(), [Tombstone.parameters(deleted)])
+            events = _publish("deleted", [{"id": deleted.id}])
+    Customer.events.deliver(events)
+    if deleted is not None:
+        Customer.invalidate(customer_id)
+        flask_app.logger.info("Customer with id [%s] was deleted", customer_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /api/customers/{id}/deactivate
+######################################################################
+@observed("DeactivateResource")
+async def deactivate_customer(request):
+    """Deactivates a Customer"""
+    customer_id = request.path_params["customer_id"]
+    flask_app.logger.info("Request to Deactivate a Customer")
+    return await _update_in_place(
+        request, customer_id, {"active": False}, f"Customer with id [{customer_id}] was not found.", "deactivated"
+    )
+
+
+######################################################################
+#  PATH: /api/customers/events
+######################################################################
+@observed("CustomerEvents")
+async def customer_events(_request):
+    """Streams Customer changes as Server-Sent Events
+
+    The stream waits on the event loop rather than holding a thread, so a
+    worker serves any number of subscribers.
+    """
+    flask_app.logger.info("Request to stream Customer events")
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = Customer.events.subscribe(wake=lambda: loop.call_soon_threadsafe(ready.set))
+    heartbeat = flask_app.config["EVENTS_HEARTBEAT_INTERVAL"]
+
+    async def stream():
+        try:
+            yield EVENTS_PREAMBLE
+            while True:
+                try:
+                    await asyncio.wait_for(ready.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+                ready.clear()
+                for message in stream_messages(subscription, subscription.take(), event_message):
+                    yield message
+                if subscription.dropped:
+                    break
+        finally:
+            Customer.events.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=EVENTS_HEADERS)
+
+
+######################################################################
+#  PATH: /api/customers/{id}/verify-password
+######################################################################
+@observed("PasswordResource")
+async def verify_password(request):
+    """Checks a Customer's password without blocking the event loop"""
+    customer_id = request.path_params["customer_id"]
+    flask_app.logger.info("Request to Verify the password of Customer [%s]", customer_id)
+    try:
+        password = (await _payload(request))["password"]
+    except (DataValidationError, KeyError, TypeError):
+        password = None
+    if not isinstance(password, str):
+        return _error(status.HTTP_400_BAD_REQUEST, "A password is required.")
+
+    engine = request.app.state.engine
+    async with engine.connect() as conn:
+        stmt = select(table.c.salt, table.c.password).where(table.c.id == customer_id)
+        row = (await conn.execute(stmt)).one_or_none()
+    if row is None:
+        return _error(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
+    hasher = Customer.hasher
+    try:
+        if not await run_in_threadpool(hasher.verify, password, row.salt, row.password):
+            return _error(status.HTTP_401_UNAUTHORIZED, "The password is wrong.")
+        if hasher.needs_rehash(row.password):
+            salt, encoded = await run_in_threadpool(hasher.hash, password)
+            async with engine.begin() as conn:
+                await conn.execute(rehash_statement(customer_id, salt, encoded))
+    except PasswordHasherBusy as error:
+        return _busy(error)
+    return Response(dumps({"id": str(customer_id), "verified": True}), media_type="application/json")
+
+
+######################################################################
+#  PATH: /api/customers
+######################################################################
+@observed("CustomerCollection")
+async def list_customers(request):
+    """Returns a page of the Customers, all of them as NDJSON, or their number"""
+    flask_app.logger.info("Request to list Customers...")
+    try:
+        args = _list_args(request.query_params)
+        serializer, columns = customer_fieldset(args["fields"])
+        queries.sort_key(args["sort"])
+    except (ValueError, DataValidationError) as error:
+        return _bad_request(error)
+    if args["q"] is not None:
+        return await _search(request, args, serializer, columns)
+    clauses = queries.filters(**{name: args[name] for name in FILTER_ARGS if args[name] not in (None, "")})
+    engine = request.app.state.engine
+    if args["count"] or request.method == "HEAD":
+        return await _count(engine, clauses)
+    try:
+        stmt = await _keyset_statement(engine, select(*columns).where(*clauses), args)
+    except DataValidationError as error:
+        return _bad_request(error)
+    if args["stream"]:
+        return StreamingResponse(
+            _ndjson(engine, stmt.execution_options(yield_per=flask_app.config["STREAM_BATCH_SIZE"]), serializer),
+            media_type="application/x-ndjson",
+        )
+    return await _page(request, stmt, args, serializer)
+
+
+@observed("CustomerCollection")
+async def create_customer(request):
+    """Creates a Customer from the posted body"""
+    flask_app.logger.info("Request to Create a Customer")
+    try:
+        values = await _deserialize(request, password_required=True)
+    except DataValidationError as error:
+        return _bad_request(error)
+    except PasswordHasherBusy as error:
+        return _busy(error)
+    async with request.app.state.engine.begin() as conn:
+        stmt = insert(table).values(**values).returning(*public_columns())
+        row = (await conn.execute(stmt)).one()
+        customer = dict(row._mapping)
+        events = _publish("created", [customer])
+    Customer.events.deliver(events)
+    Customer.invalidate(customer["id"])
+    flask_app.logger.info("Customer with new id [%s] created!", customer["id"])
+    location = request.url_for("customer", customer_id=customer["id"])
+    return _customer_response(customer, status.HTTP_201_CREATED, {"Location": str(location)})
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+async def _count(engine, clauses: list) -> Response:
+    """Returns the number of Customers that match the clauses in X-Total-Count"""
+    async with engine.connect() as conn:
+        total = await conn.scalar(queries.count_statement(clauses))
+    return Response(dumps({"count": total}), media_type="application/json", headers={"X-Total-Count": str(total)})
+
+
+async def _keyset_statement(engine, stmt, args: dict):
+    """Returns the statement sorted and started after the cursor, like queries.keyset_page()
+
+    Sorting by anything but the id needs the sort value of the cursor
+    Customer, so a cursor that was deleted raises a DataValidationError.
+    """
+    if args["after"] is not None:
+        value = None
+        if queries.sort_key(args["sort"])[0] is not table.c.id:
+            async with engine.connect() as conn:
+                value = await conn.scalar(queries.cursor_statement(args["sort"], args["after"]))
+            if value is None:
+                raise DataValidationError(
+                    f"Cursor Customer '{args['after']}' no longer exists; start again without after"
+                )
+        stmt = stmt.where(queries.after_clause(args["sort"], args["after"], value))
+    return stmt.order_by(*queries.order_by(args["sort"]))
+
+
+async def _page(request, stmt, args: dict, serializer) -> Response:
+    """Returns one page of the sorted statement with a Link to the next one"""
+    engine = request.app.state.engine
+    limit = min(args["limit"] or flask_app.config["DEFAULT_PAGE_SIZE"], flask_app.config["MAX_PAGE_SIZE"])
+    if_none_match = parse_etags(request.headers.get("if-none-match"))
+    if if_none_match:
+        async with engine.connect() as conn:
+            versions = stmt.with_only_columns(table.c.id, table.c.version).limit(limit)
+            etag = make_list_etag((await conn.execute(versions)).all())
+        if if_none_match.contains_weak(etag):
+            return _not_modified(etag)
+    page = functools.partial(_select_all, engine, stmt.limit(limit))
+    rows = await (email_queries.do(query_key(args, limit), page) if args["email"] else page())
+    flask_app.logger.info("[%s] Customers returned", len(rows))
+
+    headers = {"ETag": f'"{make_list_etag((row.id, row.version) for row in rows)}"'}
+    if len(rows) == limit:
+        cursor = rows[-1].id
+        next_url = request.url.include_query_params(limit=limit, after=cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+        headers["X-Next-Cursor"] = str(cursor)
+    return Response(serializer.dumps(rows), media_type="application/json", headers=headers)
+
+
+async def _search(request, args: dict, serializer, columns: list) -> Response:
+    """Returns the Customers that best match the ?q= search, like queries.search()"""
+    flask_app.logger.info("Searching for: %s", args["q"])
+    if search_conflicts(args):
+        return _error(status.HTTP_400_BAD_REQUEST, SEARCH_CONFLICT)
+    limit = min(args["limit"] or flask_app.config["SEARCH_LIMIT"], flask_app.config["MAX_PAGE_SIZE"])
+    engine = request.app.state.engine
+    dialect = engine.dialect.name
+    async with engine.connect() as conn:
+        if dialect in queries.DATABASE_SEARCH_DIALECTS:
+            await conn.execute(queries.search_threshold_statement())
+        else:
+            await _refresh_search_index(conn)
+        try:
+            stmt = queries.search_statement(args["q"], limit, columns, dialect)
+        except DataValidationError as error:
+            return _bad_request(error)
+        rows = (await conn.execute(stmt)).all()
+    flask_app.logger.info("[%s] Customers found", len(rows))
+    headers = {"ETag": f'"{make_list_etag((row.id, row.version) for row in rows)}"'}
+    return Response(serializer.dumps(rows), media_type="application/json", headers=headers)
+
+
+async def _refresh_search_index(conn):
+    """Rebuilds the in-process search index once the Customers changed, like queries.search()"""
+    generation = Customer.search_generation
+    fingerprint = (await conn.execute(queries.search_fingerprint_statement())).one()
+    key = (generation, tuple(fingerprint))
+    if Customer.search_index.key != key:
+        documents = (await conn.execute(queries.search_documents_statement())).all()
+        queries.rebuild_search_index(documents, key)
+
+
+async def _update_in_place(  # pylint: disable=too-many-arguments
+    request, customer_id: int, values: dict, not_found: str, kind: str = "updated"
+) -> Response:
+    """Updates a Customer with one UPDATE ... RETURNING, honoring If-Match"""
+    versions = if_match_versions(customer_id, parse_etags(request.headers.get("if-match")))
+    async with request.app.state.engine.begin() as conn:
+        row = (await conn.execute(update_statement(customer_id, values, versions))).one_or_none()
+        exists = row is not None or (
+            versions is not None
+            and await conn.scalar(select(table.c.id).where(table.c.id == customer_id)) is not None
+        )
+        events = [] if row is None else _publish(kind, [dict(row._mapping)])
+    Customer.events.deliver(events)
+    if row is None:
+        if exists:
+            return _error(
+                status.HTTP_412_PRECONDITION_FAILED,
+                f"Customer with id '{customer_id}' does not match the If-Match ETag.",
+            )
+        return _error(status.HTTP_404_NOT_FOUND, not_found)
+    Customer.invalidate(customer_id)
+    return _customer_response(dict(row._mapping), status.HTTP_200_OK)
+
+
+async def _load_cached(engine, customer_id: int) -> dict:
+    """Reads a whole Customer for the read cache, like Customer.find_cached()"""
+    generation = Customer.cache_generation
+    customer = await _select_one(engine, select(*public_columns()).where(table.c.id == customer_id))
+    if customer is not None:
+        Customer.cache_fill(customer_id, customer, generation)
+    return customer
+
+
+async def _select_one(engine, stmt) -> dict:
+    """Returns the column values of the one row a statement selects, or None"""
+    async with engine.connect() as conn:
+        row = (await conn.execute(stmt)).one_or_none()
+    return None if row is None else dict(row._mapping)
+
+
+async def _select_all(engine, stmt) -> list:
+    """Returns the rows a statement selects"""
+    async with engine.connect() as conn:
+        return (await conn.execute(stmt)).all()
+
+
+def _publish(kind: str, customers: list) -> list:
+    """Returns the events to deliver once the transaction commits
+
+    Like Customer.publish(), there are none while no subscriber could see
+    them, nor on Postgres, where the triggers of the table NOTIFY them.
+    """
+    if not customers or not Customer.events.listening or Customer.events.channel:
+        return []
+    return change_events(kind, customers)
+
+
+async def _deserialize(request, password_required: bool) -> dict:
+    """Returns the column values of the posted Customer
+
+    The password is hashed in a thread so the event loop keeps serving
+    other requests meanwhile.
+    """
+    data = await _payload(request)
+    customer = await run_in_threadpool(Customer().deserialize, data, password_required)
+    return customer.changes()
+
+
+async def _payload(request) -> dict:
+    """Returns the JSON body of a request"""
+    try:
+        return json.loads(await request.body())
+    except ValueError as error:
+        raise DataValidationError(f"Invalid JSON: {error}") from error
+
+
+def _list_args(params) -> dict:
+    """Validates the query arguments of the collection like customer_args"""
+    return {
+        "email": params.get("email"),
+        "first_name": params.get("first_name"),
+        "last_name": params.get("last_name"),
+        "active": _boolean(params, "active"),
+        "min_id": _integer(params, "min_id", minimum=0),
+        "max_id": _integer(params, "max_id", minimum=0),
+        "sort": params.get("sort", "id"),
+        "count": _boolean(params, "count") or False,
+        "q": params.get("q"),
+        "fields": params.get("fields"),
+        "limit": _integer(params, "limit", minimum=1),
+        "after": _integer(params, "after", minimum=0),
+        "stream": _boolean(params, "stream") or False,
+    }
+
+
+def _boolean(params, name: str) -> bool:
+    """Returns a boolean query argument like inputs.boolean, or None when it is missing"""
+    if name not in params:
+        return None
+    value = params[name].lower()
+    if value in ("true", "1", "yes", "on"):
+        return True
+    if value in ("false", "0", "no", "off"):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+def _integer(params, name: str, minimum: int) -> int:
+    """Returns an integer query argument, or None when it is missing"""
+    if name not in params:
+        return None
+    value = int(params[name])
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+
+async def _ndjson(engine, stmt, serializer):
+    """Yields each Customer row as one line of newline delimited JSON"""
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt)
+        async for row in result:
+            yield serializer.dumps_line(row)
+
+
+def _etag(customer: dict) -> str:
+    """Returns the (unquoted) entity tag of a serialized Customer"""
+    return make_etag(customer["id"], customer["version"])
+
+
+def _customer_response(customer: dict, code: int, headers: dict = None, serializer=customer_rows) -> Response:
+    """Returns a serialized Customer in the shape of customer_model, or of a sparse fieldset"""
+    headers = dict(headers or {}, ETag=f'"{_etag(customer)}"')
+    return Response(
+        dumps(serializer.from_mapping(customer)),
+        status_code=code,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _not_modified(etag: str) -> Response:
+    """Returns an empty 304 Not Modified response for an entity tag"""
+    flask_app.logger.info("Not modified: %s", etag)
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{etag}"'})
+
+
+def _error(code: int, message: str) -> Response:
+    """Logs errors and returns them like flask-restx abort()"""
+    flask_app.logger.error(message)
+    return Response(dumps({"message": message}), status_code=code, media_type="application/json")
+
+
+def _busy(error: Exception) -> Response:
+    """Returns a 503 like the PasswordHasherBusy handler of the WSGI app"""
+    message = str(error)
+    flask_app.logger.warning(message)
+    body = {"status": status.HTTP_503_SERVICE_UNAVAILABLE, "error": "Service Unavailable", "message": message}
+    return Response(
+        dumps(body),
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        media_type="application/json",
+        headers={"Retry-After": "1"},
+    )
+
+
+def _bad_request(error: Exception) -> Response:
+    """Returns a 400 like the DataValidationError handler of the WSGI app"""
+    message = str(error)
+    flask_app.logger.warning(message)
+    body = {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message}
+    return Response(dumps(body), status_code=status.HTTP_400_BAD_REQUEST, media_type="application/json")
+
+
+app = Starlette(
+    routes=[
+        Route("/api/customers", list_customers, methods=["GET"]),
+        Route("/api/customers", create_customer, methods=["POST"]),
+        Route("/api/customers/events", customer_events, methods=["GET"]),
+        Route("/api/customers/{customer_id:int}", get_customer, methods=["GET"], name="customer"),
+        Route("/api/customers/{customer_id:int}", update_customer, methods=["PUT"]),
+        Route("/api/customers/{customer_id:int}", delete_customer, methods=["DELETE"]),
+        Route("/api/customers/{customer_id:int}/deactivate", deactivate_customer, methods=["PUT"]),
+        Route("/api/customers/{customer_id:int}/verify-password", verify_password, methods=["POST"]),
+        # Everything else is served by the WSGI app in a thread pool
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
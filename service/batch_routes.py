@@ -0,0 +1,242 @@
+"""
+Batch Routes
+
+Paths:
+------
+POST /customers/batch - creates many Customer records in the database
+PUT /customers/batch - updates many Customer records in the database
+DELETE /customers/batch - deletes many Customer records in the database
+"""
+
+from flask import current_app as app  # Import Flask application
+from flask_restx import Resource, fields, reqparse, inputs
+from service.common import status  # HTTP Status Codes
+from service.common import bulk
+from service.models import Customer, DataValidationError
+from service.routes import abort, create_model
+
+from . import api
+
+batch_args = reqparse.RequestParser()
+batch_args.add_argument(
+    "atomic",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Apply all of the items or none of them",
+)
+batch_args.add_argument(
+    "chunk_size",
+    type=inputs.positive,
+    location="args",
+    required=False,
+    help="The number of items written and committed at a time",
+)
+
+update_model = api.inherit(
+    "CustomerUpdateModel",
+    create_model,
+    {
+        "id": fields.Integer(
+            required=True, description="The id of the Customer to update"
+        ),
+        "password": fields.String(
+            required=False, description="A new password, or leave out to keep the current one"
+        ),
+    },
+)
+
+batch_result_model = api.model(
+    "BatchResult",
+    {
+        "index": fields.Integer(description="The position of the item in the batch"),
+        "id": fields.Integer(description="The id of the Customer"),
+        "status": fields.Integer(description="The HTTP status of the item"),
+        "error": fields.String(description="Why the item was not applied"),
+    },
+)
+
+
+######################################################################
+#  PATH: /customers/batch
+######################################################################
+@api.route("/customers/batch")
+class CustomerBatch(Resource):
+    """
+    Handles bulk operations on many Customers at once
+
+    Every item gets its own result so one bad item does not fail the
+    whole batch, unless the caller asks for ?atomic=true.
+    """
+
+    # ------------------------------------------------------------------
+    # ADD MANY NEW CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc("create_customers_batch")
+    @api.expect(batch_args, [create_model])
+    @api.response(400, "The posted data was not valid")
+    @api.marshal_list_with(batch_result_model, code=207)
+    def post(self):
+        """
+        Creates many Customers
+
+        This endpoint will create a Customer for each item in the posted array
+        """
+        app.logger.info("Request to Create a batch of Customers")
+        args = batch_args.parse_args()
+        results, customers = [], []
+        for position, data in enumerate(_batch_payload()):
+            try:
+                customers.append((position, Customer().deserialize(data)))
+            except DataValidationError as error:
+                results.append(_batch_error(position, None, error))
+        _check_atomic(args, results)
+
+        outcomes = bulk.create_customers(
+            [customer for _, customer in customers], **_batch_options(args)
+        )
+        for (position, _), outcome in zip(customers, outcomes):
+            if isinstance(outcome, Exception):
+                results.append(_batch_error(position, None, outcome))
+            else:
+                results.append(_batch_result(position, outcome, status.HTTP_201_CREATED))
+        app.logger.info("Batch of [%s] Customers processed", len(results))
+        return _sorted(results), status.HTTP_207_MULTI_STATUS
+
+    # ------------------------------------------------------------------
+    # UPDATE MANY EXISTING CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc("update_customers_batch")
+    @api.expect(batch_args, [update_model])
+    @api.response(400, "The posted data was not valid")
+    @api.marshal_list_with(batch_result_model, code=207)
+    def put(self):
+        """
+        Updates many Customers
+
+        This endpoint will update the Customer named by the id of each item in the array
+        """
+        app.logger.info("Request to Update a batch of Customers")
+        args = batch_args.parse_args()
+        results, records = [], []
+        for position, data in enumerate(_batch_payload()):
+            try:
+                customer_id = _batch_id(data.get("id") if isinstance(data, dict) else None)
+                record = Customer().deserialize(data, password_required=False).changes()
+                record["id"] = customer_id
+                records.append((position, record))
+            except DataValidationError as error:
+                results.append(_batch_error(position, None, error))
+        _check_atomic(args, results)
+
+        outcomes = bulk.update_customers(
+            [record for _, record in records], **_batch_options(args)
+        )
+        for (position, record), outcome in zip(records, outcomes):
+            results.append(_batch_outcome(position, record["id"], outcome, status.HTTP_200_OK))
+        app.logger.info("Batch of [%s] Customers processed", len(results))
+        return _sorted(results), status.HTTP_207_MULTI_STATUS
+
+    # ------------------------------------------------------------------
+    # DELETE MANY CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc("delete_customers_batch")
+    @api.expect(batch_args)
+    @api.response(400, "The posted data was not valid")
+    @api.marshal_list_with(batch_result_model, code=207)
+    def delete(self):
+        """
+        Deletes many Customers
+
+        This endpoint will delete the Customers whose ids are in the posted array
+        """
+        app.logger.info("Request to Delete a batch of Customers")
+        args = batch_args.parse_args()
+        results, ids = [], []
+        for position, data in enumerate(_batch_payload()):
+            try:
+                ids.append((position, _batch_id(data)))
+            except DataValidationError as error:
+                results.append(_batch_error(position, None, error))
+        _check_atomic(args, results)
+
+        outcomes = bulk.delete_customers(
+            [customer_id for _, customer_id in ids], **_batch_options(args)
+        )
+        for (position, customer_id), outcome in zip(ids, outcomes):
+            results.append(
+                _batch_outcome(position, customer_id, outcome, status.HTTP_204_NO_CONTENT)
+            )
+        app.logger.info("Batch of [%s] Customers processed", len(results))
+        return _sorted(results), status.HTTP_207_MULTI_STATUS
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _batch_payload() -> list:
+    """Returns the JSON array posted to a batch endpoint"""
+    data = api.payload
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Batch requests must be a JSON array.")
+    if len(data) > app.config["MAX_BATCH_SIZE"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Batch of {len(data)} items exceeds the limit of {app.config['MAX_BATCH_SIZE']}.",
+        )
+    return data
+
+
+def _batch_id(value) -> int:
+    """Validates the Customer id of a batch item"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise DataValidationError(f"Invalid Customer id: {value!r}")
+    return value
+
+
+def _batch_options(args: dict) -> dict:
+    """Returns the chunking options of a batch request"""
+    return {
+        "chunk_size": args["chunk_size"] or app.config["BATCH_CHUNK_SIZE"],
+        "atomic": args["atomic"],
+    }
+
+
+def _check_atomic(args: dict, results: list):
+    """Rejects an atomic batch that has any invalid items"""
+    if args["atomic"] and results:
+        app.logger.warning("Atomic batch rejected with [%s] bad items", len(results))
+        api.abort(
+            status.HTTP_400_BAD_REQUEST,
+            "Atomic batch contained invalid items; nothing was applied.",
+            results=_sorted(results),
+        )
+
+
+def _batch_result(position: int, customer_id: int, code: int) -> dict:
+    """Returns the result of one batch item"""
+    return {"index": position, "id": customer_id, "status": code, "error": None}
+
+
+def _batch_error(position: int, customer_id, error: Exception) -> dict:
+    """Returns the result of a batch item that could not be applied"""
+    result = _batch_result(position, customer_id, status.HTTP_400_BAD_REQUEST)
+    result["error"] = str(error)
+    return result
+
+
+def _batch_outcome(position: int, customer_id: int, outcome, code: int) -> dict:
+    """Returns the result of a batch item from its bulk operation outcome"""
+    if isinstance(outcome, Exception):
+        return _batch_error(position, customer_id, outcome)
+    if not outcome:
+        result = _batch_result(position, customer_id, status.HTTP_404_NOT_FOUND)
+        result["error"] = f"Customer with id '{customer_id}' was not found."
+        return result
+    return _batch_result(position, customer_id, code)
+
+
+def _sorted(results: list) -> list:
+    """Returns batch results in the order the items were posted"""
+    return sorted(results, key=lambda result: result["index"])
@@ -0,0 +1,272 @@
+"""
+Bulk
+
+This module writes many Customers at once: the batch endpoints create,
+update and delete them one chunk per statement, and imports, exports and
+seeding move rows with COPY on Postgres. Every batch commits each chunk
+on its own unless it is atomic, retries a failing chunk one item at a
+time so only its bad items fail, and publishes the change events of the
+rows it wrote.
+"""
+import logging
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Values
+from service.models import (
+    CHANGE_FEED_LOCK,
+    CHANGE_SEQUENCE,
+    Customer,
+    DataValidationError,
+    Tombstone,
+    db,
+    public_columns,
+)
+
+logger = logging.getLogger("flask.app")
+
+
+@compiles(Values, "sqlite")
+def _values_sqlite(element, compiler, asfrom=False, from_linter=None, **kwargs):
+    """SQLite cannot name the columns of a VALUES list, so select them by
+    the names it gives them (column1, column2, ...)"""
+    values = compiler.visit_values(element, **kwargs)
+    if not asfrom:
+        return values
+    if from_linter:
+        from_linter.froms[element] = element.name
+    columns = ", ".join(
+        f"column{number} AS {compiler.preparer.quote(column.name)}"
+        for number, column in enumerate(element.columns, 1)
+    )
+    return f"(SELECT {columns} FROM ({values})) AS {compiler.preparer.quote(element.name)}"
+
+
+def _apply_in_chunks(operation, items: list, chunk_size: int, atomic: bool) -> list:
+    """Applies a bulk operation to a list of items one chunk at a time
+
+    ``operation`` receives a chunk and returns one outcome per item in it,
+    False for an item whose Customer was not found. Each chunk is
+    committed on its own, and a chunk that fails is applied again one item
+    at a time so only its bad items fail. In ``atomic`` mode the whole
+    batch is one transaction: an error or a Customer that was not found
+    rolls everything back and raises DataValidationError.
+
+    Returns the outcomes aligned with ``items``. The outcome of an item
+    that could not be applied is the error that was raised.
+    """
+    outcomes = []
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        try:
+            chunk_outcomes = operation(chunk)
+            if atomic:
+                _check_found(chunk_outcomes, start)
+            else:
+                db.session.commit()
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            logger.error("Batch chunk at %s failed: %s", start, error)
+            if atomic:
+                raise DataValidationError(f"Batch failed at item {start}: {error}") from error
+            chunk_outcomes = _apply_one_by_one(operation, chunk) if len(chunk) > 1 else [error]
+        outcomes.extend(chunk_outcomes)
+    if atomic:
+        db.session.commit()
+    return outcomes
+
+
+def _check_found(outcomes: list, start: int):
+    """Rolls back an atomic batch if the Customer of any item was not found"""
+    missing = [start + position for position, outcome in enumerate(outcomes) if outcome is False]
+    if missing:
+        db.session.rollback()
+        logger.warning("Atomic batch rolled back: item %s was not found", missing[0])
+        raise DataValidationError(f"The Customer of batch item {missing[0]} was not found; nothing was applied.")
+
+
+def _apply_one_by_one(operation, chunk: list) -> list:
+    """Applies and commits each item of a failed chunk on its own"""
+    outcomes = []
+    for item in chunk:
+        try:
+            outcomes.extend(operation([item]))
+            db.session.commit()
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            outcomes.append(error)
+    return outcomes
+
+
+def create_customers(customers: list, chunk_size: int = 1000, atomic: bool = False) -> list:
+    """Creates many Customers with one multi-row INSERT per chunk
+
+    :param customers: the Customers to create
+    :param chunk_size: the number of rows inserted and committed at a time
+    :param atomic: commit all of the Customers or none of them
+
+    :return: the new id of each Customer, or the error of its chunk
+    :type: list
+
+    """
+    logger.info("Bulk creating %s Customers", len(customers))
+
+    def insert(chunk):
+        for customer in chunk:
+            customer.id = None
+        db.session.add_all(chunk)
+        db.session.flush()
+        Customer.publish("created", [customer.serialize() for customer in chunk])
+        return [customer.id for customer in chunk]
+
+    outcomes = _apply_in_chunks(insert, customers, chunk_size, atomic)
+    Customer.invalidate(*(outcome for outcome in outcomes if isinstance(outcome, int)))
+    return outcomes
+
+
+def update_customers(records: list, chunk_size: int = 1000, atomic: bool = False) -> list:
+    """Updates many Customers with one UPDATE ... FROM VALUES per chunk
+
+    :param records: dictionaries of column values, each with an "id"
+    :param chunk_size: the number of rows updated and committed at a time
+    :param atomic: commit all of the updates or none of them
+
+    :return: whether each Customer was found, or the error of its chunk
+    :type: list
+
+    """
+    logger.info("Bulk updating %s Customers", len(records))
+
+    def update(chunk):
+        updated = update_rows(chunk)
+        Customer.publish("updated", updated)
+        found = {row["id"] for row in updated}
+        return [record["id"] in found for record in chunk]
+
+    outcomes = _apply_in_chunks(update, records, chunk_size, atomic)
+    Customer.invalidate(*(record["id"] for record, outcome in zip(records, outcomes) if outcome is True))
+    return outcomes
+
+
+def update_rows(records: list) -> list:
+    """Updates Customers from rows of column values without committing them
+
+    Records with the same keys are updated by one statement.
+
+    :param records: dictionaries of column values, each with an "id"
+
+    :return: the public columns of every Customer that was updated
+    :type: list
+
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(tuple(record), []).append(record)
+    updated = []
+    for group in groups.values():
+        updated += db.session.execute(_update_statement(group)).mappings().all()
+    return [dict(row) for row in updated]
+
+
+def _update_statement(records: list):
+    """Returns the UPDATE ... RETURNING statement of records with the same keys
+
+    The new values are joined to the rows they change as a VALUES
+    list, so the whole chunk is one statement that returns the public
+    columns of every updated Customer.
+    """
+    table = Customer.__table__
+    names = list(records[0])
+    changes = db.values(
+        *(db.column(name, table.c[name].type) for name in names), name="changes"
+    ).data([tuple(record[name] for name in names) for record in records])
+    return (
+        db.update(table)
+        .where(table.c.id == changes.c.id)
+        .values(
+            version=table.c.version + 1,
+            **{name: changes.c[name] for name in names if name != "id"},
+        )
+        .returning(*public_columns())
+    )
+
+
+def delete_customers(ids: list, chunk_size: int = 1000, atomic: bool = False) -> list:
+    """Deletes many Customers with one DELETE ... RETURNING per chunk
+
+    :param ids: the ids of the Customers to delete
+    :param chunk_size: the number of rows deleted and committed at a time
+    :param atomic: commit all of the deletes or none of them
+
+    :return: whether each Customer was found, or the error of its chunk
+    :type: list
+
+    """
+    logger.info("Bulk deleting %s Customers", len(ids))
+
+    def delete(chunk):
+        stmt = db.delete(Customer).where(Customer.id.in_(chunk)).returning(Customer.id, Customer.change_seq)
+        rows = db.session.execute(stmt).all()
+        if rows:
+            db.session.execute(Tombstone.insert_statement(), [Tombstone.parameters(row) for row in rows])
+            Customer.publish("deleted", [{"id": row.id} for row in rows])
+        deleted = {row.id for row in rows}
+        return [by_id in deleted for by_id in chunk]
+
+    outcomes = _apply_in_chunks(delete, ids, chunk_size, atomic)
+    Customer.invalidate(*(by_id for by_id, outcome in zip(ids, outcomes) if outcome is True))
+    return outcomes
+
+
+def copy_from(rows: list):
+    """Inserts rows of column values without committing them
+
+    Postgres loads them with one COPY ... FROM STDIN; other databases
+    with one executemany INSERT. Column defaults are not applied by
+    COPY, so every row must have the same keys, in the same order:
+    every column but id and the change columns.
+
+    :param rows: dictionaries of column values
+
+    """
+    logger.info("Copying %s Customers in", len(rows))
+    table = Customer.__table__
+    if db.engine.dialect.name != "postgresql":
+        db.session.execute(db.insert(table), rows)
+        return
+    # COPY does not evaluate the change_seq default, so number the rows first
+    db.session.execute(db.select(db.func.pg_advisory_xact_lock_shared(CHANGE_FEED_LOCK)))
+    numbers = db.session.scalars(
+        db.select(CHANGE_SEQUENCE.next_value()).select_from(db.func.generate_series(1, len(rows)))
+    ).all()
+    names = [*rows[0], "change_seq"]
+    cursor = db.session.connection().connection.cursor()
+    with cursor.copy(f"COPY {table.name} ({', '.join(names)}) FROM STDIN") as copy:
+        for row, number in zip(rows, numbers):
+            copy.write_row([*row.values(), number])
+
+
+def supports_copy() -> bool:
+    """Returns True if the database can dump with copy_to()"""
+    return db.engine.dialect.name == "postgresql"
+
+
+def copy_to(stmt, file):
+    """Writes the rows of a SELECT to a binary file as CSV with a header
+
+    Postgres streams them out with COPY (...) TO STDOUT, so no row is
+    turned into a Python object. Only for databases that supports_copy().
+
+    :param stmt: the SELECT of the rows
+    :param file: the binary file to write to
+
+    :return: the number of rows written
+    :type: int
+
+    """
+    logger.info("Copying Customers out")
+    sql = stmt.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    cursor = db.session.connection().connection.cursor()
+    with cursor.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+        for data in copy:
+            file.write(data)
+    return cursor.rowcount
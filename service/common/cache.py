@@ -0,0 +1,183 @@
+"""
+Cache
+
+This module contains the read-through cache used for single Customer
+lookups. Every backend implements the same small interface so the
+in-process LRU can be swapped for a shared cache (Redis) by configuration.
+"""
+import abc
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("flask.app")
+
+
+class CacheStats:
+    """Counters that show how well a cache is sized"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def as_dict(self) -> dict:
+        """Returns the counters as a dictionary"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+class Cache(abc.ABC):
+    """The interface of every cache backend"""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    @abc.abstractmethod
+    def get(self, key: str, default=None):
+        """Returns the value stored under key, or the default on a miss"""
+
+    @abc.abstractmethod
+    def set(self, key: str, value):
+        """Stores a value under key"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Removes key from the cache"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Removes every key from the cache"""
+
+    def info(self) -> dict:
+        """Returns the counters and size of the cache"""
+        return {"backend": type(self).__name__, **self.stats.as_dict()}
+
+
+class NullCache(Cache):
+    """A cache that never stores anything, used when caching is disabled"""
+
+    def get(self, key: str, default=None):
+        self.stats.misses += 1
+        return default
+
+    def set(self, key: str, value):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(Cache):
+    """An in-process least recently used cache with a time to live
+
+    Entries older than ``ttl`` seconds are treated as misses and the least
+    recently used entry is evicted once ``max_size`` entries are stored.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self) -> dict:
+        return {**super().info(), "size": len(self._entries), "max_size": self.max_size}
+
+
+class SharedCache(Cache):
+    """A cache shared by every worker, stored in a Redis compatible client
+
+    The client only needs ``get``, ``set(ex=)``, ``delete`` and
+    ``scan_iter``, so tests can pass a local fake. Values are stored as
+    JSON under ``prefix`` and expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, client, ttl: float = 30.0, prefix: str = "customers:"):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str, default=None):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def delete(self, key: str):
+        if self.client.delete(self.prefix + key):
+            self.stats.invalidations += 1
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+def create_cache(config) -> Cache:
+    """Creates the cache backend named by CACHE_TYPE in the configuration"""
+    cache_type = config.get("CACHE_TYPE", "lru").lower()
+    ttl = config.get("CACHE_TTL", 30.0)
+    logger.info("Using %s cache", cache_type)
+    if cache_type == "none":
+        return NullCache()
+    if cache_type == "lru":
+        return LRUCache(config.get("CACHE_MAX_SIZE", 10000), ttl)
+    if cache_type == "redis":
+        try:
+            import redis  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise RuntimeError("CACHE_TYPE=redis requires the redis package") from error
+        return SharedCache(redis.Redis.from_url(config["CACHE_REDIS_URL"]), ttl)
+    raise RuntimeError(f"Unknown CACHE_TYPE: {cache_type}")
@@ -1,8 +1,12 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+import time
+import click
+from flask import current_app as app
+from service import blueprint
+from service.common import jobs, queries, seeding
+from service.models import db, Customer, create_notify_triggers
 
 
 ######################################################################
@@ -10,7 +14,7 @@ from service.models import db
 # Usage:
 #   flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@blueprint.cli.command("db-create")
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -19,3 +23,150 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the missing tables and indexes, once per deploy
+# Usage:
+#   flask db-init
+######################################################################
+@blueprint.cli.command("db-init")
+def db_init():
+    """
+    Creates the tables, indexes and (on Postgres) event triggers that are missing, keeping the data.
+    Run it before starting workers with DB_CREATE_TABLES=false.
+    """
+    inspector = db.inspect(db.engine)
+    missing = [table.name for table in db.metadata.sorted_tables if not inspector.has_table(table.name)]
+    db.create_all()
+    db.session.commit()
+    create_notify_triggers()
+    click.echo(f"Created tables: {', '.join(missing)}" if missing else "All tables are present")
+
+
+######################################################################
+# Command to fill the database with fake Customers
+# Usage:
+#   flask db-seed [--count 1000000] [--chunk-size 10000] [--workers 4]
+######################################################################
+@blueprint.cli.command("db-seed")
+@click.option("--count", type=click.IntRange(min=1), default=1000, help="Customers to insert")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, help="Rows per COPY or INSERT")
+@click.option("--workers", type=click.IntRange(min=1), default=4, help="Chunks loaded at the same time")
+@click.option("--password", default=None, help="Password of every Customer (default: none can log in)")
+@click.option("--seed", type=int, default=None, help="Random seed for repeatable Customers")
+def db_seed(count, chunk_size, workers, password, seed):
+    """
+    Inserts fake Customers for load tests and staging, with COPY on
+    Postgres and multi-row INSERTs elsewhere
+    """
+    started = time.perf_counter()
+    inserted = seeding.seed_customers(
+        app._get_current_object(), count, chunk_size, workers, password, seed  # pylint: disable=protected-access
+    )
+    click.echo(f"Seeded {inserted} Customers{_throughput(inserted, started)}")
+
+
+######################################################################
+# Commands to export and import Customers to and from files
+# Usage:
+#   flask db-export FILE [--format csv|ndjson]
+#   flask db-import FILE [--format csv|ndjson]
+######################################################################
+@blueprint.cli.command("db-export")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(list(jobs.MEDIA_TYPES)), default="csv", help="File format")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, help="Rows read at a time")
+def db_export(path, fmt, chunk_size):
+    """
+    Writes every Customer to a CSV or NDJSON file that db-import and
+    POST /api/customers/imports read back
+    """
+    started = time.perf_counter()
+    exported = jobs.export_file(path, fmt, {}, chunk_size)
+    click.echo(f"Exported {exported} Customers to {path}{_throughput(exported, started)}")
+
+
+@blueprint.cli.command("db-import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(list(jobs.MEDIA_TYPES)), default="csv", help="File format")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, help="Rows loaded at a time")
+def db_import(path, fmt, chunk_size):
+    """
+    Loads the Customers of a CSV or NDJSON file, rejecting bad rows like
+    POST /api/customers/imports does; rows with the id of an existing
+    Customer update it and keep its password
+    """
+    started = time.perf_counter()
+    processed, rejected, errors = jobs.import_file(path, fmt, chunk_size)
+    for error in errors:
+        click.echo(f"Rejected {error}", err=True)
+    loaded = processed - rejected
+    click.echo(f"Imported {loaded} Customers, rejected {rejected}{_throughput(processed, started)}")
+    if rejected:
+        raise click.exceptions.Exit(1)
+
+
+######################################################################
+# Command to check the indexes that the hot queries rely on
+# Usage:
+#   flask db-check-indexes [--create]
+######################################################################
+@blueprint.cli.command("db-check-indexes")
+@click.option("--create", is_flag=True, help="Create the missing indexes")
+def db_check_indexes(create):
+    """
+    Reports declared indexes that are missing from the database and
+    prints the query plans of the hot Customer queries
+    """
+    missing = queries.missing_indexes()
+    for index in missing:
+        click.echo(f"Missing index: {index.name}")
+        if create:
+            index.create(db.engine)
+            click.echo(f"Created index: {index.name}")
+    if not missing:
+        click.echo("All indexes are present")
+
+    hot_queries = {
+        "find by id": Customer.query.filter(Customer.id == 1),
+        "find by email": Customer.find_by_email("someone@example.com"),
+        "find by full name": Customer.find_by_full_name("Jane Doe"),
+        "keyset page": Customer.query.filter(Customer.id > 1).order_by(Customer.id).limit(100),
+        "search": queries.search_statement("jane", 20, [Customer.id], db.engine.dialect.name),
+    }
+    for name, query in hot_queries.items():
+        click.echo(f"EXPLAIN {name}:")
+        for line in queries.explain(query):
+            click.echo(f"  {line}")
+
+    if missing and not create:
+        raise click.exceptions.Exit(1)
+
+
+######################################################################
+# Command to run the queued import and export jobs
+# Usage:
+#   flask jobs-worker [--once] [--poll SECONDS]
+######################################################################
+@blueprint.cli.command("jobs-worker")
+@click.option("--once", is_flag=True, help="Exit once no job is queued")
+@click.option("--poll", type=float, default=None, help="Seconds between looks for new jobs")
+def jobs_worker(once, poll):
+    """
+    Runs queued import and export jobs, for deployments that keep them
+    out of the web processes (JOB_WORKERS=0)
+    """
+    poll = app.config["JOB_POLL_INTERVAL"] if poll is None else poll
+    while True:
+        for job in jobs.run_pending():
+            click.echo(f"Job {job.id} ({job.kind}) {job.status}: {job.processed} processed, {job.rejected} rejected")
+        if once:
+            return
+        time.sleep(poll)
+
+
+def _throughput(rows: int, started: float) -> str:
+    """Returns how long rows took since started and the rows per second"""
+    elapsed = time.perf_counter() - started
+    return f" in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)"
@@ -17,22 +17,23 @@
 """
 Module: error_handlers
 """
-from flask import jsonify
+from flask import current_app as app, jsonify
 from service.models import DataValidationError
-from service import app
+from service.common.passwords import PasswordHasherBusy
+from service import api, blueprint
 from . import status
 
 
 ######################################################################
 # Error Handlers
 ######################################################################
-@app.errorhandler(DataValidationError)
+@blueprint.app_errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
     return bad_request(error)
 
 
-@app.errorhandler(status.HTTP_400_BAD_REQUEST)
+@blueprint.app_errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
     message = str(error)
@@ -45,7 +46,18 @@ def bad_request(error):
     )
 
 
-@app.errorhandler(status.HTTP_404_NOT_FOUND)
+@blueprint.app_errorhandler(status.HTTP_401_UNAUTHORIZED)
+def unauthorized(error):
+    """Handles failed password checks with 401_UNAUTHORIZED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_401_UNAUTHORIZED, error="Unauthorized", message=message),
+        status.HTTP_401_UNAUTHORIZED,
+    )
+
+
+@blueprint.app_errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
     message = str(error)
@@ -56,7 +68,7 @@ def not_found(error):
     )
 
 
-@app.errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
+@blueprint.app_errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
 def method_not_supported(error):
     """Handles unsupported HTTP methods with 405_METHOD_NOT_SUPPORTED"""
     message = str(error)
@@ -71,7 +83,7 @@ def method_not_supported(error):
     )
 
 
-@app.errorhandler(status.HTTP_409_CONFLICT)
+@blueprint.app_errorhandler(status.HTTP_409_CONFLICT)
 def resource_conflict(error):
     """Handles resource conflicts with HTTP_409_CONFLICT"""
     message = str(error)
@@ -86,7 +98,22 @@ def resource_conflict(error):
     )
 
 
-@app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+@blueprint.app_errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles failed conditional requests with HTTP_412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
+@blueprint.app_errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
     message = str(error)
@@ -101,7 +128,25 @@ def mediatype_not_supported(error):
     )
 
 
-@app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
+# Registered on the Api so flask-restx answers it itself instead of
+# turning it into a 500 when exceptions are not propagated
+@api.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Handles an overloaded password hasher with 503_SERVICE_UNAVAILABLE"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": message,
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": "1"},
+    )
+
+
+@blueprint.app_errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
     message = str(error)
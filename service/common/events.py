@@ -0,0 +1,289 @@
+"""
+Events
+
+This module fans Customer change events out to the subscribers of
+``GET /api/customers/events`` (Server-Sent Events). Each process keeps one
+EventBroker; every subscriber has a buffer of EVENTS_BUFFER_SIZE events
+and is dropped, rather than slowing the writers down, once it falls that
+far behind. A dropped client reconnects and catches up from the change
+feed.
+
+On Postgres triggers on the customer table NOTIFY the events of each
+statement as part of it, so every process sees the events of every other
+process and writers make no round trip of their own. Each process
+listens on one connection of its own, opened by its first subscriber,
+however many subscribers it has, and holds a shared advisory lock on it;
+the triggers send nothing while no connection holds that lock. Elsewhere
+events only reach the subscribers of the process that made them.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "customer_events"
+LISTEN_RETRY_SECONDS = 1.0
+# Held (shared) by every listening connection, so the triggers can tell
+LISTEN_LOCK_KEY = 4242001
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7999
+
+# The first message tells clients how long to wait before reconnecting;
+# proxies must neither cache nor buffer the stream
+EVENTS_PREAMBLE = b"retry: 3000\n\n"
+HEARTBEAT = b": keep-alive\n\n"
+DROPPED_EVENT = b"event: dropped\ndata: {}\n\n"
+EVENTS_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class Subscription:
+    """The buffer of events waiting to be sent to one subscriber
+
+    The broker offers events from its threads; the subscriber takes them
+    from its own thread, or from an event loop that ``wake`` notifies.
+    """
+
+    def __init__(self, size: int, wake=None):
+        self.size = size
+        self.dropped = False
+        self._wake = wake
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def offer(self, event: dict) -> bool:
+        """Buffers an event, or drops the subscriber if the buffer is full"""
+        with self._lock:
+            if self.dropped:
+                return False
+            if len(self._events) >= self.size:
+                self.dropped = True
+            else:
+                self._events.append(event)
+        self._ready.set()
+        if self._wake is not None:
+            self._wake()
+        return not self.dropped
+
+    def take(self) -> list:
+        """Returns the buffered events and empties the buffer"""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            self._ready.clear()
+        return events
+
+    def wait(self, timeout: float) -> list:
+        """Waits up to timeout seconds for events and returns them"""
+        self._ready.wait(timeout)
+        return self.take()
+
+
+class EventBroker:
+    """Delivers events to the subscribers of this process"""
+
+    channel = None  # events are not sent through the database
+
+    def __init__(self, buffer_size: int = 1000):
+        self.buffer_size = buffer_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, wake=None) -> Subscription:
+        """Returns a new Subscription to every event from now on"""
+        subscription = Subscription(self.buffer_size, wake)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stops buffering events for a Subscription"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def deliver(self, events: list):
+        """Offers events to every subscriber, dropping those that fell behind"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for event in events:
+            for subscription in subscriptions:
+                if subscription.offer(event):
+                    self.delivered += 1
+                elif subscription in self._subscriptions:
+                    logger.warning("Dropping a slow event subscriber")
+                    self.dropped += 1
+                    self.unsubscribe(subscription)
+
+    @property
+    def listening(self) -> bool:
+        """Whether events published now could reach a subscriber"""
+        return bool(self._subscriptions)
+
+    def info(self) -> dict:
+        """Returns the subscriber and delivery counters"""
+        return {
+            "subscribers": len(self._subscriptions),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "channel": self.channel,
+        }
+
+
+class NotifyBroker(EventBroker):
+    """Receives the events of every process through Postgres LISTEN/NOTIFY
+
+    The triggers of the customer table NOTIFY the channel; one thread per
+    process LISTENs on a connection of its own and delivers what arrives
+    to the subscribers.
+    """
+
+    channel = CHANNEL
+
+    def __init__(self, connect, buffer_size: int = 1000):
+        super().__init__(buffer_size)
+        self._connect = connect
+        self._listener = None
+
+    def subscribe(self, wake=None) -> Subscription:
+        """Returns a new Subscription, listening on the first one"""
+        subscription = super().subscribe(wake)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="event-listener", daemon=True)
+                self._listener.start()
+        return subscription
+
+    def _listen(self):
+        """Delivers the notifications of the channel until the process exits"""
+        while True:
+            try:
+                connection = self._connect()
+                try:
+                    connection.autocommit = True
+                    connection.execute(f"LISTEN {self.channel}")
+                    connection.execute(f"SELECT pg_advisory_lock_shared({LISTEN_LOCK_KEY})")
+                    logger.info("Listening for events on %s", self.channel)
+                    for notify in connection.notifies():
+                        self.deliver([json.loads(notify.payload)])
+                finally:
+                    connection.close()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Lost the event listener connection")
+            time.sleep(LISTEN_RETRY_SECONDS)
+
+
+def create_broker(config: dict, dialect: str, connect) -> EventBroker:
+    """Returns the broker of the configuration
+
+    :param dialect: the name of the database dialect
+    :param connect: returns a new DBAPI connection that is not pooled
+
+    """
+    buffer_size = config.get("EVENTS_BUFFER_SIZE", 1000)
+    if dialect == "postgresql":
+        return NotifyBroker(connect, buffer_size)
+    return EventBroker(buffer_size)
+
+
+def notify_triggers(table: str) -> list:
+    """Returns the statements that make the triggers that NOTIFY the events of a table
+
+    Each statement sends the events of the rows it changed, as one
+    notification per row, unless no connection is listening. Updates that
+    keep the change sequence number, like password rehashes, are not
+    changes. Events too long to NOTIFY are sent without their Customer.
+    """
+    customer = ", ".join(
+        f"'{name}', ($2).{name}" for name in ("id", "first_name", "last_name", "email", "address", "active", "version")
+    )
+    return [
+        f"""CREATE OR REPLACE FUNCTION {table}_event(text, {table}) RETURNS text LANGUAGE sql IMMUTABLE AS $$
+            SELECT CASE WHEN octet_length(event) > {MAX_PAYLOAD_BYTES}
+                THEN json_build_object('type', $1, 'id', ($2).id, 'version', ($2).version, 'customer', NULL)::text
+                ELSE event END
+            FROM (SELECT json_build_object(
+                'type', $1, 'id', ($2).id, 'version', ($2).version, 'customer', json_build_object({customer})
+            )::text AS event) AS events
+        $$""",
+        f"""CREATE OR REPLACE FUNCTION {table}_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT FROM pg_locks
+                WHERE locktype = 'advisory' AND classid = 0 AND objid = {LISTEN_LOCK_KEY} AND objsubid = 1
+                AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ) THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify('{CHANNEL}', {table}_event('created', new_row)) FROM new_rows AS new_row;
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM pg_notify('{CHANNEL}', {table}_event(
+                    CASE WHEN old_row.active AND NOT new_row.active THEN 'deactivated' ELSE 'updated' END, new_row
+                ))
+                FROM new_rows AS new_row JOIN old_rows AS old_row ON old_row.id = new_row.id
+                WHERE new_row.change_seq <> old_row.change_seq;
+            ELSE
+                PERFORM pg_notify(
+                    '{CHANNEL}',
+                    json_build_object('type', 'deleted', 'id', old_row.id, 'version', NULL, 'customer', NULL)::text
+                ) FROM old_rows AS old_row;
+            END IF;
+            RETURN NULL;
+        END
+        $$""",
+        f"DROP TRIGGER IF EXISTS {table}_notify_insert ON {table}",
+        f"""CREATE TRIGGER {table}_notify_insert AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify()""",
+        f"DROP TRIGGER IF EXISTS {table}_notify_update ON {table}",
+        f"""CREATE TRIGGER {table}_notify_update AFTER UPDATE ON {table}
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify()""",
+        f"DROP TRIGGER IF EXISTS {table}_notify_delete ON {table}",
+        f"""CREATE TRIGGER {table}_notify_delete AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify()""",
+    ]
+
+
+def change_events(kind: str, customers: list) -> list:
+    """Returns the events of a change to Customers
+
+    :param kind: "created", "updated", "deactivated" or "deleted"
+    :param customers: the public column values of each Customer, or just
+        its "id" once deleted
+
+    """
+    return [
+        {
+            "type": kind,
+            "id": customer["id"],
+            "version": customer.get("version"),
+            "customer": None if kind == "deleted" else customer,
+        }
+        for customer in customers
+    ]
+
+
+def stream_messages(subscription: Subscription, events: list, message) -> list:
+    """Returns what an event stream sends once it stopped waiting for events
+
+    That is a message per event, then the dropped event that ends the
+    stream of a subscriber that fell behind, or a keep-alive comment when
+    the wait timed out without events.
+
+    :param message: returns the message of an event
+    """
+    messages = [message(event) for event in events]
+    if subscription.dropped:
+        messages.append(DROPPED_EVENT)
+    elif not events:
+        messages.append(HEARTBEAT)
+    return messages
+
+
+def format_event(event: dict, data: bytes) -> bytes:
+    """Returns an event as a Server-Sent Events message"""
+    return b"event: " + event["type"].encode() + b"\ndata: " + data + b"\n\n"
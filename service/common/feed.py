@@ -0,0 +1,92 @@
+"""
+Feed
+
+This module reads the change feed of GET /api/customers/changes: every
+Customer changed after a change sequence number, in order, each at its
+latest change. Deleted Customers appear as their tombstones, so a client
+that syncs from the feed also learns what to remove.
+"""
+import logging
+from service.models import CHANGE_FEED_LOCK, CHANGE_SEQUENCE, Customer, Tombstone, db
+
+logger = logging.getLogger("flask.app")
+
+
+def changes_since(since: int, limit: int, columns: list) -> list:
+    """Returns the changes made after a change sequence number, in order
+
+    Each Customer appears once, at its latest change: a row of its
+    columns or a tombstone (deleted is true and only the id is set).
+    Rows that share the last sequence number are all returned, even
+    past the limit, so the next page can start after that number.
+
+    :param since: the change_seq of the last change already seen
+    :param limit: the number of changes to return (or a few more)
+    :param columns: the Customer columns to return
+
+    :return: rows of the columns, then seq, changed_at and deleted
+    :type: list
+
+    """
+    logger.info("Processing changes since %s ...", since)
+    ceiling = _committed_seq() if db.engine.dialect.name == "postgresql" else None
+    rows = db.session.execute(_changes_statement(since, columns, limit, ceiling)).all()
+    db.session.commit()
+    return rows
+
+
+def _committed_seq() -> int:
+    """Returns a change sequence number that every smaller one has committed
+
+    Postgres writers draw numbers under a shared advisory lock that they
+    hold until they commit, so they may commit out of order. Taking the
+    lock exclusively waits for the writers in flight, and every number
+    drawn by then has committed. The lock is released before the changes
+    are read, so writers only wait for as long as that takes, never for
+    the read itself.
+    """
+    last = db.select(db.column("last_value")).select_from(db.table(CHANGE_SEQUENCE.name)).scalar_subquery()
+    ceiling = db.session.scalar(db.select(last).select_from(db.func.pg_advisory_xact_lock(CHANGE_FEED_LOCK)))
+    db.session.commit()  # releases the lock
+    return ceiling
+
+
+def _changes_statement(since: int, columns: list, limit: int, ceiling: int = None):
+    """Returns the SELECT of changes_since()
+
+    The last sequence number of the first ``limit`` changes (up to the
+    ceiling, if given) bounds the changes selected, so the rows that
+    share it come in the same statement.
+    """
+    page = _numbered(since, columns, ceiling).order_by("seq", "id").limit(limit).subquery()
+    bound = db.select(db.func.max(page.c.seq).label("seq")).cte("last_change")
+    last = db.select(bound.c.seq).scalar_subquery()
+    return _numbered(since, columns, last).order_by("seq", "id")
+
+
+def _numbered(since: int, columns: list, last=None):
+    """Returns the UNION of the changed Customers and the tombstones numbered
+    after since, and up to last if it is given"""
+    table, tombstones = Customer.__table__, Tombstone.__table__
+
+    def numbered(seq):
+        return seq > since if last is None else (seq > since) & (seq <= last)
+
+    changed = db.select(
+        *columns,
+        table.c.change_seq.label("seq"),
+        table.c.updated_at.label("changed_at"),
+        db.false().label("deleted"),
+    ).where(numbered(table.c.change_seq))
+    deleted = db.select(
+        *(
+            tombstones.c.customer_id.label("id")
+            if column.name == "id"
+            else db.cast(db.null(), column.type).label(column.name)
+            for column in columns
+        ),
+        tombstones.c.change_seq.label("seq"),
+        tombstones.c.deleted_at.label("changed_at"),
+        db.true().label("deleted"),
+    ).where(numbered(tombstones.c.change_seq))
+    return db.union_all(changed, deleted)
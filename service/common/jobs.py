@@ -0,0 +1,449 @@
+"""
+Jobs
+
+This module runs bulk imports and exports of Customers in the background
+so they do not tie up the web workers. A job is a row of the job table
+(models.Job): the web process that accepts a request queues it, and
+whichever process claims it first runs it and records its progress for
+``GET /api/jobs/{id}``. There is no broker: jobs are run by JOB_WORKERS
+threads in each web process and by any ``flask jobs-worker`` processes,
+which all share JOB_DIR for the files.
+
+Imports read their file one row at a time, validate each row with
+Customer.deserialize() and load JOB_CHUNK_SIZE rows at a time, committing
+and reporting progress after every chunk. A row with the id of an
+existing Customer updates it in place; the others are new Customers,
+inserted with COPY on Postgres. Exports never carry passwords, so an
+export imported back into the same database leaves every password as it
+was, while one imported elsewhere creates Customers who cannot log in. CSV
+exports are dumped with COPY on Postgres; other exports are written in
+keyset ordered chunks of JOB_CHUNK_SIZE rows. import_file() and
+export_file() are also used by ``flask db-import`` and ``flask db-export``.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from sqlalchemy.exc import SQLAlchemyError
+from service.common.passwords import UNUSABLE_PASSWORD, PasswordHasherBusy
+from service.common.serializers import dumps
+from service.common import bulk, queries
+from service.models import Customer, DataValidationError, Job, db
+
+logger = logging.getLogger("flask.app")
+
+# The formats of import and export files and their media types
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+FORMATS = {media_type: fmt for fmt, media_type in MEDIA_TYPES.items()}
+
+# The columns written by exports, which imports read back
+EXPORT_COLUMNS = ("id", "first_name", "last_name", "email", "address", "active")
+
+# The columns that COPY would otherwise reject a whole chunk over
+TEXT_COLUMNS = ("first_name", "last_name", "email", "address")
+
+MAX_ERRORS = 100  # rejected rows described in a job's errors
+BUSY_RETRY_SECONDS = 0.1  # wait before hashing again when the hasher is busy
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+BOOLEANS = {"true": True, "t": True, "1": True, "yes": True, "false": False, "f": False, "0": False, "no": False}
+
+
+class JobRunner:
+    """Runs queued jobs in background threads of a web process
+
+    The threads are started by the first job queued in the process, so
+    none are started before gunicorn forks its workers. They also look for
+    jobs queued by other processes every JOB_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Runs the jobs of a Flask app"""
+        self.app = app
+
+    def notify(self):
+        """Wakes the threads up to run a new job, starting them on first use"""
+        if self.app is None or self.app.config["JOB_WORKERS"] <= 0:
+            return
+        with self._lock:
+            while len(self._threads) < self.app.config["JOB_WORKERS"]:
+                thread = threading.Thread(
+                    target=self._run, name=f"job-runner-{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        self._wakeup.set()
+
+    def stop(self):
+        """Stops the threads once they have finished their current jobs"""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            for thread in self._threads:
+                thread.join()
+            self._threads.clear()
+        self._stopping.clear()
+
+    def _run(self):
+        """Runs queued jobs whenever woken up, until stopped"""
+        while True:
+            self._wakeup.wait(self.app.config["JOB_POLL_INTERVAL"])
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                return
+            with self.app.app_context():
+                try:
+                    run_pending()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("The job runner failed")
+                finally:
+                    db.session.remove()
+
+
+runner = JobRunner()
+
+
+def init_jobs(app):
+    """Runs the jobs queued through a Flask app in its threads"""
+    runner.init_app(app)
+
+
+def queue_import(stream, fmt: str) -> Job:
+    """Saves an uploaded file and queues the job that imports it
+
+    :param stream: the binary stream of the upload
+    :param fmt: "csv" or "ndjson"
+
+    """
+    path = _job_path("import", fmt)
+    try:
+        with open(path, "wb") as file:
+            shutil.copyfileobj(stream, file, UPLOAD_CHUNK_BYTES)
+    except BaseException:
+        _remove(path)
+        raise
+    job = Job(kind="import", format=fmt, path=path, params={})
+    job.create()
+    runner.notify()
+    return job
+
+
+def queue_export(fmt: str, criteria: dict) -> Job:
+    """Queues the job that exports the Customers that match queries.filters() criteria
+
+    :param fmt: "csv" or "ndjson"
+    :param criteria: the keyword arguments of queries.filters()
+
+    """
+    job = Job(kind="export", format=fmt, path=_job_path("export", fmt), params=criteria)
+    job.create()
+    runner.notify()
+    return job
+
+
+def run_pending() -> list:
+    """Claims and runs queued jobs until none is left
+
+    :return: the jobs that were run
+    :type: list
+
+    """
+    jobs = []
+    while True:
+        job = Job.claim()
+        if job is None:
+            return jobs
+        run_job(job)
+        jobs.append(job)
+
+
+def run_job(job: Job):
+    """Runs a claimed job and records how it ended"""
+    logger.info("Running %s job %s", job.kind, job.id)
+    try:
+        if job.kind == "import":
+            _import(job)
+        else:
+            _export(job)
+    except Exception as error:  # pylint: disable=broad-except
+        logger.exception("Job %s failed", job.id)
+        db.session.rollback()
+        job.finish("failed", str(error))
+    else:
+        job.finish("succeeded")
+
+
+######################################################################
+#  I M P O R T S
+######################################################################
+def _import(job: Job):
+    """Loads the Customers of an import job's file"""
+    job.progress(*import_file(job.path, job.format, runner_config("JOB_CHUNK_SIZE"), job.progress))
+
+
+def import_file(path: str, fmt: str, chunk_size: int, progress=None) -> tuple:
+    """Loads the Customers of a CSV or NDJSON file, chunk_size rows at a time
+
+    Bad rows are rejected and described in the errors without stopping
+    the import. Only one chunk of rows is held in memory at a time.
+
+    :param progress: called with the processed and rejected counts and
+        the errors so far after every chunk is committed
+
+    :return: the processed and rejected counts and the first errors
+    :type: tuple
+
+    """
+    processed = rejected = 0
+    errors, chunk = [], []
+    for line, data in _read_rows(path, fmt):
+        processed += 1
+        try:
+            chunk.append((line, *_customer_values(data, fmt)))
+        except DataValidationError as error:
+            rejected += 1
+            _add_error(errors, f"line {line}: {error}")
+        if processed % chunk_size == 0:
+            rejected += _load(chunk, errors)
+            if progress:
+                progress(processed, rejected, errors)
+    rejected += _load(chunk, errors)
+    return processed, rejected, errors
+
+
+def _load(chunk: list, errors: list) -> int:
+    """Loads a chunk of (line, id, values) rows and empties it
+
+    Rows with the id of an existing Customer update it, keeping its
+    password unless the row has one; the other rows are inserted as new
+    Customers. A chunk that fails to load is rolled back as a whole.
+
+    :return: the number of rows that were rejected
+    :type: int
+
+    """
+    if not chunk:
+        return 0
+    rejected = 0
+    try:
+        records = [dict(values, id=by_id) for _, by_id, values in chunk if by_id is not None]
+        updated = {row["id"] for row in bulk.update_rows(records)}
+        rows = [_insert_values(values) for _, by_id, values in chunk if by_id not in updated]
+        if rows:
+            bulk.copy_from(rows)
+        db.session.commit()
+    except (SQLAlchemyError, db.engine.dialect.dbapi.Error) as error:
+        db.session.rollback()
+        logger.error("Import chunk at line %s failed: %s", chunk[0][0], error)
+        rejected = len(chunk)
+        _add_error(errors, f"lines {chunk[0][0]}-{chunk[-1][0]}: {error}")
+    else:
+        Customer.invalidate(*updated)
+    chunk.clear()
+    return rejected
+
+
+def _read_rows(path: str, fmt: str):
+    """Yields the line number and raw row of every row of an import file
+
+    CSV rows are dictionaries; NDJSON rows are the text of their line.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if fmt == "csv":
+            reader = csv.DictReader(file)
+            for data in reader:
+                yield reader.line_num, data
+        else:
+            for line, text in enumerate(file, start=1):
+                if text.strip():
+                    yield line, text
+
+
+def _customer_values(data, fmt: str) -> tuple:
+    """Returns the Customer id, or None, and the column values of one row
+    of an import file
+
+    The values only have a salt and password if the row has a password.
+    """
+    if fmt == "csv":
+        data = dict(data, active=_csv_boolean(data.get("active")))
+        if not data.get("password"):
+            data["password"] = None
+    else:
+        try:
+            data = json.loads(data)
+        except ValueError as error:
+            raise DataValidationError(f"Invalid JSON: {error}") from error
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid Customer: not a JSON object")
+        if "active" in data and not isinstance(data["active"], bool):
+            raise DataValidationError("Invalid Customer: active must be true or false")
+    by_id = _row_id(data.get("id"))
+    values = _deserialize(data).changes()
+    for name in TEXT_COLUMNS:
+        if not isinstance(values[name], str):
+            raise DataValidationError(f"Invalid Customer: {name} must be a string")
+    return by_id, values
+
+
+def _insert_values(values: dict) -> dict:
+    """Returns the column values of a new Customer from those of an imported row
+
+    Rows without a password get one that never matches until it is set.
+    """
+    values = dict(values)
+    if "password" not in values:
+        values.update(salt="", password=UNUSABLE_PASSWORD)
+    values["version"] = 1
+    return values
+
+
+def _row_id(value):
+    """Returns the Customer id of an imported row, or None if it has none"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise DataValidationError(f"Invalid Customer: id must be an integer, not {value!r}")
+
+
+def _deserialize(data: dict) -> Customer:
+    """Deserializes a Customer, waiting for the password hasher when it is busy"""
+    while True:
+        try:
+            return Customer().deserialize(data, password_required=False)
+        except PasswordHasherBusy:
+            time.sleep(BUSY_RETRY_SECONDS)
+
+
+def _csv_boolean(value: str) -> bool:
+    """Returns the boolean of a CSV field"""
+    if value is None:
+        raise DataValidationError("Invalid Customer: missing active")
+    try:
+        return BOOLEANS[value.strip().lower()]
+    except KeyError as error:
+        raise DataValidationError(f"Invalid Customer: active must be true or false, not {value!r}") from error
+
+
+######################################################################
+#  E X P O R T S
+######################################################################
+def _export(job: Job):
+    """Writes the Customers that match an export job's criteria to its file"""
+    job.total = queries.count(queries.filters(**job.params))
+    db.session.commit()
+    processed = export_file(
+        job.path,
+        job.format,
+        job.params,
+        runner_config("JOB_CHUNK_SIZE"),
+        lambda processed: job.progress(processed, 0, []),
+    )
+    job.progress(processed, 0, [])
+
+
+def export_file(path: str, fmt: str, criteria: dict, chunk_size: int, progress=None) -> int:
+    """Writes the Customers that match queries.filters() criteria to a file
+
+    The file is written next to its path and renamed into place once it
+    is complete. Only one chunk of rows is held in memory at a time.
+
+    :param progress: called with the number of Customers written after
+        every chunk but the last
+
+    :return: the number of Customers written
+    :type: int
+
+    """
+    table = Customer.__table__
+    clauses = queries.filters(**criteria)
+    partial = f"{path}.part"
+    with open(partial, "wb") as file:
+        if fmt == "csv" and bulk.supports_copy():
+            columns = [table.c[name] for name in EXPORT_COLUMNS]
+            columns[EXPORT_COLUMNS.index("active")] = db.cast(table.c.active, db.Text).label("active")
+            processed = bulk.copy_to(db.select(*columns).where(*clauses).order_by(table.c.id), file)
+        else:
+            processed = _write_chunks(fmt, clauses, chunk_size, file, progress)
+    os.replace(partial, path)
+    return processed
+
+
+def _write_chunks(fmt: str, clauses: list, chunk_size: int, file, progress) -> int:
+    """Writes the Customers to a file in keyset ordered chunks
+
+    Every chunk is its own short query, so progress can be committed
+    between chunks without holding a cursor open.
+
+    :return: the number of Customers written
+    :type: int
+
+    """
+    table = Customer.__table__
+    stmt = db.select(*(table.c[name] for name in EXPORT_COLUMNS)).where(*clauses)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+    processed, after = 0, None
+    while True:
+        page = stmt if after is None else stmt.where(table.c.id > after)
+        rows = db.session.execute(page.order_by(table.c.id).limit(chunk_size)).all()
+        for row in rows:
+            if fmt == "csv":
+                writer.writerow([*row[:-1], "true" if row.active else "false"])
+            else:
+                buffer.write(dumps(dict(row._mapping)).decode() + "\n")
+        file.write(buffer.getvalue().encode())
+        buffer.seek(0)
+        buffer.truncate()
+        processed += len(rows)
+        if len(rows) < chunk_size:
+            return processed
+        after = rows[-1].id
+        if progress:
+            progress(processed)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def runner_config(name: str):
+    """Returns a setting of the app that runs the jobs"""
+    return runner.app.config[name]
+
+
+def _job_path(kind: str, fmt: str) -> str:
+    """Returns a new file name in JOB_DIR"""
+    directory = runner_config("JOB_DIR")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{kind}-{uuid.uuid4().hex}.{fmt}")
+
+
+def _remove(path: str):
+    """Removes a file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _add_error(errors: list, message: str):
+    """Describes a rejected row, up to MAX_ERRORS of them"""
+    if len(errors) < MAX_ERRORS:
+        errors.append(message)
@@ -19,18 +19,198 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+Records are formatted as text or, with LOG_FORMAT=json, as one JSON
+object per line, and handed to a background thread that writes them, so
+a request never waits on the log's I/O. Every record logged while a
+request is served carries its request id (the X-Request-ID header, or a
+new one), and LOG_SAMPLE_RATE keeps that share of the requests' info
+records; warnings and errors are always kept. ACCESS_LOG adds one line
+per request with its route, status, duration and database time.
 """
 import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import current_app, g, request
+from service.common import metrics
+from service.common.serializers import dumps
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# The fields of access log records that JSON lines include
+ACCESS_FIELDS = ("request_id", "method", "path", "route", "status", "duration_ms", "db_ms", "db_queries")
+
+# The id of the request being served, in its thread or task
+request_id = ContextVar("request_id", default=None)
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in gunicorn_logger.handlers:
         handler.setFormatter(formatter)
+    for handler in app.logger.handlers:
+        if isinstance(handler, BackgroundHandler):
+            handler.close()  # of an app made before this one
+    app.logger.handlers = []
+    if gunicorn_logger.handlers:
+        handler = BackgroundHandler(gunicorn_logger.handlers)
+        handler.addFilter(RequestIdFilter())
+        handler.addFilter(SamplingFilter(app.config.get("LOG_SAMPLE_RATE", 1.0)))
+        app.logger.handlers = [handler]
+    app.logger.setLevel(gunicorn_logger.level)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
     app.logger.info("Logging handler established")
+
+
+def new_request_id(header: str = None) -> str:
+    """Returns the id of a request: the one it was sent with, or a new one"""
+    if header and len(header) <= 200:
+        return header
+    return uuid.uuid4().hex
+
+
+def log_access(logger, **fields):
+    """Logs the access log line of a request
+
+    Server errors are logged as errors, so they are never sampled out.
+    """
+    level = logging.ERROR if fields["status"] >= 500 else logging.INFO
+    logger.log(level, "%s %s %s", fields["method"], fields["path"], fields["status"], extra=fields)
+
+
+######################################################################
+#  H A N D L E R S   A N D   F I L T E R S
+######################################################################
+class BackgroundHandler(QueueHandler):
+    """Hands records to a thread that writes them to other handlers
+
+    The thread starts with the first record of each process, so every
+    worker forked from a gunicorn --preload master gets one of its own.
+    Closing the handler writes out the records still queued.
+    """
+
+    def __init__(self, handlers: list):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = list(handlers)
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        """Starts the writer thread of this process"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()  # not the records of the parent
+            self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def close(self):
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+        super().close()
+
+
+class RequestIdFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Adds the id of the request being served to its records"""
+
+    def filter(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Keeps a share of the records below WARNING
+
+    Records of a request are kept or dropped together, by its id.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        key = getattr(record, "request_id", None)
+        if key is None:
+            return random.random() < self.rate
+        return zlib.crc32(key.encode()) < self.rate * 2**32
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for field in ACCESS_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return dumps(data).decode()
+
+
+######################################################################
+#  H O O K S
+######################################################################
+def _start_request():
+    request_id.set(new_request_id(request.headers.get(REQUEST_ID_HEADER)))
+
+
+def _finish_request(response):
+    response.headers[REQUEST_ID_HEADER] = request_id.get()
+    if current_app.config.get("ACCESS_LOG"):
+        log_access(
+            logging.getLogger(f"{current_app.logger.name}.access"),
+            request_id=request_id.get(),
+            method=request.method,
+            path=request.path,
+            route=metrics.resource_name(),
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - g.request_start) * 1000, 3),
+            db_ms=round(g.db_seconds * 1000, 3),
+            db_queries=g.db_queries,
+        )
+    return response
+
+
+def _end_request(error=None):  # pylint: disable=unused-argument
+    # Not reset with a token: a streamed response tears its request down twice
+    request_id.set(None)
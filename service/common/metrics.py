@@ -0,0 +1,233 @@
+"""
+Metrics
+
+This module collects Prometheus metrics for every request: count and
+latency per resource and method, plus the number of SQL statements, the
+time spent in SQL and the time spent serializing Customers. It also
+counts the queries coalesced into one already in flight and times each
+phase of starting a worker.
+
+Resource methods declare the most SQL statements they may execute with
+@query_budget(n). A request over its budget, or one that executes the same
+statement more than DB_QUERY_REPEAT_LIMIT times (an N+1 query), is logged
+and counted; with DB_QUERY_BUDGET_ENFORCE, as in the tests, it raises
+QueryBudgetExceeded instead. In debug mode, or with DB_QUERY_HEADERS, the
+number of statements is returned in the X-DB-Queries header (their time
+is in Server-Timing, see profiling.py).
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR so every worker writes its
+samples to a shared directory and /metrics aggregates all of them.
+"""
+import collections
+import logging
+import os
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+LABELS = ["resource", "method"]
+
+logger = logging.getLogger("flask.app")
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request executes more SQL statements than it may"""
+
+
+REQUESTS = Counter(
+    "customer_http_requests_total",
+    "HTTP requests by resource, method and status",
+    LABELS + ["status"],
+)
+LATENCY = Histogram(
+    "customer_http_request_duration_seconds",
+    "HTTP request latency by resource and method",
+    LABELS,
+)
+DB_QUERIES = Histogram(
+    "customer_db_queries_per_request",
+    "SQL statements executed per request",
+    LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+DB_DURATION = Histogram(
+    "customer_db_duration_seconds",
+    "Time spent executing SQL per request",
+    LABELS,
+)
+SERIALIZATION_DURATION = Histogram(
+    "customer_serialization_duration_seconds",
+    "Time spent serializing Customers per request",
+    LABELS,
+)
+
+COALESCED_QUERIES = Counter(
+    "customer_coalesced_queries_total",
+    "Queries answered by a query already in flight instead of the database",
+    ["query"],
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    "customer_query_budget_exceeded_total",
+    "Requests that executed more SQL statements than their budget, or repeated one",
+    LABELS,
+)
+STARTUP_DURATION = Histogram(
+    "customer_startup_duration_seconds",
+    "Time each phase of starting a worker took",
+    ["phase"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+def init_metrics(app):
+    """Registers the request hooks that collect the metrics"""
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.after_request(_check_queries)
+    app.teardown_request(_observe_request)
+
+
+def instrument_engine(engine):
+    """Counts and times the SQL statements that an engine executes"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def query_budget(queries: int):
+    """Declares the most SQL statements a Resource method may execute"""
+
+    def decorator(method):
+        method.query_budget = queries
+        return method
+
+    return decorator
+
+
+@contextmanager
+def serialization():
+    """Adds the time spent in the block to the request's serialization time"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.serialize_seconds = g.get("serialize_seconds", 0.0) + time.perf_counter() - start
+
+
+def observe_startup(phases: dict):
+    """Records how long each phase of starting this worker took"""
+    for phase, seconds in phases.items():
+        STARTUP_DURATION.labels(phase).observe(seconds)
+    STARTUP_DURATION.labels("total").observe(sum(phases.values()))
+
+
+def render() -> tuple:
+    """Returns the metrics of every worker in the Prometheus text format"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def resource_name() -> str:
+    """Returns the flask-restx Resource (or view) that handled the request"""
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None:
+        return "unmatched"
+    view_class = getattr(view, "view_class", None)
+    return view.__name__ if view_class is None else view_class.__name__
+
+
+######################################################################
+#  H O O K S
+######################################################################
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.db_statements = collections.Counter()
+    g.serialize_seconds = 0.0
+
+
+def _record_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+def _check_queries(response):
+    config = current_app.config
+    if current_app.debug or config["DB_QUERY_HEADERS"]:
+        response.headers["X-DB-Queries"] = str(g.db_queries)
+    problems = []
+    budget = _query_budget()
+    if budget is not None and g.db_queries > budget:
+        problems.append(f"{g.db_queries} SQL statements, over its budget of {budget}")
+    for statement, repeats in g.db_statements.most_common(1):
+        if repeats > config["DB_QUERY_REPEAT_LIMIT"]:
+            problems.append(f"the same statement {repeats} times (N+1?): {statement[:200]}")
+    if problems:
+        message = f"{request.method} {request.path} executed " + " and ".join(problems)
+        if config["DB_QUERY_BUDGET_ENFORCE"]:
+            raise QueryBudgetExceeded(message)
+        QUERY_BUDGET_EXCEEDED.labels(resource_name(), request.method).inc()
+        logger.warning(message)
+    return response
+
+
+def _query_budget():
+    """Returns the query budget of the Resource method that handled the request"""
+    view = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view, "view_class", None)
+    if view_class is not None:
+        method = request.method.lower()
+        if method == "head" and not hasattr(view_class, "head"):
+            method = "get"
+        view = getattr(view_class, method, None)
+    return getattr(view, "query_budget", None)
+
+
+def _observe_request(error=None):
+    if "request_start" not in g:
+        return
+    status = g.get("response_status", 500 if error else 200)
+    labels = (resource_name(), request.method)
+    REQUESTS.labels(*labels, status).inc()
+    LATENCY.labels(*labels).observe(time.perf_counter() - g.request_start)
+    DB_QUERIES.labels(*labels).observe(g.db_queries)
+    DB_DURATION.labels(*labels).observe(g.db_seconds)
+    SERIALIZATION_DURATION.labels(*labels).observe(g.serialize_seconds)
+
+
+def _before_cursor_execute(  # pylint: disable=too-many-arguments, unused-argument
+    conn, cursor, statement, parameters, context, executemany
+):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(  # pylint: disable=too-many-arguments, unused-argument
+    conn, cursor, statement, parameters, context, executemany
+):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+        g.db_statements[statement] += 1
+
+
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
@@ -0,0 +1,183 @@
+"""
+Passwords
+
+This module hashes Customer passwords with a slow, salted key derivation
+function from hashlib (scrypt or PBKDF2-SHA256) and checks them in
+constant time.
+
+Hashing is CPU heavy on purpose, so it runs in a small bounded thread
+pool: hashlib releases the GIL while it derives a key, the pool caps how
+many cores hashing can take away from the request workers, and requests
+beyond the queue limit are turned away with PasswordHasherBusy instead
+of piling up behind each other.
+
+Hashes are stored as ``<algorithm>$<cost parameters>$<hex digest>`` next
+to the salt, so the cost can be raised later and old hashes upgraded the
+next time their password is verified.
+"""
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+ALGORITHMS = ("scrypt", "pbkdf2_sha256")
+SALT_BYTES = 16
+KEY_BYTES = 32
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Stored instead of a hash for Customers imported without a password; no
+# password ever matches it
+UNUSABLE_PASSWORD = "!"
+
+
+class PasswordHasherBusy(Exception):
+    """Used when too many passwords are waiting to be hashed"""
+
+
+def _derive(password: str, salt: str, algorithm: str, params: list) -> str:
+    """Returns the hex digest of a password under an algorithm and its parameters"""
+    if algorithm == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(
+            password.encode(),
+            salt=bytes.fromhex(salt),
+            n=n,
+            r=r,
+            p=p,
+            maxmem=256 * n * r * p + 2**20,
+            dklen=KEY_BYTES,
+        ).hex()
+    if algorithm == "pbkdf2_sha256":
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), bytes.fromhex(salt), iterations, KEY_BYTES
+        ).hex()
+    raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+
+
+def cost_params(algorithm: str, cost: int) -> list:
+    """Returns the parameters of an algorithm for a cost (scrypt N or iterations)"""
+    if algorithm == "scrypt":
+        return [cost, SCRYPT_R, SCRYPT_P]
+    if algorithm == "pbkdf2_sha256":
+        return [cost]
+    raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+
+
+def hash_password(password: str, salt: str, algorithm: str, cost: int) -> str:
+    """Returns the encoded hash of a password
+
+    :param password: the password in clear text
+    :param salt: the hex encoded salt
+    :param algorithm: "scrypt" or "pbkdf2_sha256"
+    :param cost: the scrypt N or the number of PBKDF2 iterations
+
+    """
+    params = cost_params(algorithm, cost)
+    digest = _derive(password, salt, algorithm, params)
+    return "$".join([algorithm, *map(str, params), digest])
+
+
+def check_password(password: str, salt: str, encoded: str) -> bool:
+    """Returns True if a password matches its salt and encoded hash
+
+    A hash without parameters is a plain sha256(salt + password) digest,
+    the format clients stored before the service hashed passwords itself.
+    """
+    if encoded == UNUSABLE_PASSWORD:
+        return False
+    if "$" not in encoded:
+        expected = hashlib.sha256(salt.encode() + password.encode()).hexdigest()
+        return hmac.compare_digest(expected, encoded)
+    algorithm, *params, digest = encoded.split("$")
+    expected = _derive(password, salt, algorithm, [int(param) for param in params])
+    return hmac.compare_digest(expected, digest)
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords in a bounded thread pool
+
+    At most ``workers`` passwords are hashed at once and at most
+    ``queue_size`` more wait for a worker; any more raise
+    PasswordHasherBusy right away, as does a hash that is not done
+    within ``timeout`` seconds.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        algorithm: str = "scrypt",
+        cost: int = 2**14,
+        workers: int = 2,
+        queue_size: int = 32,
+        timeout: float = 30.0,
+    ):
+        self.algorithm = algorithm
+        self.cost = cost
+        self.workers = workers
+        self.timeout = timeout
+        self.prefix = "$".join([algorithm, *map(str, cost_params(algorithm, cost))]) + "$"
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password: str) -> tuple:
+        """Returns a new random salt and the encoded hash of a password"""
+        salt = os.urandom(SALT_BYTES).hex()
+        return salt, self._run(hash_password, password, salt, self.algorithm, self.cost)
+
+    def verify(self, password: str, salt: str, encoded: str) -> bool:
+        """Returns True if a password matches its salt and encoded hash"""
+        return self._run(check_password, password, salt, encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """Returns True if a hash was made with another algorithm or cost"""
+        return not encoded.startswith(self.prefix)
+
+    def info(self) -> dict:
+        """Returns the settings of the hasher"""
+        return {"algorithm": self.algorithm, "cost": self.cost, "workers": self.workers}
+
+    def _run(self, function, *args):
+        """Runs a hashing function in the pool and waits for its result"""
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many passwords are being hashed, try again later")
+        try:
+            future = self._pool().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError as error:
+            raise PasswordHasherBusy("Hashing the password timed out, try again later") from error
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """Returns the thread pool, starting it on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hasher"
+                )
+            return self._executor
+
+
+def create_hasher(config) -> PasswordHasher:
+    """Returns the password hasher described by the configuration
+
+    PASSWORD_HASH_ALGORITHM selects scrypt (cost PASSWORD_SCRYPT_N) or
+    pbkdf2_sha256 (cost PASSWORD_PBKDF2_ITERATIONS).
+    """
+    algorithm = config["PASSWORD_HASH_ALGORITHM"]
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+    cost = config["PASSWORD_SCRYPT_N"] if algorithm == "scrypt" else config["PASSWORD_PBKDF2_ITERATIONS"]
+    return PasswordHasher(
+        algorithm,
+        cost,
+        workers=config["PASSWORD_HASH_WORKERS"],
+        queue_size=config["PASSWORD_HASH_QUEUE"],
+        timeout=config["PASSWORD_HASH_TIMEOUT"],
+    )
@@ -0,0 +1,120 @@
+"""
+Connection Pool
+
+This module builds the SQLAlchemy engine options from the configuration
+and provides a connection pool that measures how long requests wait to
+check out a connection.
+"""
+import logging
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+logger = logging.getLogger("flask.app")
+
+# The asyncio driver to use for each synchronous database driver
+ASYNC_DRIVERS = {
+    "postgresql": "psycopg",
+    "sqlite": "aiosqlite",
+}
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records checkout wait times and timeouts"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.checkout_wait_total += waited
+                self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns the database URI with the asyncio driver of its backend
+
+    psycopg 3 serves both modes, so a ``postgresql+psycopg`` URI is used
+    as is; SQLite is switched to aiosqlite.
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver is known for {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(
+        hide_password=False
+    )
+
+
+def engine_options(config, asyncio: bool = False) -> dict:
+    """Returns the SQLAlchemy engine options described by the configuration
+
+    Pool sizing only applies to server databases; SQLite keeps the
+    Flask-SQLAlchemy defaults. With DB_PGBOUNCER the pooling is left to
+    PgBouncer (NullPool) and psycopg prepared statements are disabled,
+    because transaction pooling hands each transaction a different server
+    connection. An ``asyncio`` engine keeps SQLAlchemy's own async queue
+    pool, since TimedQueuePool cannot hand connections to coroutines.
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite":
+        return {}
+
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    connect_args = {}
+    if config["DB_PGBOUNCER"]:
+        options["poolclass"] = NullPool
+        connect_args["prepare_threshold"] = None
+        if config["DB_STATEMENT_TIMEOUT"]:
+            logger.warning("DB_STATEMENT_TIMEOUT is ignored behind PgBouncer; set it on the database role")
+    else:
+        if not asyncio:
+            options["poolclass"] = TimedQueuePool
+        options.update(
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+            pool_recycle=config["DB_POOL_RECYCLE"],
+        )
+        if config["DB_STATEMENT_TIMEOUT"]:
+            connect_args["options"] = f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def pool_stats(pool) -> dict:
+    """Returns the size, usage and checkout wait counters of a pool"""
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            checkouts=pool.checkouts,
+            checkout_timeouts=pool.checkout_timeouts,
+            checkout_wait_seconds_total=round(pool.checkout_wait_total, 6),
+            checkout_wait_seconds_max=round(pool.checkout_wait_max, 6),
+        )
+    return stats
@@ -0,0 +1,111 @@
+"""
+Profiling
+
+This module breaks requests into phases and profiles single requests.
+
+In debug mode, or with SERVER_TIMING, every response carries a
+Server-Timing header with the time its request spent executing SQL (db),
+serializing Customers and encoding JSON (serialize), in the rest of the
+handler, marshalling included (app), and in total.
+
+With PROFILE_TOKEN set, a request sent with ?_profile=1 and the header
+``Authorization: Bearer <PROFILE_TOKEN>`` runs under cProfile. Its stats
+are written to PROFILE_DIR as ``<request id>.prof`` (open them with
+pstats or snakeviz), the slowest functions are logged, and the response
+names the file in an X-Profile header. Without the token the parameter is
+ignored.
+
+Neither registers a hook unless it is turned on, so they cost nothing
+when they are off. Streamed responses are only timed and profiled up to
+their first byte.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import time
+from flask import current_app, g, request
+from service.common.log_handlers import request_id
+
+logger = logging.getLogger("flask.app")
+
+PROFILE_PARAM = "_profile"
+PROFILE_HEADER = "X-Profile"
+
+# Functions logged from the stats of a profiled request
+PROFILE_TOP = 25
+
+
+def init_profiling(app):
+    """Registers the request hooks that are turned on"""
+    if app.debug or app.config["SERVER_TIMING"]:
+        app.after_request(_server_timing)
+    if app.config["PROFILE_TOKEN"]:
+        app.before_request(_start_profile)
+        app.after_request(_stop_profile)
+        app.teardown_request(_end_profile)
+
+
+def server_timing(phases: dict) -> str:
+    """Returns the seconds of each phase as a Server-Timing header"""
+    return ", ".join(f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in phases.items())
+
+
+def authorized(token: str) -> bool:
+    """Returns whether the request carries the profiling token"""
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+######################################################################
+#  H O O K S
+######################################################################
+def _server_timing(response):
+    if "request_start" not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    phases = {"db": g.db_seconds, "serialize": g.serialize_seconds}
+    phases["app"] = max(total - sum(phases.values()), 0.0)
+    phases["total"] = total
+    response.headers.add("Server-Timing", server_timing(phases))
+    return response
+
+
+def _start_profile():
+    if request.args.get(PROFILE_PARAM) != "1":
+        return
+    if not authorized(current_app.config["PROFILE_TOKEN"]):
+        logger.warning("Ignoring %s=1 of %s %s without the profiling token", PROFILE_PARAM, request.method, request.path)
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as error:  # another profiler is running in this process
+        logger.warning("Cannot profile %s %s: %s", request.method, request.path, error)
+        return
+    g.profiler = profiler
+
+
+def _stop_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    name = re.sub(r"[^\w-]", "_", request_id.get() or str(os.getpid())) + ".prof"
+    directory = current_app.config["PROFILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, name))
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    logger.info("Profile of %s %s in %s\n%s", request.method, request.path, name, report.getvalue())
+    response.headers[PROFILE_HEADER] = name
+    return response
+
+
+def _end_profile(error=None):  # pylint: disable=unused-argument
+    profiler = g.pop("profiler", None)
+    if profiler is not None:  # the request raised before its response
+        profiler.disable()
@@ -0,0 +1,384 @@
+"""
+Queries
+
+This module reads Customers without loading whole rows where it can:
+lookups of a few columns, the WHERE clauses of the collection's filters,
+sorted keyset pages and streams, ?q= search, and the missing indexes and
+query plans that ``flask db-check-indexes`` reports. Every function works
+on the current session; the ASGI app runs the statements they return on
+its async engine.
+"""
+import logging
+from service.common.search import NgramIndex, search_words
+from service.models import TEXT_SEARCH_CONFIG, Customer, DataValidationError, db, make_list_etag, search_document
+
+logger = logging.getLogger("flask.app")
+
+# Catalog queries that list the indexes of a table, by dialect. SQLAlchemy
+# cannot reflect expression indexes such as lower(email) on every backend.
+INDEX_CATALOG_QUERIES = {
+    "postgresql": "SELECT indexname FROM pg_indexes WHERE tablename = :table",
+    "sqlite": "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table",
+}
+
+# How to ask each dialect for a query plan
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN"}
+
+# The sort= keys of the collection; "-" in front sorts descending
+SORT_KEYS = ("id", "first_name", "last_name", "email")
+
+# Dialects that search with trigram and full-text indexes in the database;
+# the others search the in-process n-gram index
+DATABASE_SEARCH_DIALECTS = ("postgresql",)
+
+
+def find_columns(by_id, columns: list) -> dict:
+    """Returns some of the columns of a Customer by it's ID
+
+    A Customer in the read cache is returned from there whole; otherwise
+    only the columns asked for are selected. Such partial rows are not
+    cached.
+
+    :param by_id: the id of the Customer to look up
+    :param columns: the table columns to select
+
+    :return: the column values by name or None if it does not exist
+    :type: dict
+
+    """
+    data = Customer.cache.get(str(by_id))
+    if data is not None:
+        return data
+    logger.info("Processing lookup of %s columns for id %s ...", len(columns), by_id)
+    row = db.session.execute(db.select(*columns).where(Customer.id == by_id)).one_or_none()
+    return None if row is None else dict(row._mapping)
+
+
+def exists(by_id) -> bool:
+    """Returns True if a Customer with the id exists"""
+    stmt = db.select(Customer.id).where(Customer.id == by_id)
+    return db.session.execute(stmt).first() is not None
+
+
+def find_version(by_id) -> int:
+    """Returns the version of a Customer without loading the whole row
+
+    :param by_id: the id of the Customer to look up
+
+    :return: the version or None if the Customer does not exist
+    :type: int
+
+    """
+    data = Customer.cache.get(str(by_id))
+    if data is not None:
+        return data["version"]
+    return db.session.scalar(db.select(Customer.version).where(Customer.id == by_id))
+
+
+def filters(  # pylint: disable=too-many-arguments
+    email: str = None,
+    first_name: str = None,
+    last_name: str = None,
+    active: bool = None,
+    min_id: int = None,
+    max_id: int = None,
+) -> list:
+    """Returns the WHERE clauses that select Customers by their columns
+
+    The clauses work on both Customer.query and Core statements. Text
+    comparisons ignore case so they use the lower() indexes. Criteria
+    that are None are left out.
+
+    :param email: the email of the Customers
+    :param first_name: the first name of the Customers
+    :param last_name: the last name of the Customers
+    :param active: whether the Customers are active
+    :param min_id: the smallest id, inclusive
+    :param max_id: the largest id, inclusive
+
+    :return: the clauses, all of which must hold
+    :type: list
+
+    """
+    table = Customer.__table__
+    clauses = []
+    for column, value in ((table.c.email, email), (table.c.first_name, first_name), (table.c.last_name, last_name)):
+        if value is not None:
+            clauses.append(db.func.lower(column) == value.lower())
+    if active is not None:
+        clauses.append(table.c.active.is_(active))
+    if min_id is not None:
+        clauses.append(table.c.id >= min_id)
+    if max_id is not None:
+        clauses.append(table.c.id <= max_id)
+    return clauses
+
+
+def count(clauses: list) -> int:
+    """Returns the number of Customers that match the clauses of filters()"""
+    logger.info("Processing count ...")
+    return db.session.scalar(count_statement(clauses))
+
+
+def count_statement(clauses: list):
+    """Returns the SELECT count(*) of count()"""
+    return db.select(db.func.count()).select_from(Customer.__table__).where(*clauses)
+
+
+def sort_key(sort: str) -> tuple:
+    """Returns the expression and direction of a sort= value
+
+    Names are sorted by lower() so the ordering uses the lower() indexes.
+
+    :param sort: a key of SORT_KEYS, with "-" in front to sort descending
+
+    :return: the sort expression and whether it is descending
+    :type: tuple
+
+    """
+    descending = sort.startswith("-")
+    name = sort[1:] if descending else sort
+    if name not in SORT_KEYS:
+        raise DataValidationError(
+            f"Invalid sort: {sort}. Choose from: {', '.join(SORT_KEYS)}, with - to sort descending"
+        )
+    column = Customer.__table__.c[name]
+    return (column if name == "id" else db.func.lower(column)), descending
+
+
+def order_by(sort: str = "id") -> list:
+    """Returns the ORDER BY of a sort= value, with the id breaking ties"""
+    key, descending = sort_key(sort)
+    table = Customer.__table__
+    keys = [key] if key is table.c.id else [key, table.c.id]
+    return [key.desc() for key in keys] if descending else keys
+
+
+def after_clause(sort: str, after: int, value=None):
+    """Returns the WHERE clause of the Customers past a cursor
+
+    Sorted by anything but the id, the cursor Customer's sort key is
+    compared too, as (key, id) row values.
+
+    :param sort: the sort= key of the page
+    :param after: the id of the last Customer of the previous page
+    :param value: the sort key of that Customer, see cursor_statement()
+
+    """
+    key, descending = sort_key(sort)
+    table = Customer.__table__
+    if key is table.c.id:
+        return table.c.id < after if descending else table.c.id > after
+    row, cursor = db.tuple_(key, table.c.id), db.tuple_(value, after)
+    return row < cursor if descending else row > cursor
+
+
+def cursor_statement(sort: str, after: int):
+    """Returns the SELECT of the sort key of the cursor Customer"""
+    key, _ = sort_key(sort)
+    return db.select(key).where(Customer.id == after)
+
+
+def past_cursor(query, after: int, sort: str):
+    """Returns a Customer query narrowed to the Customers past a cursor
+
+    Raises DataValidationError when a sorted page's cursor Customer no
+    longer exists, since its place in the order is unknown. A caller that
+    needs both the ETag and the rows of a page narrows its query once, so
+    the sort key of the cursor is only selected once.
+    """
+    if after is None:
+        return query
+    value = None
+    if sort_key(sort)[0] is not Customer.__table__.c.id:
+        value = db.session.scalar(cursor_statement(sort, after))
+        if value is None:
+            raise DataValidationError(
+                f"Cursor Customer '{after}' no longer exists; start again without after"
+            )
+    return query.filter(after_clause(sort, after, value))
+
+
+def keyset_page(query, after: int = None, limit: int = None, sort: str = "id") -> list:
+    """Returns one page of a Customer query using keyset pagination
+
+    Rows are ordered by the sort key and id, and only rows past the
+    ``after`` Customer are returned, so every page is an index range
+    scan no matter how deep into the table the caller is.
+
+    :param query: the Customer query to paginate
+    :param after: the last id of the previous page (the cursor)
+    :param limit: the maximum number of Customers to return
+    :param sort: the sort= key of the page
+
+    :return: a list of at most ``limit`` Customers
+    :type: list
+
+    """
+    logger.info("Processing page after id %s (limit %s, sort %s) ...", after, limit, sort)
+    query = past_cursor(query, after, sort)
+    return query.order_by(*order_by(sort)).limit(limit).all()
+
+
+def page_etag(query, after: int = None, limit: int = None, sort: str = "id") -> str:
+    """Returns the entity tag of a page without loading the whole rows
+
+    :param query: the Customer query to paginate
+    :param after: the last id of the previous page (the cursor)
+    :param limit: the maximum number of Customers in the page
+    :param sort: the sort= key of the page
+
+    """
+    query = past_cursor(query, after, sort)
+    rows = query.with_entities(Customer.id, Customer.version).order_by(*order_by(sort)).limit(limit)
+    return make_list_etag(rows)
+
+
+def stream(query, after: int = None, batch_size: int = 500, sort: str = "id"):
+    """Yields the Customers of a query from a server-side cursor
+
+    Only ``batch_size`` rows are buffered at a time so memory stays
+    flat regardless of how many rows the query matches.
+
+    :param query: the Customer query to stream
+    :param after: only stream Customers past the one with this id
+    :param batch_size: the number of rows fetched per round trip
+    :param sort: the sort= key of the stream
+
+    """
+    logger.info("Streaming Customers after id %s ...", after)
+    query = past_cursor(query, after, sort)
+    return query.order_by(*order_by(sort)).yield_per(batch_size)
+
+
+def search(text: str, limit: int, columns: list) -> list:
+    """Returns the Customers that best match a search, best first
+
+    Names, emails and addresses are searched for words that start with
+    the query's words and for fuzzy (trigram) matches.
+
+    :param text: what the user typed
+    :param limit: the maximum number of Customers to return
+    :param columns: the columns to select
+
+    :return: a list of rows
+    :type: list
+
+    """
+    logger.info("Processing search for %s ...", text)
+    dialect = db.engine.dialect.name
+    if dialect in DATABASE_SEARCH_DIALECTS:
+        db.session.execute(search_threshold_statement())
+    else:
+        generation = Customer.search_generation
+        fingerprint = db.session.execute(search_fingerprint_statement()).one()
+        key = (generation, tuple(fingerprint))
+        if Customer.search_index.key != key:
+            documents = db.session.execute(search_documents_statement())
+            rebuild_search_index(documents, key)
+    stmt = search_statement(text, limit, columns, dialect)
+    return db.session.execute(stmt).all()
+
+
+def search_statement(text: str, limit: int, columns: list, dialect: str):
+    """Returns the SELECT of search()
+
+    On Postgres the trigram and tsvector indexes find the matches; on
+    other databases their ids come from the n-gram index, which the
+    caller must have refreshed.
+    """
+    words = search_words(text)
+    if not words:
+        raise DataValidationError("Invalid search: q must contain letters or digits")
+    table = Customer.__table__
+    stmt = db.select(*columns)
+    if dialect in DATABASE_SEARCH_DIALECTS:
+        query = " ".join(words)
+        document = search_document(table.c.first_name, table.c.last_name, table.c.email, table.c.address)
+        tsquery = db.func.to_tsquery(TEXT_SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words))
+        prefix = db.func.to_tsvector(TEXT_SEARCH_CONFIG, document).op("@@")(tsquery)
+        return (
+            stmt.where(db.or_(prefix, db.literal(query).op("<%")(document)))
+            .order_by(prefix.desc(), db.func.word_similarity(query, document).desc(), table.c.id)
+            .limit(limit)
+        )
+    ids = Customer.search_index.search(text, limit, Customer.search_similarity)
+    if not ids:
+        return stmt.where(db.false())
+    rank = db.case({by_id: position for position, by_id in enumerate(ids)}, value=table.c.id)
+    return stmt.where(table.c.id.in_(ids)).order_by(rank)
+
+
+def search_threshold_statement():
+    """Returns the statement that sets the pg_trgm match threshold for the transaction"""
+    return db.select(
+        db.func.set_config("pg_trgm.word_similarity_threshold", str(Customer.search_similarity), True)
+    )
+
+
+def search_fingerprint_statement():
+    """Returns a SELECT whose result changes whenever the Customers do
+
+    It catches writes by other processes, which search_generation
+    cannot see.
+    """
+    return db.select(db.func.count(Customer.id), db.func.max(Customer.id), db.func.sum(Customer.version))
+
+
+def search_documents_statement():
+    """Returns the SELECT of the id and search text of every Customer"""
+    table = Customer.__table__
+    return db.select(
+        table.c.id,
+        search_document(table.c.first_name, table.c.last_name, table.c.email, table.c.address),
+    )
+
+
+def rebuild_search_index(documents, key):
+    """Replaces the n-gram index with one of the (id, text) documents"""
+    logger.info("Rebuilding the search index")
+    Customer.search_index = NgramIndex(documents, key)
+
+
+def missing_indexes() -> list:
+    """Returns the declared indexes that do not exist in the database
+
+    :return: the Index objects that still need to be created
+    :type: list
+
+    """
+    dialect = db.engine.dialect.name
+    declared = [
+        index for index in Customer.__table__.indexes
+        if index.info.get("dialect", dialect) == dialect
+    ]
+    if dialect in INDEX_CATALOG_QUERIES:
+        existing = set(
+            db.session.execute(
+                db.text(INDEX_CATALOG_QUERIES[dialect]), {"table": Customer.__table__.name}
+            ).scalars().all()
+        )
+    else:
+        inspector = db.inspect(db.engine)
+        existing = {index["name"] for index in inspector.get_indexes(Customer.__table__.name)}
+    return sorted(
+        (index for index in declared if index.name not in existing),
+        key=lambda index: index.name,
+    )
+
+
+def explain(query) -> list:
+    """Returns the database query plan of a Customer query
+
+    :param query: the Customer query or SELECT statement to explain
+
+    :return: the lines of the query plan
+    :type: list
+
+    """
+    dialect = db.engine.dialect
+    statement = getattr(query, "statement", query)
+    sql = statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    prefix = EXPLAIN_PREFIXES.get(dialect.name, "EXPLAIN")
+    rows = db.session.connection().exec_driver_sql(f"{prefix} {sql}")
+    return [str(row[-1]) for row in rows]
@@ -0,0 +1,86 @@
+"""
+Search
+
+This module contains the in-process n-gram index that backs Customer
+search on databases without trigram and full-text indexes (SQLite), so
+``?q=`` behaves the same locally as it does on Postgres.
+
+Text is cut into trigrams the way pg_trgm does it: it is split into lower
+case words and each word is padded with two spaces in front and one
+behind. A document matches a query when every query word is the start of
+one of its words (type-ahead), or when it contains enough of the query's
+trigrams to be a fuzzy match. Prefix matches rank first, then documents
+by the share of the query's trigrams they contain, like pg_trgm's
+word_similarity().
+"""
+import re
+from collections import Counter
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def search_words(text: str) -> list:
+    """Returns the lower case words of a text"""
+    return WORD.findall(text.lower())
+
+
+def trigrams(words: list) -> set:
+    """Returns the pg_trgm style trigrams of a list of words"""
+    grams = set()
+    for word in words:
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramIndex:
+    """An inverted index from trigrams to the documents that contain them
+
+    The index is built once from all of the documents and never changed
+    afterwards; a new index is built when the documents change, so it can
+    be searched from many threads without locks. ``key`` records what the
+    index was built from so its owner can tell when it is stale.
+    """
+
+    def __init__(self, documents=(), key=None):
+        self.key = key
+        self._words = {}
+        self._postings = {}
+        for doc_id, text in documents:
+            words = search_words(text)
+            self._words[doc_id] = words
+            for gram in trigrams(words):
+                self._postings.setdefault(gram, []).append(doc_id)
+
+    def __len__(self):
+        return len(self._words)
+
+    def search(self, text: str, limit: int, threshold: float) -> list:
+        """Returns the ids of the best matching documents, best first
+
+        :param text: the query text
+        :param limit: the maximum number of ids to return
+        :param threshold: the share of the query's trigrams a document
+            must contain to be a fuzzy match
+
+        """
+        words = search_words(text)
+        grams = trigrams(words)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        ranked = []
+        for doc_id, count in shared.items():
+            similarity = count / len(grams)
+            prefix = self._prefix_match(words, self._words[doc_id])
+            if prefix or similarity >= threshold:
+                ranked.append((not prefix, -similarity, doc_id))
+        ranked.sort()
+        return [doc_id for _, _, doc_id in ranked[:limit]]
+
+    @staticmethod
+    def _prefix_match(words: list, doc_words: list) -> bool:
+        """Returns True if every query word starts one of the document's words"""
+        return all(any(doc_word.startswith(word) for doc_word in doc_words) for word in words)
@@ -0,0 +1,92 @@
+"""
+Seeding
+
+This module fills the database with fake Customers for load tests and
+staging, in the shapes of tests.factories.CustomerFactory. Faker is slow
+next to COPY, so it only makes pools of names, addresses and email
+domains that every row is drawn from; emails are made unique with the
+row's number. Chunks of rows are made and loaded by a pool of threads,
+each with its own session and connection.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from service.common.passwords import UNUSABLE_PASSWORD
+from service.common import bulk
+from service.models import Customer, db
+
+POOL_SIZE = 1000  # fake values of each kind that rows are drawn from
+ACTIVE_SHARE = 0.9  # share of the seeded Customers that are active
+
+
+class FakePools:  # pylint: disable=too-few-public-methods
+    """Fake names, addresses and email domains to draw Customers from"""
+
+    def __init__(self, seed: int = None):
+        try:
+            from faker import Faker  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise RuntimeError("Seeding requires the Faker package (installed with factory-boy)") from error
+        fake = Faker()
+        fake.seed_instance(seed)
+        self.first_names = [fake.first_name() for _ in range(POOL_SIZE)]
+        self.last_names = [fake.last_name() for _ in range(POOL_SIZE)]
+        self.addresses = [fake.address() for _ in range(POOL_SIZE)]
+        self.domains = list({fake.free_email_domain() for _ in range(POOL_SIZE)})
+
+
+def fake_rows(pools: FakePools, start: int, count: int, salt: str, password: str) -> list:
+    """Returns the column values of count fake Customers
+
+    The rows of a chunk only depend on where it starts, so a seeded run
+    makes the same Customers whatever the number of threads.
+    """
+    rng = random.Random(start)
+    rows = []
+    for number in range(start, start + count):
+        first_name = rng.choice(pools.first_names)
+        last_name = rng.choice(pools.last_names)
+        rows.append(
+            {
+                "first_name": first_name,
+                "last_name": last_name,
+                "email": f"{first_name}.{last_name}.{number}@{rng.choice(pools.domains)}".lower(),
+                "address": rng.choice(pools.addresses),
+                "active": rng.random() < ACTIVE_SHARE,
+                "salt": salt,
+                "password": password,
+                "version": 1,
+            }
+        )
+    return rows
+
+
+def seed_customers(app, count: int, chunk_size: int, workers: int, password: str = None, seed: int = None) -> int:
+    """Inserts count fake Customers in parallel chunks
+
+    Every Customer gets the same password, hashed once, or an unusable one
+    when there is none. SQLite takes one writer at a time, so it is seeded
+    by one thread.
+
+    :return: the number of Customers inserted
+    :type: int
+
+    """
+    pools = FakePools(seed)
+    # number the emails after the existing Customers so reruns add new ones
+    offset = (db.session.scalar(db.select(db.func.max(Customer.id))) or 0) + 1
+    salt, encoded = Customer.hasher.hash(password) if password else ("", UNUSABLE_PASSWORD)
+    if db.engine.dialect.name == "sqlite":
+        workers = 1
+
+    def load(start: int) -> int:
+        with app.app_context():
+            try:
+                rows = fake_rows(pools, offset + start, min(chunk_size, count - start), salt, encoded)
+                bulk.copy_from(rows)
+                db.session.commit()
+                return len(rows)
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="seed") as executor:
+        return sum(executor.map(load, range(0, count, chunk_size)))
@@ -0,0 +1,101 @@
+"""
+Serializers
+
+This module encodes query rows straight to JSON bytes in the shape of a
+flask-restx model. List endpoints select only the model's columns as
+plain tuples, so there is no ORM hydration, no serialize() dictionary and
+no marshal() pass over every field. orjson is used when it is installed.
+"""
+import json
+from flask_restx import fields
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """Encodes data as compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+# The Python type each flask-restx field formats its value to
+FIELD_TYPES = {
+    fields.String: str,
+    fields.Integer: int,
+    fields.Boolean: bool,
+    fields.Float: float,
+}
+
+
+class RowSerializer:
+    """Serializes result rows to the JSON of a flask-restx model
+
+    The serializer is compiled once per model: it knows which table column
+    feeds each field and only converts the values whose column type differs
+    from the field type (such as an integer id shown as a string).
+    Serializers of sparse fieldsets (a subset of the fields) are compiled
+    on first use and kept.
+    """
+
+    def __init__(self, model, table, names: list = None):
+        model_fields = model.resolved  # includes the fields of parent models
+        self.model = model
+        self.table = table
+        self.names = list(model_fields.keys()) if names is None else names
+        self.columns = [table.c[name] for name in self.names]
+        self.converters = []
+        for name, column in zip(self.names, self.columns):
+            field_type = FIELD_TYPES.get(type(model_fields[name]))
+            if field_type is None or column.type.python_type is field_type:
+                self.converters.append(None)
+            else:
+                self.converters.append(field_type)
+        self._subsets = {}
+
+    def subset(self, names: list) -> "RowSerializer":
+        """Returns the serializer of some of the fields, in model order
+
+        :param names: the names of the fields to keep
+
+        Raises ValueError when a name is not a field of the model.
+        """
+        wanted = frozenset(name.strip() for name in names if name.strip())
+        if not wanted:
+            raise ValueError("fields must name at least one field")
+        unknown = wanted.difference(self.names)
+        if unknown:
+            raise ValueError(
+                f"Unknown fields: {', '.join(sorted(unknown))}. Choose from: {', '.join(self.names)}"
+            )
+        subset = self._subsets.get(wanted)
+        if subset is None:
+            subset = RowSerializer(self.model, self.table, [name for name in self.names if name in wanted])
+            self._subsets[wanted] = subset
+        return subset
+
+    def to_dict(self, row) -> dict:
+        """Returns the model dictionary of one row
+
+        The first values of the row must be the serializer's columns; any
+        extra values after them are ignored.
+        """
+        return {
+            name: value if convert is None or value is None else convert(value)
+            for name, convert, value in zip(self.names, self.converters, row)
+        }
+
+    def from_mapping(self, data) -> dict:
+        """Returns the model dictionary of a column name to value mapping"""
+        return self.to_dict([data[name] for name in self.names])
+
+    def dumps(self, rows) -> bytes:
+        """Returns the JSON array of the rows"""
+        return dumps([self.to_dict(row) for row in rows])
+
+    def dumps_line(self, row) -> bytes:
+        """Returns one row as a line of newline delimited JSON"""
+        return dumps(self.to_dict(row)) + b"\n"
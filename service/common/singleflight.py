@@ -0,0 +1,113 @@
+"""
+Single Flight
+
+This module coalesces identical reads within a worker: while a query for
+a key is in flight, every other request for the same key waits for its
+result instead of running the query again. A burst of requests for the
+same Customer thus costs one query however many threads (or coroutines,
+under the ASGI server) ask at once.
+
+Only requests that arrive while the query runs share its result; nothing
+is kept once it returns. Writes forget the keys they change, so a request
+that starts after a write never joins a query that started before it.
+"""
+import asyncio
+import threading
+from service.common.metrics import COALESCED_QUERIES
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """A query in flight and, once it returns, its result or error"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces the identical queries of the threads of a worker"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, load):
+        """Returns load(), or the result of the load() in flight for the key
+
+        An error raised by load() is raised in every request that shared it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            COALESCED_QUERIES.labels(self.name).inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = load()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            self.forget(key, call)
+            call.done.set()
+        return call.result
+
+    def forget(self, key, call=None):
+        """Stops later requests for a key from joining the query in flight"""
+        with self._lock:
+            if call is None or self._calls.get(key) is call:
+                self._calls.pop(key, None)
+
+    def info(self) -> dict:
+        """Returns the query counters"""
+        return {"queries": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """Coalesces the identical queries of the coroutines of an event loop
+
+    The query runs in a task of its own, so a request that is cancelled,
+    such as by its client going away, does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.coalesced = 0
+        self._tasks = {}
+
+    async def do(self, key, load):
+        """Returns await load(), or the result of the load() in flight for the key"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self.forget(key, task))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            COALESCED_QUERIES.labels(self.name).inc()
+        return await asyncio.shield(task)
+
+    def forget(self, key, task=None):
+        """Stops later requests for a key from joining the query in flight"""
+        if task is None or self._tasks.get(key) is task:
+            self._tasks.pop(key, None)
+        if task is not None and task.done() and not task.cancelled():
+            task.exception()  # retrieved, even if every request was cancelled
+
+    def info(self) -> dict:
+        """Returns the query counters"""
+        return {"queries": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._tasks)}
@@ -0,0 +1,57 @@
+"""
+Startup
+
+This module times the phases of starting the service (imports, the app,
+the database and the job runner) so the cold start of a
+worker is logged, returned by /stats and exported as a metric. It only
+imports the standard library, so the service imports it first and its
+clock starts before everything else is imported.
+"""
+import time
+
+
+class StartupReport:
+    """The seconds each phase of starting the service took"""
+
+    def __init__(self):
+        self.phases = {}
+        self.finished = False
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        """Ends a phase: it took the time since the previous one ended
+
+        Apps made after the first one, as by tests, are not timed.
+        """
+        if self.finished:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def finish(self) -> bool:
+        """Ends the report, returning whether it was still running"""
+        running = not self.finished
+        self.finished = True
+        return running
+
+    @property
+    def total(self) -> float:
+        """Returns the seconds taken by the phases so far"""
+        return sum(self.phases.values())
+
+    def summary(self) -> str:
+        """Returns the phases as one log line"""
+        phases = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases.items())
+        return f"Started in {self.total:.3f}s ({phases})"
+
+    def info(self) -> dict:
+        """Returns the seconds of each phase and in total"""
+        return {
+            "phases": {phase: round(seconds, 6) for phase, seconds in self.phases.items()},
+            "total": round(self.total, 6),
+        }
+
+
+# Started when the service package is first imported
+startup = StartupReport()
@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+import tempfile
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -14,3 +15,85 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Logging: "text" or "json" lines, the share of requests whose info
+# records are kept (warnings and errors always are), and one access log
+# line per request with its route, status, duration and database time
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "false").lower() in ("true", "1", "yes")
+
+# SQL per request: return the number of statements in the X-DB-Queries
+# header (always on in debug mode), the times one statement may repeat
+# before it is reported as an N+1 query, and whether a request over its
+# query budget raises instead of logging
+DB_QUERY_HEADERS = os.getenv("DB_QUERY_HEADERS", "false").lower() in ("true", "1", "yes")
+DB_QUERY_REPEAT_LIMIT = int(os.getenv("DB_QUERY_REPEAT_LIMIT", "10"))
+DB_QUERY_BUDGET_ENFORCE = os.getenv("DB_QUERY_BUDGET_ENFORCE", "false").lower() in ("true", "1", "yes")
+
+# Profiling: break every request into phases in a Server-Timing header
+# (always on in debug mode), and profile a request sent with ?_profile=1
+# and "Authorization: Bearer <PROFILE_TOKEN>" into PROFILE_DIR. Without a
+# token no request is profiled.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("true", "1", "yes")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "customer-profiles"))
+
+# Create missing tables when each worker starts. Turn it off in production
+# and run `flask db-init` once per deploy instead, so starting a worker
+# does not query the database catalog.
+DB_CREATE_TABLES = os.getenv("DB_CREATE_TABLES", "true").lower() in ("true", "1", "yes")
+
+# Keyset pagination and streaming for the collection endpoint
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "1000"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "5000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# ?q= search: default number of results and the share of a query's
+# trigrams a fuzzy match must contain (pg_trgm word similarity)
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "20"))
+SEARCH_SIMILARITY = float(os.getenv("SEARCH_SIMILARITY", "0.6"))
+
+# Batch endpoints: rows per INSERT/UPDATE/DELETE chunk and largest accepted batch
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "1000"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "100000"))
+
+# Import and export jobs: where their files are kept (shared by every
+# process that runs jobs), the job threads of each web process (0 leaves
+# them to `flask jobs-worker`), how often idle runners look for queued
+# jobs and the rows loaded or written between progress reports
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(tempfile.gettempdir(), "customer-jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "10000"))
+
+# Server-Sent Events: events buffered for each subscriber before it is
+# dropped as too slow, and seconds between keep-alive comments
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1000"))
+EVENTS_HEARTBEAT_INTERVAL = float(os.getenv("EVENTS_HEARTBEAT_INTERVAL", "15"))
+
+# Read-through cache for single Customer lookups: "lru", "redis" or "none"
+CACHE_TYPE = os.getenv("CACHE_TYPE", "lru")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Password hashing: "scrypt" (cost PASSWORD_SCRYPT_N) or "pbkdf2_sha256"
+# (cost PASSWORD_PBKDF2_ITERATIONS), run by at most PASSWORD_HASH_WORKERS
+# threads with up to PASSWORD_HASH_QUEUE more passwords waiting
+PASSWORD_HASH_ALGORITHM = os.getenv("PASSWORD_HASH_ALGORITHM", "scrypt")
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", "16384"))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "30"))
+
+# Connection pool (ignored for SQLite). DB_PGBOUNCER leaves pooling to
+# PgBouncer and disables prepared statements. DB_STATEMENT_TIMEOUT is in ms.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in ("true", "1", "yes")
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
@@ -0,0 +1,200 @@
+"""
+Import and Export Job Routes
+
+Paths:
+------
+POST /customers/imports - queues a job that imports a CSV or NDJSON file of Customers
+POST /customers/exports - queues a job that exports the Customers (same filters as GET)
+GET /jobs/{id} - Returns the status and progress of an import or export job
+GET /jobs/{id}/result - Downloads the file of a finished export job
+"""
+
+from flask import request, send_file
+from flask import current_app as app  # Import Flask application
+from flask_restx import Resource, fields, reqparse
+from service.common import status  # HTTP Status Codes
+from service.common import jobs, metrics
+from service.models import Job
+from service.routes import FILTER_ARGS, abort, customer_args, filter_criteria
+
+from . import api
+
+import_args = reqparse.RequestParser()
+import_args.add_argument(
+    "format",
+    type=str,
+    location="args",
+    required=False,
+    choices=list(jobs.MEDIA_TYPES),
+    help="The format of the file, when the Content-Type does not say",
+)
+
+export_args = reqparse.RequestParser()
+for argument in customer_args.args:
+    if argument.name in FILTER_ARGS:
+        export_args.add_argument(argument)
+export_args.add_argument(
+    "format",
+    type=str,
+    location="args",
+    required=False,
+    default="csv",
+    choices=list(jobs.MEDIA_TYPES),
+    help="The format of the export file",
+)
+
+job_model = api.model(
+    "Job",
+    {
+        "id": fields.Integer(readOnly=True, description="The unique id assigned internally by service"),
+        "kind": fields.String(description="import or export"),
+        "format": fields.String(description="csv or ndjson"),
+        "status": fields.String(description="queued, running, succeeded or failed"),
+        "params": fields.Raw(description="The filters of an export"),
+        "total": fields.Integer(description="The number of Customers to export"),
+        "processed": fields.Integer(description="The number of rows processed so far"),
+        "rejected": fields.Integer(description="The number of rows that were not imported"),
+        "errors": fields.List(fields.String, description="Why rows were rejected (the first ones)"),
+        "message": fields.String(description="Why the job failed"),
+        "created_at": fields.DateTime(description="When the job was queued"),
+        "started_at": fields.DateTime(description="When the job started running"),
+        "finished_at": fields.DateTime(description="When the job finished"),
+        "result": fields.String(description="Where to download the file of a succeeded export"),
+    },
+)
+
+
+######################################################################
+#  PATH: /customers/imports
+######################################################################
+@api.route("/customers/imports")
+class CustomerImports(Resource):
+    """Imports Customers in the background"""
+
+    @metrics.query_budget(2)
+    @api.doc("import_customers")
+    @api.expect(import_args)
+    @api.response(400, "The file is not CSV or NDJSON")
+    @api.marshal_with(job_model, code=202)
+    def post(self):
+        """
+        Import Customers from a file
+
+        This endpoint will save the CSV or NDJSON file in the request body
+        and queue a job that imports it; poll the job for its progress
+        """
+        app.logger.info("Request to Import Customers")
+        args = import_args.parse_args()
+        fmt = args["format"] or jobs.FORMATS.get(request.mimetype)
+        if fmt is None:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Imports must be text/csv or application/x-ndjson, or name their ?format=.",
+            )
+        job = jobs.queue_import(request.stream, fmt)
+        app.logger.info("Import job with id [%s] queued!", job.id)
+        return _job_response(job), status.HTTP_202_ACCEPTED, _job_location(job)
+
+
+######################################################################
+#  PATH: /customers/exports
+######################################################################
+@api.route("/customers/exports")
+class CustomerExports(Resource):
+    """Exports Customers in the background"""
+
+    @metrics.query_budget(2)
+    @api.doc("export_customers")
+    @api.expect(export_args, validate=True)
+    @api.marshal_with(job_model, code=202)
+    def post(self):
+        """
+        Export Customers to a file
+
+        This endpoint will queue a job that writes the Customers matching
+        the filters to a CSV or NDJSON file; download it from the job's result
+        """
+        app.logger.info("Request to Export Customers")
+        args = export_args.parse_args()
+        job = jobs.queue_export(args["format"], filter_criteria(args))
+        app.logger.info("Export job with id [%s] queued!", job.id)
+        return _job_response(job), status.HTTP_202_ACCEPTED, _job_location(job)
+
+
+######################################################################
+#  PATH: /jobs/{id}
+######################################################################
+@api.route("/jobs/<int:job_id>")
+@api.param("job_id", "The Job identifier")
+class JobResource(Resource):
+    """Handles a single import or export Job"""
+
+    @metrics.query_budget(1)
+    @api.doc("get_jobs")
+    @api.response(404, "Job not found")
+    @api.marshal_with(job_model)
+    def get(self, job_id):
+        """
+        Retrieve a single Job
+
+        This endpoint will return the status and progress of a Job
+        """
+        app.logger.info("Request to Retrieve a Job with id [%s]", job_id)
+        return _job_response(_find_job(job_id)), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /jobs/{id}/result
+######################################################################
+@api.route("/jobs/<int:job_id>/result")
+@api.param("job_id", "The Job identifier")
+class JobResult(Resource):
+    """Downloads the file of an export Job"""
+
+    @metrics.query_budget(1)
+    @api.doc("get_job_results")
+    @api.response(404, "Job not found or not an export")
+    @api.response(409, "The export has not succeeded")
+    def get(self, job_id):
+        """
+        Download the file of an export
+
+        This endpoint will return the CSV or NDJSON file of a succeeded export
+        """
+        app.logger.info("Request to Download the result of Job [%s]", job_id)
+        job = _find_job(job_id)
+        if job.kind != "export":
+            abort(status.HTTP_404_NOT_FOUND, f"Job with id '{job_id}' has no result.")
+        if job.status != "succeeded":
+            abort(status.HTTP_409_CONFLICT, f"Job with id '{job_id}' is {job.status}.")
+        return send_file(
+            job.path,
+            mimetype=jobs.MEDIA_TYPES[job.format],
+            as_attachment=True,
+            download_name=f"customers-{job.id}.{job.format}",
+        )
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _find_job(job_id: int) -> Job:
+    """Returns a Job or aborts with 404 Not Found"""
+    job = Job.find(job_id)
+    if job is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Job with id '{job_id}' was not found.")
+    return job
+
+
+def _job_response(job: Job) -> dict:
+    """Returns a serialized Job with the URL of its result"""
+    data = job.serialize()
+    data["result"] = None
+    if job.kind == "export" and job.status == "succeeded":
+        data["result"] = api.url_for(JobResult, job_id=job.id, _external=True)
+    return data
+
+
+def _job_location(job: Job) -> dict:
+    """Returns the Location header of a queued Job"""
+    return {"Location": api.url_for(JobResource, job_id=job.id, _external=True)}
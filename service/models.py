@@ -3,14 +3,81 @@ Models for Customer
 
 All of the models are stored in this module
 """
+import hashlib
 import logging
+import threading
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.orm.exc import StaleDataError
+from service.common.cache import NullCache, create_cache
+from service.common.events import EventBroker, change_events, create_broker, notify_triggers
+from service.common.passwords import PasswordHasher, create_hasher
+from service.common.pool import engine_options
+from service.common.metrics import instrument_engine
+from service.common.search import NgramIndex
+from service.common.singleflight import AsyncSingleFlight, SingleFlight
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Columns that are never sent back to clients
+SECRET_COLUMNS = ("salt", "password")
+
+# Columns that track changes for the change feed rather than describe a Customer
+CHANGE_COLUMNS = ("change_seq", "updated_at")
+
+# Where a session keeps the events it publishes until it commits
+EVENTS_KEY = "customer_events"
+
+# The Postgres sequence that numbers changes, and the advisory lock that
+# writers hold shared and the change feed takes exclusively, so the feed
+# never sees a number before the smaller numbers have all been committed
+CHANGE_SEQUENCE = db.Sequence("customer_change_seq", metadata=db.metadata)
+CHANGE_FEED_LOCK = 0x63686E67  # "chng"
+
+# The text search configuration: no stemming or stop words, so prefixes of
+# names and emails match
+TEXT_SEARCH_CONFIG = db.literal_column("'simple'")
+
+
+# SQLAlchemy itself never overrides Operators.__sa_operate__, a typing stub
+class next_change_seq(FunctionElement):  # pylint: disable=invalid-name, too-many-ancestors, abstract-method
+    """The next number of the change sequence, larger than an optional floor
+
+    Postgres draws it from CHANGE_SEQUENCE. SQLite has no sequences but
+    takes one writer at a time, so the next number is one more than the
+    largest in use (or the floor, for the tombstone of the row that had it).
+    Every row a statement writes may get the same number.
+    """
+
+    type = db.BigInteger()
+    name = "next_change_seq"
+    inherit_cache = True
+
+
+@compiles(next_change_seq)
+def _next_change_seq(element, compiler, **kwargs):
+    floors = [
+        "coalesce((SELECT max(change_seq) FROM customer), 0)",
+        "coalesce((SELECT max(change_seq) FROM customer_tombstone), 0)",
+        *(compiler.process(clause, **kwargs) for clause in element.clauses),
+    ]
+    return f"(max({', '.join(floors)}) + 1)"
+
+
+@compiles(next_change_seq, "postgresql")
+def _next_change_seq_postgresql(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    return (
+        f"(SELECT nextval('{CHANGE_SEQUENCE.name}') "
+        f"FROM pg_advisory_xact_lock_shared({CHANGE_FEED_LOCK}))"
+    )
+
 
 # Function to initialize the database
 def init_db(app):
@@ -18,10 +85,77 @@ def init_db(app):
     Customer.init_db(app)
 
 
+def dispose_engine():
+    """Drops the pooled connections a forked worker inherited from its parent
+
+    The connections stay open for the parent; the worker opens its own
+    on first use. Call it in the worker right after the fork.
+    """
+    if Customer.app is None:
+        return
+    with Customer.app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class ConcurrentUpdateError(Exception):
+    """Used when a Customer was changed by someone else since it was read"""
+
+
+def make_etag(customer_id: int, version: int) -> str:
+    """Returns the (unquoted) entity tag of one version of a Customer"""
+    return f"{customer_id}-{version}"
+
+
+def if_match_versions(customer_id: int, etags) -> list:
+    """Returns the versions of a Customer allowed by If-Match entity tags
+
+    :param customer_id: the id of the Customer being changed
+    :param etags: the parsed If-Match header (werkzeug ETags)
+
+    :return: the allowed versions, or None when any version is allowed
+    :type: list
+
+    """
+    if not etags or etags.star_tag:
+        return None
+    prefix = f"{customer_id}-"
+    return [
+        int(tag[len(prefix):])
+        for tag in etags.as_set()
+        if tag.startswith(prefix) and tag[len(prefix):].isdigit()
+    ]
+
+
+def search_document(first_name, last_name, email, address):
+    """Returns the lower case text that Customer search matches against
+
+    Indexes and queries must build it the same way for Postgres to use
+    them, so the separators are literals rather than bound parameters.
+    """
+    space = db.literal_column("' '")
+    return db.func.lower(first_name + space + last_name + space + email + space + address)
+
+
+def postgresql_index(name: str, *expressions, **kwargs):
+    """Declares an index that is only created on Postgres"""
+    return db.Index(name, *expressions, info={"dialect": "postgresql"}, **kwargs).ddl_if(
+        dialect="postgresql"
+    )
+
+
+def make_list_etag(rows) -> str:
+    """Returns the (unquoted) entity tag of a list of (id, version) rows"""
+    digest = hashlib.sha1(usedforsecurity=False)
+    for customer_id, version in rows:
+        digest.update(f"{customer_id}-{version};".encode())
+    return digest.hexdigest()
+
+
 # pylint: disable=too-many-instance-attributes
 class Customer(db.Model):
     """
@@ -29,6 +163,16 @@ class Customer(db.Model):
     """
 
     app = None
+    cache = NullCache()
+    cache_generation = 0  # bumped by invalidate() so a load that overlaps a write is not cached
+    cache_lock = threading.Lock()
+    events = EventBroker()
+    lookups = SingleFlight("find")  # coalesces concurrent cache misses
+    async_lookups = AsyncSingleFlight("find")  # the same for the ASGI app
+    hasher = PasswordHasher()
+    search_index = NgramIndex()
+    search_generation = 0  # bumped by every write the n-gram index must see
+    search_similarity = 0.6
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
@@ -37,8 +181,44 @@ class Customer(db.Model):
     email = db.Column(db.String(64), nullable=False)
     address = db.Column(db.String(128), nullable=False)
     salt = db.Column(db.String(32), nullable=False)
-    password = db.Column(db.String(64), nullable=False)
+    password = db.Column(db.String(128), nullable=False)
     active = db.Column(db.Boolean(), nullable=False, default=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # Renumbered by every write, for GET /customers/changes
+    change_seq = db.Column(
+        db.BigInteger, nullable=False, default=next_change_seq(), onupdate=next_change_seq()
+    )
+    updated_at = db.Column(
+        db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now()
+    )
+
+    # The ORM bumps version on every UPDATE and only updates the row if it
+    # still has the version that was read (optimistic concurrency)
+    __mapper_args__ = {"version_id_col": version}
+
+    # Lookups are case-insensitive, so the indexes are on lower() of the columns
+    __table_args__ = (
+        db.Index("ix_customer_email_lower", db.func.lower(email)),
+        db.Index(
+            "ix_customer_name_lower", db.func.lower(last_name), db.func.lower(first_name)
+        ),
+        db.Index("ix_customer_first_name_lower", db.func.lower(first_name)),
+        db.Index("ix_customer_change_seq", change_seq, id),
+        # ?q= search: fuzzy matches with pg_trgm, word prefixes with tsvector
+        postgresql_index(
+            "ix_customer_search_trgm",
+            search_document(first_name, last_name, email, address).label("document"),
+            postgresql_using="gin",
+            postgresql_ops={"document": "gin_trgm_ops"},
+        ),
+        postgresql_index(
+            "ix_customer_search_tsv",
+            db.func.to_tsvector(
+                TEXT_SEARCH_CONFIG, search_document(first_name, last_name, email, address)
+            ),
+            postgresql_using="gin",
+        ),
+    )
 
     def __repr__(self):
         return f"<Customer {self.get_full_name()} id=[{self.id}]>"
@@ -49,29 +229,54 @@ class Customer(db.Model):
         """
         return f"{self.first_name} {self.last_name}"
 
-    def create(self):
+    def create(self) -> dict:
         """
         Creates a Customer to the database
+
+        Returns the Customer serialized from the INSERT ... RETURNING, so
+        callers need not reload the row that the commit expired.
         """
         logger.info("Creating %s", self.get_full_name())
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
+        db.session.flush()
+        data = self.serialize()
+        self.publish("created", [data])
         db.session.commit()
+        self.invalidate(data["id"])
+        return data
 
     def update(self):
         """
         Updates a Customer to the database
+
+        Raises ConcurrentUpdateError if the row was changed after it was read
         """
         logger.info("Saving %s", self.get_full_name())
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        customer_id = self.id
+        try:
+            db.session.flush()
+            self.publish("updated", [self.serialize()])
+            db.session.commit()
+        except StaleDataError as error:
+            db.session.rollback()
+            raise ConcurrentUpdateError(
+                f"Customer with id '{customer_id}' was changed by another request"
+            ) from error
+        self.invalidate(customer_id)
 
     def delete(self):
         """Removes a Customer from the data store"""
         logger.info("Deleting %s", self.get_full_name())
+        customer_id, change_seq = self.id, self.change_seq
         db.session.delete(self)
+        db.session.flush()
+        db.session.execute(Tombstone.insert_statement(), [{"customer_id": customer_id, "deleted_seq": change_seq}])
+        self.publish("deleted", [{"id": customer_id}])
         db.session.commit()
+        self.invalidate(customer_id)
 
     def serialize(self):
         """Serializes a Customer into a dictionary"""
@@ -81,32 +286,48 @@ class Customer(db.Model):
             "last_name": self.last_name,
             "email": self.email,
             "address": self.address,
-            "salt": self.salt,
-            "password": self.password,
             "active": self.active,
+            "version": self.version,
         }
 
-    def deserialize(self, data):
+    def etag(self) -> str:
+        """Returns the entity tag of this version of the Customer"""
+        return make_etag(self.id, self.version)
+
+    def set_password(self, password: str):
+        """Stores a new salt and the slow hash of a password"""
+        if not isinstance(password, str) or not password:
+            raise DataValidationError("Invalid Customer: password must be a non-empty string")
+        self.salt, self.password = self.hasher.hash(password)
+
+    def changes(self) -> dict:
+        """Returns the column values set by deserialize() for an in-place update"""
+        values = self.serialize()
+        del values["id"], values["version"]
+        if self.password is not None:
+            values.update(salt=self.salt, password=self.password)
+        return values
+
+    def deserialize(self, data, password_required: bool = True):
         """
         Deserializes a Customer from a dictionary
 
+        The password is hashed with a new salt; any salt in the data is
+        ignored.
+
         Args:
             data (dict): A dictionary containing the resource data
+            password_required (bool): False to keep the current password
+                when the data has none, as updates do
         """
-        # import hashlib
-
-        # def hash_password(salt, password):
-        #     hashed_password = hashlib.sha256(salt.encode() + password.encode()).hexdigest()
-        #     return salt, hashed_password
         try:
             self.first_name = data["first_name"]
             self.last_name = data["last_name"]
             self.email = data["email"]
             self.address = data["address"]
-            # self.salt,self.password = hash_password(data["salt"],data["password"])
-            self.salt = data["salt"]
-            self.password = data["password"]
             self.active = data["active"]
+            if password_required or data.get("password") is not None:
+                self.set_password(data["password"])
         except KeyError as error:
             raise DataValidationError(
                 "Invalid Customer: missing " + error.args[0]
@@ -124,10 +345,32 @@ class Customer(db.Model):
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        # Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS win over the DB_* ones
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            **engine_options(app.config),
+            **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+        }
+        # This is where we initialize SQLAlchemy from the Flask app. It is
+        # only done once per app: Flask refuses new setup once it has served
+        # a request, and the engine already reflects the configuration.
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
+        with app.app_context():
+            engine = db.engine
+            if app.config["DB_CREATE_TABLES"]:
+                db.create_all()  # make our sqlalchemy tables
+            else:
+                logger.info("Leaving the tables to flask db-init")
+        instrument_engine(engine)
+        cls.cache = create_cache(app.config)
+        cls.hasher = create_hasher(app.config)
+
+        def connect():
+            cargs, cparams = engine.dialect.create_connect_args(engine.url)
+            return engine.dialect.connect(*cargs, **cparams)
+
+        cls.events = create_broker(app.config, engine.dialect.name, connect)
+        cls.search_similarity = app.config["SEARCH_SIMILARITY"]
 
     @classmethod
     def all(cls):
@@ -141,22 +384,184 @@ class Customer(db.Model):
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_cached(cls, by_id) -> dict:
+        """Returns a serialized Customer by it's ID through the read cache
+
+        Concurrent misses for the same Customer share one query.
+
+        :param by_id: the id of the Customer to look up
+
+        :return: the serialized Customer or None if it does not exist
+        :type: dict
+
+        """
+        key = str(by_id)
+        data = cls.cache.get(key)
+        if data is None:
+            data = cls.lookups.do(key, lambda: cls._load_cached(by_id))
+        return data
+
+    @classmethod
+    def _load_cached(cls, by_id) -> dict:
+        """Reads a serialized Customer for find_cached() and caches it"""
+        generation = cls.cache_generation
+        customer = cls.find(by_id)
+        if customer is None:
+            return None
+        data = customer.serialize()
+        cls.cache_fill(by_id, data, generation)
+        return data
+
+    @classmethod
+    def cache_fill(cls, by_id, data: dict, generation: int):
+        """Caches a loaded Customer unless a write was invalidated since
+
+        A write that commits while the row is being read would otherwise
+        leave the old row in the cache until it expires.
+
+        :param by_id: the id of the loaded Customer
+        :param data: the serialized Customer
+        :param generation: the cache_generation read before the load began
+
+        """
+        with cls.cache_lock:
+            if generation == cls.cache_generation:
+                cls.cache.set(str(by_id), data)
+
+    @classmethod
+    def update_by_id(cls, by_id, values: dict, versions: list = None, kind: str = "updated") -> dict:
+        """Updates a Customer with a single UPDATE ... RETURNING statement
+
+        The row is never loaded first: the number of rows returned tells
+        whether the Customer exists (and had one of the expected versions).
+
+        :param by_id: the id of the Customer to update
+        :param values: the column values to set
+        :param versions: only update the Customer if it has one of these
+            versions, or any version when None
+        :param kind: the type of the event published, such as "deactivated"
+
+        :return: the serialized updated Customer or None if no row matched
+        :type: dict
+
+        """
+        logger.info("Updating id %s in place ...", by_id)
+        row = db.session.execute(update_statement(by_id, values, versions)).one_or_none()
+        if row is not None:
+            cls.publish(kind, [dict(row._mapping)])
+        db.session.commit()
+        if row is None:
+            return None
+        cls.invalidate(by_id)
+        return dict(row._mapping)
+
+    @classmethod
+    def delete_by_id(cls, by_id) -> bool:
+        """Deletes a Customer with a single DELETE ... RETURNING statement
+
+        :param by_id: the id of the Customer to delete
+
+        :return: True if the Customer existed
+        :type: bool
+
+        """
+        logger.info("Deleting id %s in place ...", by_id)
+        row = db.session.execute(delete_statement(by_id)).one_or_none()
+        if row is not None:
+            db.session.execute(Tombstone.insert_statement(), [Tombstone.parameters(row)])
+            cls.publish("deleted", [{"id": row.id}])
+        deleted = row is not None
+        db.session.commit()
+        if deleted:
+            cls.invalidate(by_id)
+        return deleted
+
+    @classmethod
+    def verify_password(cls, by_id, password: str) -> bool:
+        """Checks a Customer's password against its stored hash
+
+        A hash made with an older algorithm or cost is replaced by a new
+        one once the password is known to be right. That does not change
+        the Customer, so its version stays the same.
+
+        :param by_id: the id of the Customer
+        :param password: the password in clear text
+
+        :return: whether the password is right, or None if there is no such Customer
+        :type: bool
+
+        """
+        logger.info("Verifying the password of id %s ...", by_id)
+        stmt = db.select(cls.salt, cls.password).where(cls.id == by_id)
+        row = db.session.execute(stmt).one_or_none()
+        if row is None:
+            return None
+        if not cls.hasher.verify(password, row.salt, row.password):
+            return False
+        if cls.hasher.needs_rehash(row.password):
+            db.session.execute(rehash_statement(by_id, *cls.hasher.hash(password)))
+        db.session.commit()
+        return True
+
+    @classmethod
+    def invalidate(cls, *ids):
+        """Removes Customers from the read cache after they change"""
+        if ids:
+            with cls.cache_lock:
+                cls.cache_generation += 1
+        for by_id in ids:
+            cls.cache.delete(str(by_id))
+            cls.lookups.forget(str(by_id))
+            cls.async_lookups.forget(str(by_id))
+        if ids:
+            cls.search_generation += 1
+
+    @classmethod
+    def publish(cls, kind: str, customers: list):
+        """Publishes change events when the current transaction commits
+
+        The session keeps the events until it commits. Nothing is published
+        while no subscriber could see it, nor on Postgres, where the
+        triggers of the table NOTIFY the events of each statement.
+
+        :param kind: "created", "updated", "deactivated" or "deleted"
+        :param customers: the public column values of each Customer, or
+            just its "id" once deleted
+
+        """
+        if customers and cls.events.listening and not cls.events.channel:
+            db.session.info.setdefault(EVENTS_KEY, []).extend(change_events(kind, customers))
+
     @classmethod
     def find_by_full_name(cls, full_name):
-        """Returns all Customers with the given name
+        """Returns all Customers with the given name, ignoring case
+
+        A single word matches either the first or the last name; otherwise
+        the first word is the first name and the rest is the last name.
 
         Args:
             name (string): the name of the Customers you want to match
         """
         logger.info("Processing name query for %s ...", full_name)
-        name_parts = full_name.split(" ", 1)
+        name_parts = full_name.lower().split(None, 1)
+        if not name_parts:
+            return cls.query.filter(db.false())
+        if len(name_parts) == 1:
+            return cls.query.filter(
+                db.or_(
+                    db.func.lower(cls.last_name) == name_parts[0],
+                    db.func.lower(cls.first_name) == name_parts[0],
+                )
+            )
         return cls.query.filter(
-            cls.first_name == name_parts[0], cls.last_name == name_parts[1]
+            db.func.lower(cls.last_name) == name_parts[1],
+            db.func.lower(cls.first_name) == name_parts[0],
         )
 
     @classmethod
     def find_by_email(cls, email: str) -> list:
-        """Returns all Customers with the given email
+        """Returns all Customers with the given email, ignoring case
 
         :param email: the email of the Customers you want to match
         :type email: str
@@ -166,4 +571,220 @@ class Customer(db.Model):
 
         """
         logger.info("Processing email query for %s ...", email)
-        return cls.query.filter(cls.email == email)
+        return cls.query.filter(db.func.lower(cls.email) == email.lower())
+
+
+class Tombstone(db.Model):
+    """
+    Class that represents a deleted Customer in the change feed
+
+    A Customer whose id is reused after it was deleted (SQLite reuses the
+    largest id) has a tombstone before its new rows in the feed.
+    """
+
+    __tablename__ = "customer_tombstone"
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    __table_args__ = (db.Index("ix_customer_tombstone_change_seq", change_seq, customer_id),)
+
+    def __repr__(self):
+        return f"<Tombstone customer_id=[{self.customer_id}] change_seq=[{self.change_seq}]>"
+
+    @classmethod
+    def insert_statement(cls):
+        """Returns the INSERT that records deleted Customers for the change feed
+
+        Execute it with the parameters() of each deleted row. It must run
+        after the DELETE, so the row cannot change in between.
+        """
+        return db.insert(cls.__table__).values(
+            customer_id=db.bindparam("customer_id"),
+            change_seq=next_change_seq(db.bindparam("deleted_seq", type_=db.BigInteger)),
+        )
+
+    @staticmethod
+    def parameters(row) -> dict:
+        """Returns the insert_statement() parameters of a deleted (id, change_seq) row"""
+        return {"customer_id": row.id, "deleted_seq": row.change_seq}
+
+
+######################################################################
+#  Statements that both the WSGI and the ASGI app run
+######################################################################
+def public_columns() -> list:
+    """Returns the Customer columns that may be sent back to clients"""
+    return [
+        column for column in Customer.__table__.c if column.name not in SECRET_COLUMNS + CHANGE_COLUMNS
+    ]
+
+
+def update_statement(by_id, values: dict, versions: list = None):
+    """Returns the UPDATE ... RETURNING statement of Customer.update_by_id()"""
+    table = Customer.__table__
+    stmt = db.update(table).where(table.c.id == by_id)
+    if versions is not None:
+        stmt = stmt.where(table.c.version.in_(versions))
+    return stmt.values(version=table.c.version + 1, **values).returning(*public_columns())
+
+
+def rehash_statement(by_id, salt: str, encoded: str):
+    """Returns the UPDATE that replaces the password hash of a Customer
+
+    It keeps change_seq and updated_at, so the change feed does not
+    report a Customer whose public columns have not changed.
+    """
+    table = Customer.__table__
+    return (
+        db.update(table)
+        .where(table.c.id == by_id)
+        .values(salt=salt, password=encoded, change_seq=table.c.change_seq, updated_at=table.c.updated_at)
+    )
+
+
+def delete_statement(by_id):
+    """Returns the DELETE ... RETURNING statement of Customer.delete_by_id()
+
+    Run the Tombstone.insert_statement() of the row it returns after it.
+    """
+    table = Customer.__table__
+    return db.delete(table).where(table.c.id == by_id).returning(table.c.id, table.c.change_seq)
+
+
+class Job(db.Model):
+    """
+    Class that represents a background import or export of Customers
+
+    Jobs are rows so that any process can queue one, run it and report
+    its progress to whoever polls it.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)  # "import" or "export"
+    format = db.Column(db.String(16), nullable=False)  # "csv" or "ndjson"
+    status = db.Column(db.String(16), nullable=False, default="queued", index=True)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    path = db.Column(db.String(255), nullable=False)
+    total = db.Column(db.Integer)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.JSON, nullable=False, default=list)
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<Job {self.kind} {self.status} id=[{self.id}]>"
+
+    def create(self):
+        """Queues a Job"""
+        logger.info("Queueing %s job for %s", self.kind, self.path)
+        self.id = None  # pylint: disable=invalid-name
+        db.session.add(self)
+        db.session.commit()
+
+    def progress(self, processed: int, rejected: int, errors: list):
+        """Records how far a running Job has got and commits its work so far"""
+        self.processed = processed
+        self.rejected = rejected
+        self.errors = list(errors)
+        db.session.commit()
+
+    def finish(self, status: str, message: str = None):
+        """Records the end of a Job"""
+        logger.info("Job %s %s", self.id, status)
+        self.status = status
+        self.message = message
+        self.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+    def serialize(self) -> dict:
+        """Serializes a Job into a dictionary"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "format": self.format,
+            "status": self.status,
+            "params": self.params,
+            "total": self.total,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def find(cls, by_id):
+        """Finds a Job by it's ID"""
+        return db.session.get(cls, by_id)
+
+    @classmethod
+    def claim(cls):
+        """Marks the oldest queued Job as running and returns it
+
+        The UPDATE only matches a Job that is still queued, and Postgres
+        skips rows locked by other claimers, so each Job is run once
+        however many processes claim at the same time.
+
+        :return: the claimed Job or None if none is queued
+        :type: Job
+
+        """
+        table = cls.__table__
+        oldest = db.select(table.c.id).where(table.c.status == "queued").order_by(table.c.id).limit(1)
+        if db.engine.dialect.name == "postgresql":
+            oldest = oldest.with_for_update(skip_locked=True)
+        stmt = (
+            db.update(table)
+            .where(table.c.id == oldest.scalar_subquery(), table.c.status == "queued")
+            .values(status="running", started_at=datetime.now(timezone.utc))
+            .returning(table.c.id)
+        )
+        job_id = db.session.execute(stmt).scalar_one_or_none()
+        db.session.commit()
+        return None if job_id is None else cls.find(job_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _deliver_events(session):
+    """Delivers the events a session published once they are committed"""
+    events = session.info.pop(EVENTS_KEY, None)
+    if events:
+        Customer.events.deliver(events)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_events(session, previous_transaction):  # pylint: disable=unused-argument
+    """Forgets the events of a transaction that was rolled back"""
+    session.info.pop(EVENTS_KEY, None)
+
+
+# The trigram index needs the pg_trgm extension
+event.listen(
+    next(index for index in Customer.__table__.indexes if index.name == "ix_customer_search_trgm"),
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+# On Postgres the triggers of the customer table NOTIFY its change events
+for _statement in notify_triggers(Customer.__tablename__):
+    event.listen(Customer.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
+
+
+def create_notify_triggers():
+    """(Re)creates the triggers that NOTIFY change events, on Postgres
+
+    New tables get them when they are created; this adds them to tables
+    created before them.
+    """
+    if db.engine.dialect.name == "postgresql":
+        for statement in notify_triggers(Customer.__tablename__):
+            db.session.execute(DDL(statement))
+        db.session.commit()
@@ -4,25 +4,58 @@ Customer Service with Swagger
 Paths:
 ------
 GET / - Displays a UI for Selenium testing
-GET /customers - Returns a list all of the Customers
+GET /stats - Returns the read cache and connection pool counters and the startup times
+GET /metrics - Returns the Prometheus metrics of every worker
+GET /customers - Returns a page of Customers (?limit=&after=&sort=, ?stream=true for NDJSON, ?q= to search)
+HEAD /customers - Returns the number of Customers in X-Total-Count (also GET ?count=true)
+GET /customers/changes - Returns the Customers changed or deleted since a change sequence number
+GET /customers/events - Streams Customer changes as they happen (Server-Sent Events)
 GET /customers/{id} - Returns the Customer with a given id number
+(both GETs take ?fields=id,email,... to return and select only some fields)
 POST /customers - creates a new Customer record in the database
 PUT /customers/{id} - updates a Customer record in the database
 DELETE /customers/{id} - deletes a Customer record in the database
+POST /customers/{id}/verify-password - checks the password of a Customer
+(the batch endpoints are in service/batch_routes.py and the import and
+export jobs in service/job_routes.py)
 """
 
-from flask_restx import Resource, fields, reqparse
+from flask import Response, request, stream_with_context
+from flask import current_app as app  # Import Flask application
+from flask_restx import Resource, fields, reqparse, inputs
+from flask_restx.representations import output_json
 from service.common import status  # HTTP Status Codes
-from service.models import Customer
+from service.common import feed, metrics, queries
+from service.common.events import EVENTS_HEADERS, EVENTS_PREAMBLE, format_event, stream_messages
+from service.common.serializers import RowSerializer, dumps
+from service.common.singleflight import SingleFlight
+from service.common.startup import startup
+from service.common.pool import pool_stats
+from service.models import (
+    db,
+    Customer,
+    if_match_versions,
+    make_etag,
+    make_list_etag,
+)
+
+from . import api, blueprint
+
 
-# Import Flask application
-from . import app, api
+############################################################
+# JSON Representation
+############################################################
+@api.representation("application/json")
+def timed_output_json(data, code, headers=None):
+    """Encodes the JSON response of a Resource, timed as serialization"""
+    with metrics.serialization():
+        return output_json(data, code, headers)
 
 
 ############################################################
 # Health Endpoint
 ############################################################
-@app.route("/health")
+@blueprint.route("/health")
 def health():
     """
     Endpoint to check the health of the microservice.
@@ -33,47 +66,111 @@ def health():
     return {"status": "OK"}, status.HTTP_200_OK
 
 
+############################################################
+# Stats Endpoint
+############################################################
+@blueprint.route("/stats")
+def stats():
+    """
+    Endpoint to size the service's in-process resources.
+
+    Returns:
+        A JSON response with the read cache, event subscriber, password
+        hasher and connection pool counters, and the time the service took
+        to start, with HTTP_200_OK.
+    """
+    return {
+        "cache": Customer.cache.info(),
+        "events": Customer.events.info(),
+        "password_hasher": Customer.hasher.info(),
+        "pool": pool_stats(db.engine.pool),
+        "startup": startup.info(),
+    }, status.HTTP_200_OK
+
+
+############################################################
+# Metrics Endpoint
+############################################################
+@blueprint.route("/metrics")
+def prometheus_metrics():
+    """
+    Endpoint for Prometheus to scrape.
+
+    Returns:
+        Request, SQL and serialization metrics in the Prometheus text format.
+    """
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@blueprint.route("/")
 def index():
     """Base URL for our service"""
     return app.send_static_file("index.html")
 
 
 # Define the model so that the docs reflect what can be sent
+customer_fields = {
+    "first_name": fields.String(
+        required=True, description="The first name of the Customer"
+    ),
+    "last_name": fields.String(
+        required=True, description="The last name of the Customer"
+    ),
+    "email": fields.String(required=True, description="The email of the Customer"),
+    "address": fields.String(
+        required=True, description="The address of the Customer"
+    ),
+    "active": fields.Boolean(required=True, description="Is the Customer active?"),
+}
+
 create_model = api.model(
     "Customer",
     {
-        "first_name": fields.String(
-            required=True, description="The first name of the Customer"
-        ),
-        "last_name": fields.String(
-            required=True, description="The last name of the Customer"
-        ),
-        "email": fields.String(required=True, description="The email of the Customer"),
-        "address": fields.String(
-            required=True, description="The address of the Customer"
-        ),
-        "salt": fields.String(required=True, description="The salt of the Customer"),
+        **customer_fields,
         "password": fields.String(
-            required=True, description="The password of the Customer"
+            required=True,
+            description="The password of the Customer, stored hashed and never returned",
         ),
-        "active": fields.Boolean(required=True, description="Is the Customer active?"),
     },
 )
 
-customer_model = api.inherit(
+# Responses never carry the password hash or its salt
+customer_model = api.model(
     "CustomerModel",
-    create_model,
     {
+        **customer_fields,
         "id": fields.String(
             readOnly=True, description="The unique id assigned internally by service"
         ),
     },
 )
 
+# List responses select just these columns and encode the rows directly
+customer_rows = RowSerializer(customer_model, Customer.__table__)
+
+
+def customer_fieldset(names: str = None) -> tuple:
+    """Returns the serializer and SELECT columns of a ?fields= sparse fieldset
+
+    The id and version are always selected, for the cursor and the ETag,
+    even when they are not sent back.
+
+    :param names: comma separated fields of customer_model, or None for all
+
+    Raises ValueError when a name is not a field of customer_model.
+    """
+    serializer = customer_rows if names is None else customer_rows.subset(names.split(","))
+    table = Customer.__table__
+    extra = [column for column in (table.c.id, table.c.version) if column.name not in serializer.names]
+    return serializer, serializer.columns + extra
+
+
+customer_columns = customer_fieldset()[1]
+
 # query string arguments
 customer_args = reqparse.RequestParser()
 customer_args.add_argument(
@@ -83,6 +180,144 @@ customer_args.add_argument(
     required=False,
     help="Search a Customer by email",
 )
+customer_args.add_argument(
+    "first_name",
+    type=str,
+    location="args",
+    required=False,
+    help="Only return Customers with this first name, ignoring case",
+)
+customer_args.add_argument(
+    "last_name",
+    type=str,
+    location="args",
+    required=False,
+    help="Only return Customers with this last name, ignoring case",
+)
+customer_args.add_argument(
+    "active",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    help="Only return active (true) or inactive (false) Customers",
+)
+customer_args.add_argument(
+    "min_id",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    help="Only return Customers with an id of at least this",
+)
+customer_args.add_argument(
+    "max_id",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    help="Only return Customers with an id of at most this",
+)
+customer_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    required=False,
+    default="id",
+    choices=[*queries.SORT_KEYS, *(f"-{key}" for key in queries.SORT_KEYS)],
+    help="Sort by id, first_name, last_name or email; prefix with - to sort descending",
+)
+customer_args.add_argument(
+    "count",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Only return the number of matching Customers, in X-Total-Count",
+)
+customer_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    required=False,
+    help="Search names, emails and addresses by word prefix and fuzzy match",
+)
+customer_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields to return, such as id,email,active",
+)
+customer_args.add_argument(
+    "limit",
+    type=inputs.positive,
+    location="args",
+    required=False,
+    help="The maximum number of Customers to return",
+)
+customer_args.add_argument(
+    "after",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    help="Return Customers with an id greater than this cursor",
+)
+customer_args.add_argument(
+    "stream",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Stream the Customers as newline delimited JSON",
+)
+
+fieldset_args = reqparse.RequestParser()
+fieldset_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields to return, such as id,email,active",
+)
+
+# The query arguments that are passed on to queries.filters()
+FILTER_ARGS = ("email", "first_name", "last_name", "active", "min_id", "max_id")
+
+# Why a ?q= search refused the other query arguments
+SEARCH_CONFLICT = "q cannot be combined with filters, sort, count, after or stream."
+
+# Identical ?email= list queries in flight at once run once per worker
+email_queries = SingleFlight("email")
+
+changes_args = reqparse.RequestParser()
+changes_args.add_argument(
+    "since",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    default=0,
+    help="Return the changes after this change sequence number (the next of the last page)",
+)
+changes_args.add_argument(
+    "limit",
+    type=inputs.positive,
+    location="args",
+    required=False,
+    help="The maximum number of changes to return",
+)
+
+password_model = api.model(
+    "Password",
+    {
+        "password": fields.String(required=True, description="The password to check"),
+    },
+)
+
+verification_model = api.model(
+    "PasswordVerification",
+    {
+        "id": fields.String(description="The id of the Customer"),
+        "verified": fields.Boolean(description="Whether the password is right"),
+    },
+)
 
 
 ######################################################################
@@ -103,31 +338,54 @@ class CustomerResource(Resource):
     # ------------------------------------------------------------------
     # RETRIEVE A CUSTOMER
     # ------------------------------------------------------------------
+    @metrics.query_budget(2)
     @api.doc("get_customers")
+    @api.expect(fieldset_args, validate=True)
+    @api.response(304, "Customer not modified since the If-None-Match ETag")
     @api.response(404, "Customer not found")
-    @api.marshal_with(customer_model)
+    @api.response(400, "The fields are not fields of a Customer")
+    @api.response(200, "Success", customer_model)
     def get(self, customer_id):
         """
         Retrieve a single Customer
 
-        This endpoint will return a Customer based on its id
+        This endpoint will return a Customer based on its id. With
+        ``fields`` only those fields are returned, and a Customer that is
+        not in the read cache only has their columns selected.
         """
         app.logger.info("Request to Retrieve a customer with id [%s]", customer_id)
-        customer = Customer.find(customer_id)
+        args = fieldset_args.parse_args()
+        serializer, columns = _fieldset(args["fields"])
+        if request.if_none_match:
+            version = queries.find_version(customer_id)
+            if version is not None:
+                etag = make_etag(customer_id, version)
+                if request.if_none_match.contains_weak(etag):
+                    return _not_modified(etag)
+
+        if serializer is customer_rows:
+            customer = Customer.find_cached(customer_id)
+        else:
+            customer = queries.find_columns(customer_id, columns)
         if not customer:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Customer with id '{customer_id}' was not found.",
             )
 
-        return customer.serialize(), status.HTTP_200_OK
+        etag = make_etag(customer["id"], customer["version"])
+        with metrics.serialization():
+            data = serializer.from_mapping(customer)
+        return data, status.HTTP_200_OK, {"ETag": f'"{etag}"'}
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING CUSTOMER
     # ------------------------------------------------------------------
+    @metrics.query_budget(2)
     @api.doc("update_customers")
     @api.response(404, "Customer not found")
     @api.response(400, "The posted Customer data was not valid")
+    @api.response(412, "The Customer does not match the If-Match ETag")
     @api.expect(customer_model)
     @api.marshal_with(customer_model)
     def put(self, customer_id):
@@ -137,22 +395,14 @@ class CustomerResource(Resource):
         This endpoint will update a Customer based on the body that is posted
         """
         app.logger.info("Request to Update a customer with id [%s]", customer_id)
-        customer = Customer.find(customer_id)
-        if not customer:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Customer with id '{customer_id}' was not found.",
-            )
-        app.logger.debug("Payload = %s", api.payload)
-        data = api.payload
-        customer.deserialize(data)
-        customer.id = customer_id
-        customer.update()
-        return customer.serialize(), status.HTTP_200_OK
+        values = Customer().deserialize(api.payload, password_required=False).changes()
+        customer = _update_in_place(customer_id, values, f"Customer with id '{customer_id}' was not found.")
+        return customer, status.HTTP_200_OK, _etag_header(customer)
 
     # ------------------------------------------------------------------
     # DELETE A CUSTOMER
     # ------------------------------------------------------------------
+    @metrics.query_budget(2)
     @api.doc("delete_customers")
     @api.response(204, "Customer deleted")
     def delete(self, customer_id):
@@ -162,9 +412,7 @@ class CustomerResource(Resource):
         This endpoint will delete a Customer based on the id specified in the path
         """
         app.logger.info("Request to Delete a customer with id [%s]", customer_id)
-        customer = Customer.find(customer_id)
-        if customer:
-            customer.delete()
+        if Customer.delete_by_id(customer_id):
             app.logger.info("Customer with id [%s] was deleted", customer_id)
 
         return "", status.HTTP_204_NO_CONTENT
@@ -180,28 +428,100 @@ class CustomerCollection(Resource):
     # ------------------------------------------------------------------
     # LIST ALL CUSTOMERS
     # ------------------------------------------------------------------
+    @metrics.query_budget(3)
     @api.doc("list_customers")
     @api.expect(customer_args, validate=True)
-    @api.marshal_list_with(customer_model)
+    @api.response(304, "Page not modified since the If-None-Match ETag")
+    @api.response(200, "Success", [customer_model])
     def get(self):
-        """Returns all of the Customers"""
+        """Returns a page of the Customers
+
+        Customers are filtered by ``email``, ``first_name``, ``last_name``,
+        ``active``, ``min_id`` and ``max_id`` in the database, sorted by
+        ``sort`` and paginated with ``limit`` and ``after``. The ``Link``
+        and ``X-Next-Cursor`` headers point to the next page. With
+        ``count=true`` only the number of matching Customers is returned.
+        With ``stream=true`` the Customers are sent as NDJSON instead.
+        A page that still matches the If-None-Match ETag is answered with
+        304 Not Modified without loading the Customers.
+        With ``q`` the best ``limit`` matches of a search are returned instead.
+        With ``fields`` only those fields are selected and returned.
+        """
         app.logger.info("Request to list Customers...")
-        customers = []
         args = customer_args.parse_args()
-        if args["email"]:
-            app.logger.info("Filtering by email: %s", args["email"])
-            customers = Customer.find_by_email(args["email"])
-        else:
-            app.logger.info("Returning unfiltered list.")
-            customers = Customer.all()
+        serializer, columns = _fieldset(args["fields"])
+        if args["q"] is not None:
+            return _search(args, serializer, columns)
+        clauses = queries.filters(**filter_criteria(args))
+        if args["count"]:
+            return _count(clauses)
+        # the cursor is looked up once for the ETag and the page alike
+        query = queries.past_cursor(Customer.query.filter(*clauses), args["after"], args["sort"])
+
+        if args["stream"]:
+            rows = queries.stream(
+                query.with_entities(*columns),
+                batch_size=app.config["STREAM_BATCH_SIZE"],
+                sort=args["sort"],
+            )
+            return Response(
+                stream_with_context(_ndjson(rows, serializer)),
+                status=status.HTTP_200_OK,
+                mimetype="application/x-ndjson",
+            )
+
+        limit = min(
+            args["limit"] or app.config["DEFAULT_PAGE_SIZE"],
+            app.config["MAX_PAGE_SIZE"],
+        )
+        if request.if_none_match:
+            etag = queries.page_etag(query, limit=limit, sort=args["sort"])
+            if request.if_none_match.contains_weak(etag):
+                return _not_modified(etag)
+
+        def page():
+            return queries.keyset_page(query.with_entities(*columns), limit=limit, sort=args["sort"])
+
+        # campaigns send bursts of the same ?email= lookup; they share one query
+        rows = email_queries.do(query_key(args, limit), page) if args["email"] else page()
+        app.logger.info("[%s] Customers returned", len(rows))
+
+        etag = make_list_etag((row.id, row.version) for row in rows)
+        headers = {"ETag": f'"{etag}"'}
+        if len(rows) == limit:
+            cursor = rows[-1].id
+            next_url = api.url_for(
+                CustomerCollection,
+                _external=True,
+                **_query_params(args, limit=limit, after=cursor),
+            )
+            headers["Link"] = f'<{next_url}>; rel="next"'
+            headers["X-Next-Cursor"] = str(cursor)
+        with metrics.serialization():
+            body = serializer.dumps(rows)
+        return Response(
+            body, status=status.HTTP_200_OK, mimetype="application/json", headers=headers
+        )
+
+    # ------------------------------------------------------------------
+    # COUNT THE CUSTOMERS
+    # ------------------------------------------------------------------
+    @metrics.query_budget(1)
+    @api.doc("count_customers")
+    @api.expect(customer_args, validate=True)
+    @api.response(200, "The number of matching Customers is in X-Total-Count")
+    def head(self):
+        """Returns the number of Customers that match the filters
 
-        results = [customer.serialize() for customer in customers]
-        app.logger.info("[%s] Customers returned", len(results))
-        return results, status.HTTP_200_OK
+        Only a SELECT count(*) is run; no Customers are loaded.
+        """
+        app.logger.info("Request to count Customers...")
+        return _count(queries.filters(**filter_criteria(customer_args.parse_args())))
 
     # ------------------------------------------------------------------
     # ADD A NEW CUSTOMER
     # ------------------------------------------------------------------
+    @metrics.query_budget(1)
     @api.doc("create_customers")
     @api.response(400, "The posted data was not valid")
     @api.expect(create_model)
@@ -213,26 +533,27 @@ class CustomerCollection(Resource):
         """
         app.logger.info("Request to Create a Customer")
         customer = Customer()
-        app.logger.debug("Payload = %s", api.payload)
         customer.deserialize(api.payload)
-        customer.create()
-        app.logger.info("Customer with new id [%s] created!", customer.id)
+        data = customer.create()
+        app.logger.info("Customer with new id [%s] created!", data["id"])
         location_url = api.url_for(
-            CustomerResource, customer_id=customer.id, _external=True
+            CustomerResource, customer_id=data["id"], _external=True
         )
-        return customer.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return data, status.HTTP_201_CREATED, {"Location": location_url}
 
 
 ######################################################################
 #  PATH: /customers/{id}/deactivate
 ######################################################################
-@api.route("/customers/<customer_id>/deactivate")
+@api.route("/customers/<int:customer_id>/deactivate")
 @api.param("customer_id", "The Customer identifier")
 class DeactivateResource(Resource):
     """Deactivate actions on a Customer"""
 
+    @metrics.query_budget(2)
     @api.doc("deactivate_customers")
     @api.response(404, "Customer not found")
+    @api.response(412, "The Customer does not match the If-Match ETag")
     def put(self, customer_id):
         """
         Deactivate a Customer
@@ -240,16 +561,118 @@ class DeactivateResource(Resource):
         This endpoint will deactivate a Customer
         """
         app.logger.info("Request to Deactivate a Customer")
-        customer = Customer.find(customer_id)
-        if not customer:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Customer with id [{customer_id}] was not found.",
-            )
-        customer.active = False
-        customer.update()
-        app.logger.info("Customer with id [%s] has been deactivated!", customer.id)
-        return customer.serialize(), status.HTTP_200_OK
+        customer = _update_in_place(
+            customer_id, {"active": False}, f"Customer with id [{customer_id}] was not found.", "deactivated"
+        )
+        app.logger.info("Customer with id [%s] has been deactivated!", customer_id)
+        return customer, status.HTTP_200_OK, _etag_header(customer)
+
+
+######################################################################
+#  PATH: /customers/{id}/verify-password
+######################################################################
+@api.route("/customers/<int:customer_id>/verify-password")
+@api.param("customer_id", "The Customer identifier")
+class PasswordResource(Resource):
+    """Checks the password of a Customer"""
+
+    @metrics.query_budget(2)
+    @api.doc("verify_customer_password")
+    @api.expect(password_model)
+    @api.response(400, "The posted data was not valid")
+    @api.response(401, "The password is wrong")
+    @api.response(404, "Customer not found")
+    @api.response(503, "Too many passwords are being hashed")
+    @api.marshal_with(verification_model)
+    def post(self, customer_id):
+        """
+        Verify a Customer's password
+
+        This endpoint will check the posted password against the Customer's stored hash
+        """
+        app.logger.info("Request to Verify the password of Customer [%s]", customer_id)
+        data = api.payload
+        if not isinstance(data, dict) or not isinstance(data.get("password"), str):
+            abort(status.HTTP_400_BAD_REQUEST, "A password is required.")
+        verified = Customer.verify_password(customer_id, data["password"])
+        if verified is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
+        if not verified:
+            abort(status.HTTP_401_UNAUTHORIZED, "The password is wrong.")
+        return {"id": customer_id, "verified": True}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/changes
+######################################################################
+@api.route("/customers/changes")
+class CustomerChanges(Resource):
+    """The change feed that mirrors of the Customers sync from"""
+
+    @metrics.query_budget(2)
+    @api.doc("list_customer_changes")
+    @api.expect(changes_args, validate=True)
+    @api.response(200, "The changes, oldest first, and the since of the next page")
+    def get(self):
+        """
+        Returns the Customers changed or deleted since a change sequence number
+
+        Each Customer appears once, at its latest change; deleted Customers
+        are tombstones with no customer. Start from since=0 and pass the
+        returned next until no changes come back.
+        """
+        app.logger.info("Request to list Customer changes...")
+        args = changes_args.parse_args()
+        limit = min(args["limit"] or app.config["DEFAULT_PAGE_SIZE"], app.config["MAX_PAGE_SIZE"])
+        rows = feed.changes_since(args["since"], limit, customer_columns)
+        app.logger.info("[%s] Customer changes returned", len(rows))
+        cursor = rows[-1].seq if rows else args["since"]
+        headers = {"X-Next-Cursor": str(cursor)}
+        if len(rows) >= limit:
+            next_url = api.url_for(CustomerChanges, _external=True, since=cursor, limit=limit)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        with metrics.serialization():
+            body = dumps({"changes": [_change(row) for row in rows], "next": cursor})
+        return Response(body, status=status.HTTP_200_OK, mimetype="application/json", headers=headers)
+
+
+######################################################################
+#  PATH: /customers/events
+######################################################################
+@api.route("/customers/events")
+class CustomerEvents(Resource):
+    """The Server-Sent Events stream of Customer changes"""
+
+    @api.doc("stream_customer_events", produces=["text/event-stream"])
+    @api.response(200, "A created, updated, deactivated or deleted event per change")
+    def get(self):
+        """
+        Streams Customer changes as they happen
+
+        Events are sent once their change is committed. A client that falls
+        EVENTS_BUFFER_SIZE events behind gets a dropped event and is
+        disconnected; it catches up from the change feed and reconnects.
+        """
+        app.logger.info("Request to stream Customer events")
+        subscription = Customer.events.subscribe()
+        heartbeat = app.config["EVENTS_HEARTBEAT_INTERVAL"]
+
+        def stream():
+            try:
+                yield EVENTS_PREAMBLE
+                while True:
+                    yield from stream_messages(subscription, subscription.wait(heartbeat), event_message)
+                    if subscription.dropped:
+                        return
+            finally:
+                Customer.events.unsubscribe(subscription)
+
+        return Response(
+            stream_with_context(stream()),
+            status=status.HTTP_200_OK,
+            mimetype="text/event-stream",
+            headers=EVENTS_HEADERS,
+        )
 
 
 ######################################################################
@@ -261,3 +684,141 @@ def abort(error_code: int, message: str):
     """Logs errors before aborting"""
     app.logger.error(message)
     api.abort(error_code, message)
+
+
+def _update_in_place(customer_id: int, values: dict, not_found: str, kind: str = "updated") -> dict:
+    """Updates a Customer without reading it first, honoring If-Match
+
+    Only when no row was updated is the Customer looked up again, to tell
+    a missing Customer (404) from a stale If-Match ETag (412).
+    """
+    versions = if_match_versions(customer_id, request.if_match)
+    customer = Customer.update_by_id(customer_id, values, versions, kind)
+    if customer is None:
+        if versions is not None and queries.exists(customer_id):
+            abort(
+                status.HTTP_412_PRECONDITION_FAILED,
+                f"Customer with id '{customer_id}' does not match the If-Match ETag.",
+            )
+        abort(status.HTTP_404_NOT_FOUND, not_found)
+    return customer
+
+
+def _etag_header(customer: dict) -> dict:
+    """Returns the ETag header of a serialized Customer"""
+    return {"ETag": f'"{make_etag(customer["id"], customer["version"])}"'}
+
+
+def _not_modified(etag: str) -> Response:
+    """Returns an empty 304 Not Modified response for an entity tag"""
+    app.logger.info("Not modified: %s", etag)
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{etag}"'})
+
+
+def _fieldset(names: str) -> tuple:
+    """Returns the customer_fieldset() of the ?fields= argument"""
+    try:
+        return customer_fieldset(names)
+    except ValueError as error:
+        return abort(status.HTTP_400_BAD_REQUEST, str(error))
+
+
+def filter_criteria(args: dict) -> dict:
+    """Returns the queries.filters() criteria of the query arguments"""
+    criteria = {name: args[name] for name in FILTER_ARGS if args[name] not in (None, "")}
+    if criteria:
+        app.logger.info("Filtering by: %s", criteria)
+    return criteria
+
+
+def _count(clauses: list) -> Response:
+    """Returns the number of Customers that match the clauses in X-Total-Count"""
+    total = queries.count(clauses)
+    app.logger.info("[%s] Customers counted", total)
+    return Response(
+        dumps({"count": total}),
+        status=status.HTTP_200_OK,
+        mimetype="application/json",
+        headers={"X-Total-Count": str(total)},
+    )
+
+
+def _search(args: dict, serializer: RowSerializer, columns: list) -> Response:
+    """Returns the Customers that best match the ?q= search, best first"""
+    app.logger.info("Searching for: %s", args["q"])
+    if search_conflicts(args):
+        abort(status.HTTP_400_BAD_REQUEST, SEARCH_CONFLICT)
+    limit = min(args["limit"] or app.config["SEARCH_LIMIT"], app.config["MAX_PAGE_SIZE"])
+    rows = queries.search(args["q"], limit, columns)
+    app.logger.info("[%s] Customers found", len(rows))
+    etag = make_list_etag((row.id, row.version) for row in rows)
+    with metrics.serialization():
+        body = serializer.dumps(rows)
+    return Response(
+        body, status=status.HTTP_200_OK, mimetype="application/json", headers={"ETag": f'"{etag}"'}
+    )
+
+
+def search_conflicts(args: dict) -> bool:
+    """Whether ?q= is combined with query arguments a search cannot honor"""
+    return (
+        any(args[name] not in (None, "") for name in FILTER_ARGS)
+        or args["after"] is not None
+        or args["stream"]
+        or args["count"]
+        or args["sort"] != "id"
+    )
+
+
+def event_message(event: dict) -> bytes:
+    """Returns a change event as a Server-Sent Events message"""
+    customer = event["customer"]
+    data = {
+        "type": event["type"],
+        "id": str(event["id"]),
+        "version": event["version"],
+        "customer": None if customer is None else customer_rows.from_mapping(customer),
+    }
+    return format_event(event, dumps(data))
+
+
+def _change(row) -> dict:
+    """Returns one change of the change feed"""
+    customer = None if row.deleted else customer_rows.to_dict(row)
+    return {
+        "seq": row.seq,
+        "id": str(row.id),
+        "deleted": row.deleted,
+        "changed_at": row.changed_at.isoformat(),
+        "version": None if row.deleted else row.version,
+        "customer": customer,
+    }
+
+
+def query_key(args: dict, limit: int) -> tuple:
+    """Returns the key identical list queries share while one is in flight
+
+    The key changes with every write of this worker, so no query joins one
+    that started before the write.
+    """
+    params = tuple(sorted((name, value) for name, value in args.items() if value not in (None, "")))
+    return Customer.search_generation, limit, params
+
+
+def _query_params(args: dict, **overrides) -> dict:
+    """Returns the non-empty query arguments with overrides applied"""
+    params = {
+        key: value
+        for key, value in args.items()
+        if value not in (None, "") and key not in ("stream", "count")
+    }
+    params.update(overrides)
+    return params
+
+
+def _ndjson(rows, serializer: RowSerializer):
+    """Yields each Customer row as one line of newline delimited JSON"""
+    for row in rows:
+        with metrics.serialization():
+            line = serializer.dumps_line(row)
+        yield line
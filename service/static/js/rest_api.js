@@ -10,8 +10,7 @@ $(function () {
         $("#customer_first_name").val(res.first_name);
         $("#customer_last_name").val(res.last_name);
         $("#customer_email").val(res.email);
-        $("#customer_salt").val(res.salt);
-        $("#customer_password").val(res.password);
+        $("#customer_password").val("");
         $("#customer_address").val(res.address);
         if (res.active == true) {
             $("#customer_active").val("true");
@@ -27,7 +26,6 @@ $(function () {
         $("#customer_email").val("");
         $("#customer_address").val("");
         $("#customer_active").val("");
-        $("#customer_salt").val("");
         $("#customer_password").val("");
     }
 
@@ -48,7 +46,6 @@ $(function () {
         let email = $("#customer_email").val();
         let address = $("#customer_address").val();
         let active = $("#customer_active").val() == "true";
-        let salt = $("#customer_salt").val();
         let password = $("#customer_password").val();
 
         let data = {
@@ -57,7 +54,6 @@ $(function () {
             "email": email,
             "address": address,
             "active": active,
-            "salt": salt,
             "password": password
         };
 
@@ -93,7 +89,6 @@ $(function () {
         let email = $("#customer_email").val();
         let address = $("#customer_address").val();
         let active = $("#customer_active").val() == "true";
-        let salt = $("#customer_salt").val();
         let password = $("#customer_password").val();
 
         let data = {
@@ -101,10 +96,12 @@ $(function () {
             "last_name": lastName,
             "email": email,
             "address": address,
-            "active": active,
-            "salt": salt,
-            "password": password
+            "active": active
         };
+        // Leave the password out to keep the current one
+        if (password) {
+            data.password = password;
+        }
 
         $("#flash_message").empty();
 
@@ -254,13 +251,11 @@ $(function () {
             table += '<th class="col-md-3">Email</th>'
             table += '<th class="col-md-4">Address</th>'
             table += '<th class="col-md-1">Active</th>'
-            table += '<th class="col-md-4">Salt</th>'
-            table += '<th class="col-md-4">Password</th>'
             table += '</tr></thead><tbody>'
             let firstCustomer = "";
             for(let i = 0; i < res.length; i++) {
                 let customer = res[i];
-                table +=  `<tr id="row_${i}"><td>${customer.id}</td><td>${customer.first_name}</td><td>${customer.last_name}</td><td>${customer.email}</td><td>${customer.address}</td><td>${customer.active}</td><td>${customer.salt}</td><td>${customer.password}</td></tr>`;
+                table +=  `<tr id="row_${i}"><td>${customer.id}</td><td>${customer.first_name}</td><td>${customer.last_name}</td><td>${customer.email}</td><td>${customer.address}</td><td>${customer.active}</td></tr>`;
                 if (i == 0) {
                     firstCustomer = customer;
                 }
@@ -2,10 +2,21 @@
 Test Factory to make fake objects for testing
 """
 import os
-import hashlib
 import factory
+from service.common.passwords import SALT_BYTES, hash_password
 from service.models import Customer
 
+# The password of every fake Customer. It is hashed once with a tiny cost
+# so building Customers stays cheap; verifying it upgrades the hash.
+PASSWORD = "P@ssw0rd!123"
+SALT = os.urandom(SALT_BYTES).hex()
+PASSWORD_HASH = hash_password(PASSWORD, SALT, "scrypt", 2**4)
+
+
+def customer_payload(customer: Customer) -> dict:
+    """Returns the JSON body that creates a Customer with PASSWORD"""
+    return dict(customer.serialize(), password=PASSWORD)
+
 
 class CustomerFactory(factory.Factory):
     """Creates fake customers"""
@@ -20,6 +31,6 @@ class CustomerFactory(factory.Factory):
     last_name = factory.Faker("last_name")
     email = factory.Faker("ascii_email")
     address = factory.Faker("address")
-    salt = os.urandom(16).hex()
-    password = factory.LazyAttribute(lambda obj: hashlib.sha256(obj.salt.encode() + "P@ssw0rd!123".encode()).hexdigest())
+    salt = SALT
+    password = PASSWORD_HASH
     active = True
@@ -0,0 +1,350 @@
+"""
+ASGI Entry Point Test Suite
+
+Test cases can be run with the following:
+  green -vvv tests/test_asgi.py
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from unittest import TestCase
+from unittest.mock import patch
+from starlette.testclient import TestClient
+from service import app as flask_app, config
+from service.asgi import app
+from service.common import status  # HTTP Status Codes
+from service.common.events import EventBroker
+from service.models import Customer, Tombstone, db, init_db
+from tests.factories import PASSWORD, CustomerFactory, customer_payload
+
+BASE_URL = "/api/customers"
+
+
+######################################################################
+#  T E S T   F I X T U R E S
+######################################################################
+class AsgiServerCase(TestCase):
+    """Runs each test against the ASGI app with a clean database"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        flask_app.config["TESTING"] = True
+        flask_app.config["DEBUG"] = False
+        flask_app.config["SQLALCHEMY_DATABASE_URI"] = config.DATABASE_URI
+        flask_app.logger.setLevel(logging.CRITICAL)
+        init_db(flask_app)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.stack = ExitStack()
+        self.stack.enter_context(flask_app.app_context())
+        db.session.query(Customer).delete()  # clean up the last tests
+        db.session.query(Tombstone).delete()
+        db.session.commit()
+        Customer.cache.clear()
+        self.client = self.stack.enter_context(TestClient(app))  # runs the lifespan that creates the engine
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        self.stack.close()
+
+    def _create_customers(self, count):
+        """Creates Customers through the ASGI app"""
+        customers = []
+        for _ in range(count):
+            data = customer_payload(CustomerFactory())
+            response = self.client.post(BASE_URL, json=data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            customers.append(response.json())
+        return customers
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAsgiServer(AsgiServerCase):
+    """ASGI Server Tests"""
+
+    def test_create_customer(self):
+        """It should Create a Customer"""
+        data = customer_payload(CustomerFactory())
+        response = self.client.post(BASE_URL, json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        new_customer = response.json()
+        self.assertEqual(new_customer["email"], data["email"])
+        self.assertTrue(response.headers["Location"].endswith(f"{BASE_URL}/{new_customer['id']}"))
+        self.assertEqual(response.headers["ETag"], f'"{new_customer["id"]}-1"')
+        self.assertNotIn("password", new_customer)
+        self.assertNotIn("salt", new_customer)
+
+    def test_create_customer_bad_data(self):
+        """It should not Create a Customer with missing or invalid data"""
+        response = self.client.post(BASE_URL, json={"first_name": "Joe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("missing last_name", response.json()["message"])
+        response = self.client.post(BASE_URL, content="not json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer(self):
+        """It should Get a Customer like the WSGI app does"""
+        customer = self._create_customers(1)[0]
+        response = self.client.get(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), customer)
+        wsgi = flask_app.test_client().get(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(response.json(), wsgi.get_json())
+        self.assertEqual(response.headers["ETag"], wsgi.headers["ETag"])
+
+    def test_access_log(self):
+        """It should return the request id and log the access like the WSGI app does"""
+        customer = self._create_customers(1)[0]
+        flask_app.config["ACCESS_LOG"] = True
+        try:
+            with self.assertLogs("service.access", level="INFO") as logs:
+                response = self.client.get(f"{BASE_URL}/{customer['id']}", headers={"X-Request-ID": "abc-123"})
+        finally:
+            flask_app.config["ACCESS_LOG"] = False
+        self.assertEqual(response.headers["X-Request-ID"], "abc-123")
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), f"GET {BASE_URL}/{customer['id']} 200")
+        self.assertEqual(record.request_id, "abc-123")
+        self.assertEqual(record.route, "CustomerResource")
+
+    def test_get_customer_fields(self):
+        """It should Get only the requested fields of a Customer"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer['id']}"
+        Customer.cache.clear()
+        response = self.client.get(url, params={"fields": "id,active"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"id": customer["id"], "active": True})
+        self.assertIsNone(Customer.cache.get(str(customer["id"])))  # partial rows are not cached
+        self.client.get(url)
+        self.assertEqual(self.client.get(url, params={"fields": "email"}).json(), {"email": customer["email"]})
+        response = self.client.get(url, params={"fields": "password"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_not_modified(self):
+        """It should answer 304 when the If-None-Match ETag still matches"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer['id']}"
+        etag = self.client.get(url).headers["ETag"]
+        Customer.cache.clear()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_customer_not_found(self):
+        """It should not Get a Customer that is not found"""
+        response = self.client.get(f"{BASE_URL}/0")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("was not found", response.json()["message"])
+
+    def test_update_customer(self):
+        """It should Update a Customer and honor If-Match"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer['id']}"
+        self.client.get(url)  # cache it
+        data = dict(customer, last_name="Unknown")
+        response = self.client.put(url, json=data, headers={"If-Match": f'"{customer["id"]}-1"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["last_name"], "Unknown")
+        self.assertEqual(self.client.get(url).json()["last_name"], "Unknown")
+
+        response = self.client.put(url, json=data, headers={"If-Match": f'"{customer["id"]}-1"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.put(f"{BASE_URL}/0", json=data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.put(url, json={"first_name": "Joe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_verify_password(self):
+        """It should Verify a Customer's password like the WSGI app does"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer['id']}/verify-password"
+        response = self.client.post(url, json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"id": customer["id"], "verified": True})
+        self.assertEqual(self.client.post(url, json={"password": "x"}).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.post(url, json=[]).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/0/verify-password", json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_verify_password_upgrades_hash(self):
+        """It should rehash an old password hash without reporting a change"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id, change_seq, updated_at = customer.id, customer.change_seq, customer.updated_at
+        self.assertTrue(Customer.hasher.needs_rehash(customer.password))
+        response = self.client.post(f"{BASE_URL}/{customer_id}/verify-password", json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        db.session.remove()
+        stored = Customer.find(customer_id)
+        self.assertFalse(Customer.hasher.needs_rehash(stored.password))
+        self.assertEqual((stored.version, stored.change_seq, stored.updated_at), (1, change_seq, updated_at))
+
+    def test_update_customer_password(self):
+        """It should only change the password when an update sends one"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer['id']}"
+        self.client.put(url, json=dict(customer, last_name="Snow"))
+        response = self.client.post(f"{url}/verify-password", json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.put(url, json=dict(customer, password="n3w-Secret"))
+        response = self.client.post(f"{url}/verify-password", json={"password": "n3w-Secret"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivate_customer(self):
+        """It should Deactivate a Customer"""
+        customer = self._create_customers(1)[0]
+        response = self.client.put(f"{BASE_URL}/{customer['id']}/deactivate")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.json()["active"])
+        response = self.client.put(f"{BASE_URL}/0/deactivate")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_customer(self):
+        """It should Delete a Customer"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer['id']}"
+        self.client.get(url)  # cache it
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        changes = self.client.get(f"{BASE_URL}/changes").json()["changes"]
+        self.assertEqual([(c["id"], c["deleted"]) for c in changes], [(str(customer["id"]), True)])
+
+    def test_customer_events(self):
+        """It should stream changes as Server-Sent Events on the event loop"""
+        responses = []
+        with patch.object(Customer, "events", EventBroker(buffer_size=1)):
+            reader = threading.Thread(target=lambda: responses.append(self.client.get(f"{BASE_URL}/events")))
+            reader.start()
+            for _ in range(100):
+                if Customer.events.info()["subscribers"]:
+                    break
+                time.sleep(0.05)
+            customer = self._create_customers(1)[0]
+            # two more events overflow the buffer whether or not the first was sent
+            Customer.events.deliver([{"type": "deleted", "id": 0, "version": None, "customer": None}] * 2)
+            reader.join(10)
+            self.assertFalse(reader.is_alive())
+            self.assertEqual(Customer.events.info()["subscribers"], 0)
+        response = responses[0]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Accel-Buffering"], "no")
+        messages = response.text.split("\n\n")
+        self.assertEqual(messages[0], "retry: 3000")
+        event, data = messages[1].split("\n")
+        self.assertEqual(event, "event: created")
+        self.assertEqual(json.loads(data[len("data: "):])["customer"], customer)
+        self.assertIn("event: dropped\ndata: {}", messages)
+
+    def test_other_paths_use_wsgi(self):
+        """It should serve every other path with the WSGI app"""
+        response = self.client.get("/health")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"status": "OK"})
+        response = self.client.post(f"{BASE_URL}/batch", json=[customer_payload(CustomerFactory())])
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+
+
+######################################################################
+#  C O L L E C T I O N   T E S T   C A S E S
+######################################################################
+class TestAsgiCollection(AsgiServerCase):
+    """ASGI Collection Tests"""
+
+    def test_list_customers_fields(self):
+        """It should list only the requested fields like the WSGI app does"""
+        self._create_customers(3)
+        response = self.client.get(BASE_URL, params={"fields": "id,email", "limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([set(c) for c in response.json()], [{"id", "email"}] * 2)
+        wsgi = flask_app.test_client().get(BASE_URL, query_string={"fields": "id,email", "limit": 2})
+        self.assertEqual(response.json(), wsgi.get_json())
+        self.assertIn("X-Next-Cursor", response.headers)
+        response = self.client.get(BASE_URL, params={"fields": "id,nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_customers(self):
+        """It should page through the Customers with a cursor"""
+        customers = self._create_customers(5)
+        response = self.client.get(BASE_URL, params={"limit": 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), customers[:3])
+        self.assertEqual(response.headers["X-Next-Cursor"], customers[2]["id"])
+        self.assertIn(f"after={customers[2]['id']}", response.headers["Link"])
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, flask_app.test_client().get(f"{BASE_URL}?limit=3").headers["ETag"])
+
+        response = self.client.get(BASE_URL, params={"limit": 3}, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(BASE_URL, params={"limit": 3, "after": customers[2]["id"]})
+        self.assertEqual(response.json(), customers[3:])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+    def test_list_customers_bad_arguments(self):
+        """It should reject invalid paging arguments"""
+        self.assertEqual(self.client.get(BASE_URL, params={"limit": 0}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(BASE_URL, params={"after": "x"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_sort_and_count(self):
+        """It should filter, sort and count Customers like the WSGI app does"""
+        self._create_customers(5)
+        wsgi = flask_app.test_client()
+        for params in ({"active": "true", "sort": "-email"}, {"min_id": 0, "sort": "first_name", "limit": 2}):
+            response = self.client.get(BASE_URL, params=params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), wsgi.get(BASE_URL, query_string=params).get_json())
+        cursor = response.headers["X-Next-Cursor"]
+        params = {"sort": "first_name", "limit": 2, "after": cursor}
+        self.assertEqual(
+            self.client.get(BASE_URL, params=params).json(), wsgi.get(BASE_URL, query_string=params).get_json()
+        )
+
+        response = self.client.head(BASE_URL, params={"active": "true"})
+        self.assertEqual(response.headers["X-Total-Count"], "5")
+        response = self.client.get(BASE_URL, params={"count": "true", "max_id": 0})
+        self.assertEqual(response.json(), {"count": 0})
+        for params in ({"sort": "salt"}, {"active": "maybe"}, {"sort": "last_name", "after": 0}):
+            response = self.client.get(BASE_URL, params=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_by_email(self):
+        """It should Query Customers by email, ignoring case"""
+        customers = self._create_customers(3)
+        email = customers[1]["email"]
+        response = self.client.get(BASE_URL, params={"email": email.upper()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c["email"] for c in response.json()], [email])
+
+    def test_search_customers(self):
+        """It should Search Customers like the WSGI app does"""
+        customers = self._create_customers(3)
+        word = customers[1]["last_name"]
+        response = self.client.get(BASE_URL, params={"q": word})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(customers[1], response.json())
+        wsgi = flask_app.test_client().get(BASE_URL, query_string={"q": word})
+        self.assertEqual(response.json(), wsgi.get_json())
+        self.assertEqual(response.headers["ETag"], wsgi.headers["ETag"])
+        response = self.client.get(BASE_URL, params={"q": "@!"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, params={"q": word, "stream": "true"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_customers(self):
+        """It should stream the Customers as NDJSON"""
+        customers = self._create_customers(3)
+        response = self.client.get(BASE_URL, params={"stream": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        lines = [line for line in response.text.splitlines() if line]
+        self.assertEqual(len(lines), len(customers))
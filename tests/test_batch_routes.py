@@ -0,0 +1,94 @@
+"""
+Batch API Test Suite
+"""
+from service.common import status  # HTTP Status Codes
+from service.models import Customer
+from tests.factories import CustomerFactory, customer_payload
+from tests.test_routes import BASE_URL, CustomerServerCase
+
+
+######################################################################
+#  B A T C H   T E S T   C A S E S
+######################################################################
+class TestBatchRoutes(CustomerServerCase):
+    """Batch Create, Update and Delete Tests"""
+
+    def test_create_customers_batch(self):
+        """It should Create a batch of Customers and report bad items"""
+        payload = [customer_payload(customer) for customer in CustomerFactory.build_batch(3)]
+        del payload[1]["email"]
+        response = self.client.post(f"{BASE_URL}/batch?chunk_size=1", json=payload)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.get_json()
+        self.assertEqual([r["status"] for r in results], [201, 400, 201])
+        self.assertIn("email", results[1]["error"])
+        for result in (results[0], results[2]):
+            customer = Customer.find(result["id"])
+            self.assertEqual(customer.email, payload[result["index"]]["email"])
+        self.assertEqual(len(Customer.all()), 2)
+
+    def test_create_customers_batch_atomic(self):
+        """It should not Create any Customers in an atomic batch with bad items"""
+        payload = [customer_payload(customer) for customer in CustomerFactory.build_batch(3)]
+        del payload[2]["address"]
+        response = self.client.post(f"{BASE_URL}/batch?atomic=true", json=payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(Customer.all()), 0)
+
+    def test_create_customers_batch_not_array(self):
+        """It should not Create a batch that is not an array"""
+        response = self.client.post(f"{BASE_URL}/batch", json={"first_name": "x"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_customers_batch(self):
+        """It should Update a batch of Customers"""
+        customers = self._create_customers(2)
+        payload = []
+        for customer in customers:
+            data = customer.serialize()
+            data["id"] = int(customer.id)
+            data["last_name"] = "Snow"
+            payload.append(data)
+        payload.append(dict(payload[0], id=0))
+        payload.append(dict(payload[0], id="one"))
+        response = self.client.put(f"{BASE_URL}/batch", json=payload)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.get_json()
+        self.assertEqual([r["status"] for r in results], [200, 200, 404, 400])
+        for customer in customers:
+            self.assertEqual(Customer.find(int(customer.id)).last_name, "Snow")
+
+    def test_update_customers_batch_atomic(self):
+        """It should not Update any Customers in an atomic batch with an unknown id"""
+        customers = self._create_customers(2)
+        payload = []
+        for customer in customers:
+            data = customer.serialize()
+            data["id"] = int(customer.id)
+            data["last_name"] = "Snow"
+            payload.append(data)
+        payload.append(dict(payload[0], id=0))
+        response = self.client.put(f"{BASE_URL}/batch?atomic=true&chunk_size=1", json=payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("batch item 2 was not found", response.get_json()["message"])
+        for customer in customers:
+            self.assertEqual(Customer.find(int(customer.id)).last_name, customer.last_name)
+
+    def test_delete_customers_batch(self):
+        """It should Delete a batch of Customers"""
+        customers = self._create_customers(3)
+        ids = [int(customer.id) for customer in customers[:2]]
+        response = self.client.delete(f"{BASE_URL}/batch", json=ids + [0, "x"])
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.get_json()
+        self.assertEqual([r["status"] for r in results], [204, 204, 404, 400])
+        remaining = Customer.all()
+        self.assertEqual([c.id for c in remaining], [int(customers[2].id)])
+
+    def test_delete_customers_batch_atomic(self):
+        """It should not Delete any Customers in an atomic batch with an unknown id"""
+        customers = self._create_customers(2)
+        ids = [int(customer.id) for customer in customers]
+        response = self.client.delete(f"{BASE_URL}/batch?atomic=true", json=ids + [0])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sorted(c.id for c in Customer.all()), sorted(ids))
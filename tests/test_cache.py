@@ -0,0 +1,122 @@
+"""
+Test cases for the read-through cache backends
+"""
+import fnmatch
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.cache import Cache, LRUCache, NullCache, SharedCache, create_cache
+
+
+class FakeRedis:
+    """A local stand-in for the parts of a Redis client the cache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        """Returns a stored value"""
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):  # pylint: disable=unused-argument
+        """Stores a value"""
+        self.data[key] = value
+
+    def delete(self, key):
+        """Removes a value and returns how many were removed"""
+        return 1 if self.data.pop(key, None) is not None else 0
+
+    def scan_iter(self, match):
+        """Yields the keys matching a pattern"""
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestCache(TestCase):
+    """Test Cases for the cache backends"""
+
+    def test_lru_hit_and_miss(self):
+        """It should count hits and misses"""
+        cache = LRUCache(max_size=2, ttl=60)
+        self.assertIsNone(cache.get("1"))
+        cache.set("1", {"id": 1})
+        self.assertEqual(cache.get("1"), {"id": 1})
+        self.assertEqual(cache.stats.hits, 1)
+        self.assertEqual(cache.stats.misses, 1)
+
+    def test_miss_default(self):
+        """It should return the default on a miss from every backend"""
+        self.assertRaises(TypeError, Cache)
+        for cache in (NullCache(), LRUCache(), SharedCache(FakeRedis())):
+            self.assertEqual(cache.get("1", {}), {})
+            self.assertEqual(cache.stats.misses, 1)
+
+    def test_lru_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("1", 1)
+        cache.set("2", 2)
+        cache.get("1")
+        cache.set("3", 3)
+        self.assertIsNone(cache.get("2"))
+        self.assertEqual(cache.get("1"), 1)
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertEqual(cache.info()["size"], 2)
+
+    def test_lru_expires_entries(self):
+        """It should treat entries older than the ttl as misses"""
+        cache = LRUCache(max_size=2, ttl=10)
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            cache.set("1", 1)
+        with patch("service.common.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.stats.expirations, 1)
+
+    def test_lru_delete_and_clear(self):
+        """It should invalidate and clear entries"""
+        cache = LRUCache()
+        cache.set("1", 1)
+        cache.set("2", 2)
+        cache.delete("1")
+        cache.delete("missing")
+        self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.stats.invalidations, 1)
+        cache.clear()
+        self.assertIsNone(cache.get("2"))
+
+    def test_shared_cache(self):
+        """It should store JSON values in a shared client"""
+        client = FakeRedis()
+        cache = SharedCache(client, ttl=30)
+        self.assertIsNone(cache.get("1"))
+        cache.set("1", {"id": 1})
+        self.assertIn("customers:1", client.data)
+        self.assertEqual(cache.get("1"), {"id": 1})
+        cache.delete("1")
+        self.assertIsNone(cache.get("1"))
+        cache.set("2", 2)
+        cache.clear()
+        self.assertEqual(client.data, {})
+        self.assertEqual(cache.info()["hits"], 1)
+
+    def test_null_cache(self):
+        """It should never store anything"""
+        cache = NullCache()
+        cache.set("1", 1)
+        cache.delete("1")
+        cache.clear()
+        self.assertIsNone(cache.get("1"))
+
+    def test_create_cache(self):
+        """It should create the configured backend"""
+        self.assertIsInstance(create_cache({"CACHE_TYPE": "none"}), NullCache)
+        cache = create_cache({"CACHE_TYPE": "LRU", "CACHE_MAX_SIZE": 5, "CACHE_TTL": 1})
+        self.assertIsInstance(cache, LRUCache)
+        self.assertEqual(cache.max_size, 5)
+        self.assertRaises(RuntimeError, create_cache, {"CACHE_TYPE": "memcached"})
+
+    def test_create_redis_cache_without_redis(self):
+        """It should refuse the redis backend when redis is not installed"""
+        with patch.dict("sys.modules", {"redis": None}):
+            self.assertRaises(RuntimeError, create_cache, {"CACHE_TYPE": "redis"})
@@ -0,0 +1,74 @@
+"""
+Change Feed and Server-Sent Events Test Suite
+"""
+import json
+from unittest.mock import patch
+
+from service.common import status  # HTTP Status Codes
+from service.common.events import EventBroker
+from service.models import Customer
+from tests.test_routes import BASE_URL, CustomerServerCase
+
+
+######################################################################
+#  C H A N G E S   T E S T   C A S E S
+######################################################################
+class TestCustomerChanges(CustomerServerCase):
+    """Change Feed and Event Stream Tests"""
+
+    def test_customer_events(self):
+        """It should stream committed changes as Server-Sent Events until the client falls behind"""
+        with patch.object(Customer, "events", EventBroker(buffer_size=1)):
+            response = self.client.get(f"{BASE_URL}/events")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.mimetype, "text/event-stream")
+            self.assertEqual(response.headers["Cache-Control"], "no-cache")
+            self.assertEqual(Customer.events.info()["subscribers"], 1)
+            customer = self._create_customers(1)[0]
+            Customer.events.deliver([{"type": "deleted", "id": 0, "version": None, "customer": None}])
+            body = b"".join(response.response).decode()
+            response.close()
+            self.assertEqual(Customer.events.info()["subscribers"], 0)
+        messages = body.split("\n\n")
+        self.assertEqual(messages[0], "retry: 3000")
+        name, data = messages[1].split("\n")
+        self.assertEqual(name, "event: created")
+        data = json.loads(data[len("data: "):])
+        self.assertEqual(data["id"], str(customer.id))
+        self.assertEqual(data["customer"]["email"], customer.email)
+        self.assertNotIn("password", data["customer"])
+        self.assertEqual(messages[2], "event: dropped\ndata: {}")
+
+    def test_customer_changes(self):
+        """It should return the changes since a sequence number, with tombstones"""
+        customers = self._create_customers(3)
+        response = self.client.get(f"{BASE_URL}/changes?limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([change["id"] for change in data["changes"]], [str(c.id) for c in customers[:2]])
+        self.assertEqual(data["next"], data["changes"][-1]["seq"])
+        self.assertEqual(response.headers["X-Next-Cursor"], str(data["next"]))
+        self.assertIn(f"since={data['next']}", response.headers["Link"])
+        change = data["changes"][0]
+        self.assertFalse(change["deleted"])
+        self.assertEqual(change["version"], 1)
+        self.assertEqual(change["customer"]["email"], customers[0].email)
+        self.assertNotIn("password", change["customer"])
+
+        since = data["next"]
+        self.client.put(f"{BASE_URL}/{customers[0].id}/deactivate")
+        self.client.delete(f"{BASE_URL}/{customers[1].id}")
+        response = self.client.get(f"{BASE_URL}/changes?since={since}")
+        data = response.get_json()
+        self.assertNotIn("Link", response.headers)
+        changes = [(change["id"], change["deleted"]) for change in data["changes"]]
+        self.assertEqual(
+            changes, [(str(customers[2].id), False), (str(customers[0].id), False), (str(customers[1].id), True)]
+        )
+        self.assertFalse(data["changes"][1]["customer"]["active"])
+        self.assertIsNone(data["changes"][2]["customer"])
+
+        response = self.client.get(f"{BASE_URL}/changes?since={data['next']}")
+        self.assertEqual(response.get_json(), {"changes": [], "next": data["next"]})
+        response = self.client.get(f"{BASE_URL}/changes?since=-1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -2,10 +2,16 @@
 CLI Command Extensions for Flask
 """
 import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service import app
+from service.common import queries
+from service.common.cli_commands import (
+    db_create, db_check_indexes, db_export, db_import, db_init, db_seed, jobs_worker
+)
+from service.models import Customer, Tombstone, db
 
 
 class TestFlaskCLI(TestCase):
@@ -13,6 +19,12 @@ class TestFlaskCLI(TestCase):
 
     def setUp(self):
         self.runner = CliRunner()
+        self.context = app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
 
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
@@ -21,3 +33,89 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    def test_db_init(self):
+        """It should create the missing tables and keep the others"""
+        result = self.runner.invoke(db_init)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("All tables are present", result.output)
+        Tombstone.__table__.drop(db.engine)
+        result = self.runner.invoke(db_init)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Created tables: customer_tombstone", result.output)
+        self.assertTrue(db.inspect(db.engine).has_table("customer_tombstone"))
+
+    def test_db_check_indexes(self):
+        """It should report that all indexes exist and explain the hot queries"""
+        result = self.runner.invoke(db_check_indexes)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("All indexes are present", result.output)
+        self.assertIn("EXPLAIN find by email:", result.output)
+
+    @patch('service.common.cli_commands.queries.missing_indexes')
+    def test_db_check_missing_indexes(self, missing_mock):
+        """It should fail when indexes are missing unless asked to create them"""
+        index = MagicMock()
+        index.name = "ix_customer_email_lower"
+        missing_mock.return_value = [index]
+        result = self.runner.invoke(db_check_indexes)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Missing index: ix_customer_email_lower", result.output)
+        index.create.assert_not_called()
+
+        result = self.runner.invoke(db_check_indexes, ["--create"])
+        self.assertEqual(result.exit_code, 0)
+        index.create.assert_called_once()
+
+    @patch('service.common.cli_commands.jobs.run_pending')
+    def test_jobs_worker(self, run_mock):
+        """It should run the queued jobs and exit with --once"""
+        job = MagicMock(id=7, kind="import", status="succeeded", processed=10, rejected=1)
+        run_mock.return_value = [job]
+        result = self.runner.invoke(jobs_worker, ["--once"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Job 7 (import) succeeded: 10 processed, 1 rejected", result.output)
+        run_mock.assert_called_once()
+
+    def test_db_seed(self):
+        """It should seed fake Customers in chunks and report the throughput"""
+        db.session.query(Customer).delete()
+        db.session.commit()
+        result = self.runner.invoke(db_seed, ["--count", "25", "--chunk-size", "10", "--seed", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Seeded 25 Customers in", result.output)
+        self.assertIn("rows/s", result.output)
+        customers = Customer.all()
+        self.assertEqual(len(customers), 25)
+        self.assertEqual(len({customer.email for customer in customers}), 25)
+        self.assertTrue(all(customer.version == 1 for customer in customers))
+
+        result = self.runner.invoke(db_seed, ["--count", "1", "--password", "s3cret"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        newest = max(Customer.all(), key=lambda customer: customer.id)
+        self.assertTrue(Customer.verify_password(newest.id, "s3cret"))
+
+    def test_db_export_import(self):
+        """It should export the Customers to a file and import them back"""
+        db.session.query(Customer).delete()
+        db.session.commit()
+        self.runner.invoke(db_seed, ["--count", "5"])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "customers.ndjson")
+            result = self.runner.invoke(db_export, [path, "--format", "ndjson", "--chunk-size", "2"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Exported 5 Customers", result.output)
+
+            db.session.query(Customer).delete()
+            db.session.commit()
+            result = self.runner.invoke(db_import, [path, "--format", "ndjson"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Imported 5 Customers, rejected 0", result.output)
+            self.assertEqual(queries.count([]), 5)
+
+            with open(path, "a", encoding="utf-8") as file:
+                file.write("{}\n")
+            result = self.runner.invoke(db_import, [path, "--format", "ndjson"])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("rejected 1", result.output)
+            self.assertIn("Rejected line 6: Invalid Customer: missing", result.output)
@@ -0,0 +1,135 @@
+"""
+Test cases for the Customer event brokers
+"""
+import json
+import threading
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import events
+from service.common.events import (
+    DROPPED_EVENT,
+    HEARTBEAT,
+    EventBroker,
+    NotifyBroker,
+    create_broker,
+    format_event,
+    notify_triggers,
+    stream_messages,
+)
+
+
+class FakeConnection:
+    """A local stand-in for the parts of a psycopg connection the listener uses"""
+
+    def __init__(self, payloads):
+        self.autocommit = False
+        self.statements = []
+        self.payloads = payloads
+        self.hang_up = threading.Event()
+        self.closed = threading.Event()
+
+    def execute(self, statement):
+        """Records a statement"""
+        self.statements.append(statement)
+
+    def notifies(self):
+        """Yields the notifications, then waits for the server to hang up"""
+        for payload in self.payloads:
+            yield SimpleNamespace(payload=payload)
+        self.hang_up.wait()
+
+    def close(self):
+        """Marks the connection closed"""
+        self.closed.set()
+
+
+######################################################################
+#  E V E N T   T E S T   C A S E S
+######################################################################
+class TestEvents(TestCase):
+    """Test Cases for the event brokers"""
+
+    def test_fan_out(self):
+        """It should deliver every event to every subscriber"""
+        broker = EventBroker(buffer_size=10)
+        first, second = broker.subscribe(), broker.subscribe()
+        broker.deliver([{"type": "created", "id": 1}, {"type": "deleted", "id": 2}])
+        self.assertEqual([event["id"] for event in first.take()], [1, 2])
+        self.assertEqual([event["id"] for event in second.wait(0)], [1, 2])
+        self.assertEqual(first.take(), [])
+        broker.unsubscribe(second)
+        broker.deliver([{"type": "created", "id": 3}])
+        self.assertEqual(len(first.take()), 1)
+        self.assertEqual(second.take(), [])
+        self.assertEqual(broker.info(), {"subscribers": 1, "delivered": 5, "dropped": 0, "channel": None})
+
+    def test_drop_slow_subscriber(self):
+        """It should drop a subscriber whose buffer is full without slowing the others"""
+        broker = EventBroker(buffer_size=2)
+        slow, fast = broker.subscribe(), broker.subscribe()
+        woken = []
+        fast._wake = lambda: woken.append(1)  # pylint: disable=protected-access
+        for by_id in range(3):
+            broker.deliver([{"type": "created", "id": by_id}])
+            fast.take()
+        self.assertTrue(slow.dropped)
+        self.assertFalse(fast.dropped)
+        self.assertEqual(len(slow.take()), 2)
+        self.assertEqual(len(woken), 3)
+        self.assertEqual(broker.info()["subscribers"], 1)
+        self.assertEqual(broker.info()["dropped"], 1)
+
+    def test_listening(self):
+        """It should only be listening with subscribers"""
+        broker = EventBroker()
+        self.assertFalse(broker.listening)
+        broker.subscribe()
+        self.assertTrue(broker.listening)
+
+    def test_notify_broker(self):
+        """It should LISTEN on a connection of its own and deliver the notifications"""
+        connection = FakeConnection([json.dumps({"type": "created", "id": 7})])
+        broker = NotifyBroker(lambda: connection)
+        with patch.object(events, "LISTEN_RETRY_SECONDS", 60):
+            subscription = broker.subscribe()
+            self.assertEqual(subscription.wait(5), [{"type": "created", "id": 7}])
+            connection.hang_up.set()
+            self.assertTrue(connection.closed.wait(5))
+        self.assertTrue(connection.autocommit)
+        self.assertEqual(
+            connection.statements,
+            ["LISTEN customer_events", f"SELECT pg_advisory_lock_shared({events.LISTEN_LOCK_KEY})"],
+        )
+        self.assertEqual(broker.info()["channel"], "customer_events")
+
+    def test_create_broker(self):
+        """It should only send events through the database on Postgres"""
+        config = {"EVENTS_BUFFER_SIZE": 5}
+        self.assertIsInstance(create_broker(config, "postgresql", None), NotifyBroker)
+        broker = create_broker(config, "sqlite", None)
+        self.assertNotIsInstance(broker, NotifyBroker)
+        self.assertEqual(broker.buffer_size, 5)
+
+    def test_notify_triggers(self):
+        """It should NOTIFY the rows each statement changed while someone listens"""
+        statements = notify_triggers("customer")
+        function = statements[1]
+        self.assertIn(f"objid = {events.LISTEN_LOCK_KEY}", function)
+        self.assertIn("new_row.change_seq <> old_row.change_seq", function)
+        self.assertIn(f"octet_length(event) > {events.MAX_PAYLOAD_BYTES}", statements[0])
+        self.assertNotIn("password", statements[0])
+        self.assertEqual(sum("FOR EACH STATEMENT" in statement for statement in statements), 3)
+
+    def test_format_event(self):
+        """It should format a Server-Sent Events message"""
+        self.assertEqual(format_event({"type": "deleted"}, b'{"id":"1"}'), b'event: deleted\ndata: {"id":"1"}\n\n')
+
+    def test_stream_messages(self):
+        """It should send the events, a keep-alive without any and end a dropped stream"""
+        broker = EventBroker(buffer_size=1)
+        subscription = broker.subscribe()
+        self.assertEqual(stream_messages(subscription, [], repr), [HEARTBEAT])
+        self.assertEqual(stream_messages(subscription, [1, 2], repr), ["1", "2"])
+        broker.deliver([{"id": 1}, {"id": 2}])
+        self.assertEqual(stream_messages(subscription, subscription.take(), repr), ["{'id': 1}", DROPPED_EVENT])
@@ -0,0 +1,71 @@
+"""
+Import and Export Job API Test Suite
+"""
+import json
+
+from service.common import status  # HTTP Status Codes
+from service.common import jobs
+from service.models import Customer
+from tests.test_routes import BASE_URL, CustomerServerCase
+
+
+######################################################################
+#  J O B   T E S T   C A S E S
+######################################################################
+class TestJobRoutes(CustomerServerCase):
+    """Import and Export Job Tests"""
+
+    def test_import_customers(self):
+        """It should queue an import and report its progress"""
+        body = "first_name,last_name,email,address,active\nJane,Doe,jane@example.com,1 Main St,true\n"
+        response = self.client.post(f"{BASE_URL}/imports", data=body, content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = response.get_json()
+        self.assertEqual((job["kind"], job["format"], job["status"]), ("import", "csv", "queued"))
+        self.assertTrue(response.headers["Location"].endswith(f"/api/jobs/{job['id']}"))
+
+        jobs.run_pending()
+        response = self.client.get(f"/api/jobs/{job['id']}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        job = response.get_json()
+        self.assertEqual((job["status"], job["processed"], job["rejected"]), ("succeeded", 1, 0))
+        self.assertIsNone(job["result"])
+        self.assertEqual(Customer.find_by_email("jane@example.com").count(), 1)
+
+        response = self.client.post(f"{BASE_URL}/imports?format=ndjson", data=b"", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.get_json()["format"], "ndjson")
+        response = self.client.post(f"{BASE_URL}/imports", data=b"", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_customers(self):
+        """It should queue an export and download its file once it has succeeded"""
+        customers = self._create_customers(3)
+        self.client.put(f"{BASE_URL}/{customers[0].id}/deactivate")
+        response = self.client.post(f"{BASE_URL}/exports?format=ndjson&active=true")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = response.get_json()
+        self.assertEqual(job["params"], {"active": True})
+        response = self.client.get(f"/api/jobs/{job['id']}/result")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        jobs.run_pending()
+        job = self.client.get(f"/api/jobs/{job['id']}").get_json()
+        self.assertEqual((job["status"], job["total"], job["processed"]), ("succeeded", 2, 2))
+        response = self.client.get(job["result"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        response.close()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [int(customers[1].id), int(customers[2].id)])
+
+        response = self.client.post(f"{BASE_URL}/exports?format=xml")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_job_not_found(self):
+        """It should not find a Job that does not exist or an import's result"""
+        response = self.client.get("/api/jobs/0")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(f"{BASE_URL}/imports", data=b"", content_type="text/csv")
+        response = self.client.get(f"/api/jobs/{response.get_json()['id']}/result")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,213 @@
+"""
+Test cases for the import and export jobs
+"""
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from service import app, config
+from service.common import bulk, jobs, queries
+from service.common.passwords import UNUSABLE_PASSWORD
+from service.models import Customer, Job, db, init_db
+from tests.factories import PASSWORD, CustomerFactory
+
+CSV_IMPORT = """first_name,last_name,email,address,active,password
+Jane,Doe,jane@example.com,1 Main St,true,
+John,Doe,john@example.com,2 Main St,no,P@ssw0rd!123
+Short,Row
+Other,Row,other@example.com,4 Main St,maybe,
+"""
+
+
+######################################################################
+#  J O B   T E S T   C A S E S
+######################################################################
+class TestJobs(TestCase):
+    """Test Cases for the import and export jobs"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.config["SQLALCHEMY_DATABASE_URI"] = config.DATABASE_URI
+        app.logger.setLevel(logging.CRITICAL)
+        init_db(app)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.job_dir = tempfile.mkdtemp()
+        self.settings = patch.dict(app.config, {"JOB_DIR": self.job_dir, "JOB_WORKERS": 0})
+        self.settings.start()
+        self.context = app.app_context()
+        self.context.push()
+        db.session.query(Customer).delete()  # clean up the last tests
+        db.session.query(Job).delete()
+        db.session.commit()
+        Customer.cache.clear()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        self.context.pop()
+        self.settings.stop()
+        shutil.rmtree(self.job_dir)
+
+    def _import(self, text: str, fmt: str) -> Job:
+        """Queues and runs an import of a file"""
+        job = jobs.queue_import(io.BytesIO(text.encode()), fmt)
+        self.assertEqual(job.status, "queued")
+        self.assertEqual(jobs.run_pending(), [job])
+        return job
+
+    def _export(self, fmt: str, **criteria) -> str:
+        """Queues and runs an export and returns its file"""
+        job = jobs.queue_export(fmt, criteria)
+        jobs.run_pending()
+        self.assertEqual(job.status, "succeeded")
+        self.assertFalse(os.path.exists(f"{job.path}.part"))
+        with open(job.path, encoding="utf-8") as file:
+            return file.read()
+
+    ######################################################################
+    #  T E S T   C A S E S
+    ######################################################################
+
+    def test_import_csv(self):
+        """It should import the valid rows of a CSV file and report the others"""
+        with patch.dict(app.config, {"JOB_CHUNK_SIZE": 2}):
+            job = self._import(CSV_IMPORT, "csv")
+        self.assertEqual(job.status, "succeeded")
+        self.assertEqual((job.processed, job.rejected), (4, 2))
+        self.assertEqual(len(job.errors), 2)
+        self.assertTrue(job.errors[0].startswith("line 4: "))
+        self.assertIn("maybe", job.errors[1])
+        self.assertIsNotNone(job.started_at)
+        self.assertIsNotNone(job.finished_at)
+
+        jane = Customer.find_by_email("jane@example.com").first()
+        self.assertTrue(jane.active)
+        self.assertEqual(jane.version, 1)
+        self.assertEqual(jane.password, UNUSABLE_PASSWORD)
+        self.assertFalse(Customer.verify_password(jane.id, ""))
+        john = Customer.find_by_email("john@example.com").first()
+        self.assertFalse(john.active)
+        self.assertTrue(Customer.verify_password(john.id, PASSWORD))
+
+    def test_import_ndjson(self):
+        """It should import NDJSON rows and reject lines that are not Customers"""
+        lines = [
+            json.dumps({"first_name": "Jane", "last_name": "Doe", "email": "jane@example.com",
+                        "address": "1 Main St", "active": True}),
+            "",
+            "{not json",
+            "[1, 2]",
+            json.dumps({"first_name": "John", "last_name": "Doe", "email": "john@example.com",
+                        "address": "2 Main St", "active": "yes"}),
+        ]
+        job = self._import("\n".join(lines) + "\n", "ndjson")
+        self.assertEqual((job.processed, job.rejected), (4, 3))
+        self.assertEqual([error.split(":")[0] for error in job.errors], ["line 3", "line 4", "line 5"])
+        self.assertEqual(queries.count([]), 1)
+
+    def test_import_chunk_rejected(self):
+        """It should roll back and reject a chunk that the database refuses"""
+        with patch.dict(app.config, {"JOB_CHUNK_SIZE": 2}):
+            with patch.object(bulk, "copy_from", side_effect=db.engine.dialect.dbapi.Error("refused")):
+                job = self._import(CSV_IMPORT, "csv")
+        self.assertEqual(job.status, "succeeded")
+        self.assertEqual((job.processed, job.rejected), (4, 4))
+        self.assertIn("lines 2-3: refused", job.errors)
+        self.assertEqual(queries.count([]), 0)
+
+    def test_failed_job(self):
+        """It should record why a job failed"""
+        job = jobs.queue_import(io.BytesIO(b""), "csv")
+        os.remove(job.path)
+        jobs.run_pending()
+        self.assertEqual(job.status, "failed")
+        self.assertIn("No such file", job.message)
+
+    def test_export_csv(self):
+        """It should export the matching Customers as CSV in chunks"""
+        for active in (True, True, True, False):
+            CustomerFactory(id=None, active=active).create()
+        with patch.dict(app.config, {"JOB_CHUNK_SIZE": 2}):
+            text = self._export("csv", active=True)
+        rows = list(csv.reader(io.StringIO(text)))
+        self.assertEqual(rows[0], list(jobs.EXPORT_COLUMNS))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row[-1] for row in rows[1:]}, {"true"})
+        job = Job.query.one()
+        self.assertEqual((job.total, job.processed), (3, 3))
+        self.assertEqual(job.params, {"active": True})
+
+    def test_export_ndjson_round_trip(self):
+        """It should export NDJSON that imports back"""
+        customers = [CustomerFactory(id=None) for _ in range(3)]
+        for customer in customers:
+            customer.create()
+        text = self._export("ndjson")
+        rows = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([row["id"] for row in rows], sorted(customer.id for customer in customers))
+        self.assertEqual(set(rows[0]), set(jobs.EXPORT_COLUMNS))
+
+        db.session.query(Customer).delete()
+        db.session.commit()
+        job = self._import(text, "ndjson")
+        self.assertEqual((job.processed, job.rejected), (3, 0))
+        self.assertEqual(
+            sorted(customer.email for customer in Customer.all()),
+            sorted(customer.email for customer in customers),
+        )
+
+    def test_export_csv_round_trip(self):
+        """It should update the exported Customers in place when they are imported back"""
+        customers = [CustomerFactory(id=None) for _ in range(3)]
+        for customer in customers:
+            customer.create()
+        text = self._export("csv")
+        last_name = customers[0].last_name
+        Customer.update_by_id(customers[0].id, {"last_name": "Renamed"})
+        text += "0,New,Row,new@example.com,5 Main St,true\n"
+
+        job = self._import(text, "csv")
+        self.assertEqual((job.processed, job.rejected), (4, 0))
+        self.assertEqual(queries.count([]), 4)
+        first = Customer.find(customers[0].id)
+        self.assertEqual(first.last_name, last_name)
+        self.assertEqual(first.version, 3)
+        for customer in customers:
+            self.assertTrue(Customer.verify_password(customer.id, PASSWORD))
+        new = Customer.find_by_email("new@example.com").one()
+        self.assertEqual(new.password, UNUSABLE_PASSWORD)
+
+    def test_runner_threads(self):
+        """It should run queued jobs in a background thread"""
+        with patch.dict(app.config, {"JOB_WORKERS": 1, "JOB_POLL_INTERVAL": 0.05}):
+            runner = jobs.JobRunner()
+            runner.init_app(app)
+            with patch.object(jobs, "runner", runner):
+                job = jobs.queue_import(io.BytesIO(CSV_IMPORT.encode()), "csv")
+                for _ in range(200):
+                    db.session.rollback()  # see the runner's commits
+                    if job.status == "succeeded":
+                        break
+                    time.sleep(0.05)
+                self.assertEqual(len(runner._threads), 1)  # pylint: disable=protected-access
+                runner.stop()
+        self.assertEqual(job.status, "succeeded")
+        self.assertEqual(runner._threads, [])  # pylint: disable=protected-access
+
+    def test_no_runner_threads(self):
+        """It should leave jobs queued when JOB_WORKERS is 0"""
+        runner = jobs.JobRunner()
+        runner.init_app(app)
+        runner.notify()
+        self.assertEqual(runner._threads, [])  # pylint: disable=protected-access
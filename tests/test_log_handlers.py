@@ -0,0 +1,118 @@
+"""
+Test cases for the log handlers
+"""
+import io
+import json
+import logging
+from unittest import TestCase
+from flask import Flask
+from service.common.log_handlers import (
+    BackgroundHandler,
+    JsonFormatter,
+    RequestIdFilter,
+    SamplingFilter,
+    init_logging,
+    new_request_id,
+    request_id,
+)
+
+
+def _record(level=logging.INFO, message="hello", **extra):
+    """Returns a log record with some extra fields"""
+    record = logging.LogRecord("service", level, __file__, 1, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Test Cases for the log formatters, filters and handlers"""
+
+    def test_json_formatter(self):
+        """It should format a record as one JSON line"""
+        line = JsonFormatter().format(_record(request_id="abc", status=200, db_ms=1.5))
+        data = json.loads(line)
+        self.assertEqual(data["message"], "hello")
+        self.assertEqual(data["level"], "INFO")
+        self.assertEqual(data["logger"], "service")
+        self.assertEqual(data["request_id"], "abc")
+        self.assertEqual(data["status"], 200)
+        self.assertEqual(data["db_ms"], 1.5)
+        self.assertNotIn("route", data)
+        self.assertTrue(data["time"].endswith("+00:00"))
+        self.assertNotIn("\n", line)
+
+    def test_json_formatter_exception(self):
+        """It should include the traceback of an exception"""
+        with self.assertRaises(ValueError) as context:
+            raise ValueError("boom")
+        error = context.exception
+        record = _record(logging.ERROR, "failed", exc_info=(ValueError, error, error.__traceback__))
+        data = json.loads(JsonFormatter().format(record))
+        self.assertIn("ValueError: boom", data["exception"])
+
+    def test_request_id_filter(self):
+        """It should add the id of the request being served"""
+        token = request_id.set("abc")
+        try:
+            record = _record()
+            self.assertTrue(RequestIdFilter().filter(record))
+            self.assertEqual(record.request_id, "abc")
+        finally:
+            request_id.reset(token)
+
+    def test_sampling_filter(self):
+        """It should keep a share of the info records and every warning"""
+        self.assertTrue(SamplingFilter(1.0).filter(_record()))
+        never = SamplingFilter(0.0)
+        self.assertFalse(never.filter(_record(request_id="abc")))
+        self.assertFalse(never.filter(_record()))
+        self.assertTrue(never.filter(_record(logging.WARNING)))
+        half = SamplingFilter(0.5)
+        kept = [half.filter(_record(request_id=new_request_id())) for _ in range(1000)]
+        self.assertTrue(300 < sum(kept) < 700)
+        # the records of a request are kept or dropped together
+        self.assertEqual(len({half.filter(_record(request_id="abc")) for _ in range(10)}), 1)
+
+    def test_new_request_id(self):
+        """It should keep the id a request was sent with"""
+        self.assertEqual(new_request_id("abc"), "abc")
+        self.assertEqual(len(new_request_id()), 32)
+        self.assertEqual(len(new_request_id("x" * 500)), 32)
+
+    def test_background_handler(self):
+        """It should write records from a background thread"""
+        stream = io.StringIO()
+        target = logging.StreamHandler(stream)
+        handler = BackgroundHandler([target])
+        logger = logging.getLogger("test.background")
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            logger.warning("first")
+            logger.warning("second")
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertEqual(stream.getvalue(), "first\nsecond\n")
+
+    def test_init_logging(self):
+        """It should send the app's records through a background handler"""
+        stream = io.StringIO()
+        source = logging.getLogger("test.gunicorn")
+        source.addHandler(logging.StreamHandler(stream))
+        source.setLevel(logging.INFO)
+        app = Flask("test_init_logging")
+        app.config["LOG_FORMAT"] = "json"
+        try:
+            init_logging(app, "test.gunicorn")
+            self.assertIsInstance(app.logger.handlers[0], BackgroundHandler)
+            init_logging(app, "test.gunicorn")  # replaces the handler
+            self.assertEqual(len(app.logger.handlers), 1)
+            app.logger.handlers[0].close()
+        finally:
+            source.handlers = []
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line["message"] for line in lines], ["Logging handler established"] * 2)
@@ -6,10 +6,21 @@ Test cases for Customer Model
 import logging
 import unittest
 import hashlib
+import threading
+import time
+from unittest.mock import patch
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.schema import CreateIndex
 
-from service.models import Customer, DataValidationError, db
+from service.common import bulk, feed, queries
+from service.common.cache import LRUCache
+from service.common.events import LISTEN_LOCK_KEY, EventBroker
+from service.common.singleflight import SingleFlight
+from service.models import Customer, ConcurrentUpdateError, DataValidationError, Tombstone, db, dispose_engine
 from service import app, config
-from tests.factories import CustomerFactory
+from tests.factories import PASSWORD, CustomerFactory, customer_payload
 
 
 ######################################################################
@@ -27,16 +38,21 @@ class TestCustomer(unittest.TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = config.DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         Customer.init_db(app)
+        cls.context = app.app_context()
+        cls.context.push()
 
     @classmethod
     def tearDownClass(cls):
         """This runs once after the entire test suite"""
         db.session.close()
+        cls.context.pop()
 
     def setUp(self):
         """This runs before each test"""
         db.session.query(Customer).delete()  # clean up the last tests
+        db.session.query(Tombstone).delete()
         db.session.commit()
+        Customer.cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -86,9 +102,11 @@ class TestCustomer(unittest.TestCase):
         )
         self.assertTrue(customer is not None)
         self.assertEqual(customer.id, None)
-        customer.create()
+        data = customer.create()
         # Assert that it was assigned an id and shows up in the database
-        self.assertIsNotNone(customer.id)
+        self.assertIsNotNone(data["id"])
+        self.assertEqual(data["version"], 1)
+        self.assertEqual(data, customer.serialize())
         customers = Customer.all()
         self.assertEqual(len(customers), 1)
 
@@ -106,9 +124,7 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(found_customer.last_name, customer.last_name)
         self.assertEqual(found_customer.email, customer.email)
         self.assertEqual(found_customer.address, customer.address)
-        hashed_password = hashlib.sha256(found_customer.salt.encode() + "P@ssw0rd!123".encode()).hexdigest()
-        self.assertEqual(found_customer.password, hashed_password)
-        # self.assertEqual(found_customer.password, customer.password)
+        self.assertEqual(found_customer.password, customer.password)
         self.assertEqual(found_customer.active, customer.active)
 
     def test_update_a_customer(self):
@@ -175,16 +191,14 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(data["email"], customer.email)
         self.assertIn("address", data)
         self.assertEqual(data["address"], customer.address)
-        self.assertIn("password", data)
-        hashed_password = hashlib.sha256(customer.salt.encode() + "P@ssw0rd!123".encode()).hexdigest()
-        self.assertEqual(data["password"], hashed_password)
-        # self.assertEqual(data["password"], customer.password)
+        self.assertNotIn("password", data)
+        self.assertNotIn("salt", data)
         self.assertIn("active", data)
         self.assertEqual(data["active"], customer.active)
 
     def test_deserialize_a_customer(self):
         """It should de-serialize a Customer"""
-        data = CustomerFactory().serialize()
+        data = customer_payload(CustomerFactory())
         customer = Customer()
         customer.deserialize(data)
         self.assertNotEqual(customer, None)
@@ -193,11 +207,41 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(data["last_name"], customer.last_name)
         self.assertEqual(data["email"], customer.email)
         self.assertEqual(data["address"], customer.address)
-        # self.assertEqual(data["password"], customer.password)
-        hashed_password = hashlib.sha256(customer.salt.encode() + "P@ssw0rd!123".encode()).hexdigest()
-        self.assertEqual(data["password"], hashed_password)
+        self.assertNotEqual(customer.password, PASSWORD)
+        self.assertTrue(Customer.hasher.verify(PASSWORD, customer.salt, customer.password))
         self.assertEqual(data["active"], customer.active)
 
+    def test_deserialize_password(self):
+        """It should require a password to create but not to update"""
+        data = CustomerFactory().serialize()
+        self.assertRaises(DataValidationError, Customer().deserialize, data)
+        self.assertRaises(DataValidationError, Customer().deserialize, dict(data, password=""))
+        self.assertRaises(DataValidationError, Customer().deserialize, dict(data, password=42))
+
+        customer = Customer().deserialize(data, password_required=False)
+        self.assertIsNone(customer.password)
+        self.assertNotIn("password", customer.changes())
+        customer = Customer().deserialize(dict(data, password=PASSWORD), password_required=False)
+        changes = customer.changes()
+        self.assertEqual(changes["password"], customer.password)
+        self.assertNotIn("id", changes)
+
+    def test_verify_password(self):
+        """It should verify passwords and upgrade outdated hashes"""
+        customer = CustomerFactory()
+        customer.salt = "6edcc0329c89cb56c6ddfb4dfe451887"
+        customer.password = hashlib.sha256(customer.salt.encode() + PASSWORD.encode()).hexdigest()
+        customer.create()
+        customer_id = customer.id
+        self.assertFalse(Customer.verify_password(customer_id, "wrong"))
+        self.assertTrue(Customer.verify_password(customer_id, PASSWORD))
+        stored = db.session.get(Customer, customer_id)
+        db.session.refresh(stored)
+        self.assertTrue(stored.password.startswith(Customer.hasher.prefix))
+        self.assertNotEqual(stored.salt, "6edcc0329c89cb56c6ddfb4dfe451887")
+        self.assertTrue(Customer.verify_password(customer_id, PASSWORD))
+        self.assertIsNone(Customer.verify_password(0, PASSWORD))
+
     def test_deserialize_missing_data(self):
         """It should not deserialize a Customer with missing data"""
         data = {
@@ -252,6 +296,64 @@ class TestCustomer(unittest.TestCase):
         for customer in found:
             self.assertEqual(customer.get_full_name(), full_name)
 
+    def test_keyset_page(self):
+        """It should return a page of Customers after a cursor"""
+        for customer in CustomerFactory.create_batch(5):
+            customer.create()
+        ids = sorted(customer.id for customer in Customer.all())  # all() has no order
+        page = queries.keyset_page(Customer.query, limit=2)
+        self.assertEqual([customer.id for customer in page], ids[:2])
+        page = queries.keyset_page(Customer.query, after=ids[1], limit=10)
+        self.assertEqual([customer.id for customer in page], ids[2:])
+
+    def test_filters(self):
+        """It should compose filters on the columns of Customers"""
+        jane = CustomerFactory(first_name="Jane", last_name="Doe", active=True)
+        john = CustomerFactory(first_name="John", last_name="Doe", active=False)
+        other = CustomerFactory(first_name="Jane", last_name="Smith", active=True)
+        for customer in (jane, john, other):
+            customer.create()
+
+        def ids(**criteria):
+            return sorted(c.id for c in Customer.query.filter(*queries.filters(**criteria)))
+
+        self.assertEqual(ids(last_name="DOE"), sorted([jane.id, john.id]))
+        self.assertEqual(ids(last_name="doe", active=True), [jane.id])
+        self.assertEqual(ids(first_name="jane"), sorted([jane.id, other.id]))
+        self.assertEqual(ids(active=False), [john.id])
+        self.assertEqual(ids(email=other.email), [other.id])
+        self.assertEqual(ids(min_id=john.id, max_id=other.id), sorted([john.id, other.id]))
+        self.assertEqual(queries.filters(), [])
+        self.assertEqual(queries.count(queries.filters(first_name="Jane")), 2)
+        self.assertEqual(queries.count([]), 3)
+
+    def test_sorted_keyset_page(self):
+        """It should page through Customers in a sort order with an id cursor"""
+        for last_name in ("b", "C", "a", "b"):
+            CustomerFactory(last_name=last_name).create()
+        everyone = sorted(Customer.all(), key=lambda c: (c.last_name.lower(), c.id))
+        expected = [c.id for c in everyone]
+
+        page = queries.keyset_page(Customer.query, limit=2, sort="last_name")
+        self.assertEqual([c.id for c in page], expected[:2])
+        page = queries.keyset_page(Customer.query, after=page[-1].id, limit=10, sort="last_name")
+        self.assertEqual([c.id for c in page], expected[2:])
+        page = queries.keyset_page(Customer.query, after=expected[2], limit=10, sort="-last_name")
+        self.assertEqual([c.id for c in page], expected[1::-1])
+        streamed = queries.stream(Customer.query, after=expected[0], sort="last_name")
+        self.assertEqual([c.id for c in streamed], expected[1:])
+
+        self.assertRaises(DataValidationError, queries.keyset_page, Customer.query, 0, 10, "last_name")
+        self.assertRaises(DataValidationError, queries.order_by, "password")
+
+    def test_stream(self):
+        """It should stream all Customers in id order"""
+        for customer in CustomerFactory.create_batch(5):
+            customer.create()
+        ids = sorted(customer.id for customer in Customer.all())
+        streamed = queries.stream(Customer.query, after=ids[0], batch_size=2)
+        self.assertEqual([customer.id for customer in streamed], ids[1:])
+
     def test_find_by_email(self):
         """It should Find a Customer by Email"""
         customers = CustomerFactory.create_batch(10)
@@ -263,3 +365,361 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(found.count(), count)
         for customer in found:
             self.assertEqual(customer.email, email)
+
+    def test_find_by_email_ignores_case(self):
+        """It should Find a Customer by Email regardless of case"""
+        customer = CustomerFactory(email="Jane.Doe@Example.com")
+        customer.create()
+        found = Customer.find_by_email("jane.doe@EXAMPLE.COM")
+        self.assertEqual([c.id for c in found], [customer.id])
+
+    def test_find_by_name_ignores_case(self):
+        """It should Find a Customer by Name regardless of case"""
+        customer = CustomerFactory(first_name="Jane", last_name="Doe")
+        customer.create()
+        found = Customer.find_by_full_name("JANE doe")
+        self.assertEqual([c.id for c in found], [customer.id])
+
+    def test_find_by_single_name(self):
+        """It should Find Customers by a first or last name alone"""
+        jane = CustomerFactory(first_name="Jane", last_name="Doe")
+        jane.create()
+        john = CustomerFactory(first_name="Doe", last_name="Smith")
+        john.create()
+        found = Customer.find_by_full_name("doe")
+        self.assertEqual(sorted(c.id for c in found), sorted([jane.id, john.id]))
+        self.assertEqual(Customer.find_by_full_name("  ").count(), 0)
+
+    def test_search(self):
+        """It should Search Customers by word prefix and fuzzy match, best first"""
+        address = "1 Main St"
+        jonathan = CustomerFactory(
+            first_name="Jonathan", last_name="Richard", email="jrich@yahoo.com", address=address
+        )
+        jonathan.create()
+        john = CustomerFactory(first_name="John", last_name="Jonas", email="jj@example.com", address=address)
+        john.create()
+        CustomerFactory(first_name="Megan", last_name="Chang", email="mchang@gmail.com", address=address).create()
+        columns = [Customer.id]
+
+        rows = queries.search("jon", 10, columns)
+        self.assertEqual([row.id for row in rows], [jonathan.id, john.id])
+        rows = queries.search("Jonathon", 10, columns)  # a typo
+        self.assertEqual([row.id for row in rows], [jonathan.id])
+        rows = queries.search("rich yahoo", 10, columns)
+        self.assertEqual([row.id for row in rows], [jonathan.id])
+        self.assertEqual(len(queries.search("jon", 1, columns)), 1)
+        self.assertEqual(queries.search("zzzz", 10, columns), [])
+        self.assertRaises(DataValidationError, queries.search, "@!", 10, columns)
+
+    def test_search_sees_writes(self):
+        """It should rebuild the search index when Customers change"""
+        customer = CustomerFactory(
+            first_name="Katherine", last_name="Fisher", email="kf@example.org", address="1 Main St"
+        )
+        customer.create()
+        self.assertEqual(len(queries.search("kath", 10, [Customer.id])), 1)
+        customer.first_name = "Olivia"
+        customer.update()
+        self.assertEqual(queries.search("kath", 10, [Customer.id]), [])
+        self.assertEqual(len(queries.search("oli", 10, [Customer.id])), 1)
+        # a write by another process is caught by the fingerprint
+        db.session.execute(db.delete(Customer))
+        db.session.commit()
+        self.assertEqual(queries.search("oli", 10, [Customer.id]), [])
+
+    def test_search_statement_postgres(self):
+        """It should Search with the trigram and tsvector indexes on Postgres"""
+        stmt = queries.search_statement("Jon Dix", 20, [Customer.id], "postgresql")
+        sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        self.assertIn("to_tsquery('simple', 'jon:* & dix:*')", sql)
+        self.assertIn("'jon dix' <%", sql)
+        self.assertIn("word_similarity", sql)
+        index = next(i for i in Customer.__table__.indexes if i.name == "ix_customer_search_trgm")
+        self.assertIn("gin_trgm_ops", str(CreateIndex(index).compile(dialect=postgresql.dialect())))
+
+    def test_indexes_exist(self):
+        """It should create the lookup indexes with the table"""
+        self.assertEqual(queries.missing_indexes(), [])
+        # tiny test tables may be scanned, so only check that a plan comes back
+        self.assertNotEqual(queries.explain(Customer.find_by_email("a@b.com")), [])
+
+    def test_update_bumps_version(self):
+        """It should increase the version of a Customer on every update"""
+        customer = CustomerFactory()
+        customer.create()
+        self.assertEqual(customer.version, 1)
+        self.assertEqual(queries.find_version(customer.id), 1)
+        customer.last_name = "Snow"
+        customer.update()
+        self.assertEqual(customer.version, 2)
+        self.assertEqual(customer.etag(), f"{customer.id}-2")
+
+    def test_update_stale_customer(self):
+        """It should not Update a Customer that was changed since it was read"""
+        customer = CustomerFactory()
+        customer.create()
+        customer.last_name = "Snow"
+        # the ORM raises StaleDataError when the version no longer matches
+        with patch.object(db.session, "commit", side_effect=StaleDataError("stale")):
+            self.assertRaises(ConcurrentUpdateError, customer.update)
+
+    def test_update_by_id(self):
+        """It should Update a Customer in place, honoring expected versions"""
+        customer = CustomerFactory()
+        customer.create()
+        data = Customer.update_by_id(customer.id, {"last_name": "Snow"})
+        self.assertEqual(data["last_name"], "Snow")
+        self.assertEqual(data["version"], 2)
+        self.assertIsNone(Customer.update_by_id(customer.id, {"active": False}, versions=[1]))
+        data = Customer.update_by_id(customer.id, {"active": False}, versions=[2])
+        self.assertEqual(data["active"], False)
+        self.assertIsNone(Customer.update_by_id(0, {"active": False}))
+        self.assertTrue(queries.exists(customer.id))
+
+    def test_delete_by_id(self):
+        """It should Delete a Customer in place"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id = customer.id
+        self.assertTrue(Customer.delete_by_id(customer_id))
+        self.assertFalse(Customer.delete_by_id(customer_id))
+        self.assertFalse(queries.exists(customer_id))
+
+    def _feed(self, since=0, limit=100):
+        """Returns the (id, seq, deleted) of the changes since a number"""
+        return [(row.id, row.seq, row.deleted) for row in feed.changes_since(since, limit, [Customer.id])]
+
+    def test_change_seq(self):
+        """It should renumber a Customer on every write and tombstone deletes"""
+        first, second = CustomerFactory(), CustomerFactory()
+        first.create()
+        second.create()
+        self.assertGreater(second.change_seq, first.change_seq)
+        self.assertIsNotNone(first.updated_at)
+
+        first.last_name = "Snow"
+        first.update()
+        self.assertGreater(first.change_seq, second.change_seq)
+        Customer.update_by_id(second.id, {"active": False})
+        changes = self._feed()
+        self.assertEqual([(by_id, deleted) for by_id, _, deleted in changes], [(first.id, False), (second.id, False)])
+
+        # rehashing a password does not change the Customer
+        seq = changes[-1][1]
+        Customer.verify_password(second.id, PASSWORD)
+        self.assertEqual(self._feed(seq), [])
+
+        first_id, second_id = first.id, second.id
+        Customer.delete_by_id(second_id)
+        first.delete()
+        changes = self._feed(seq)
+        self.assertEqual([(by_id, deleted) for by_id, _, deleted in changes], [(second_id, True), (first_id, True)])
+        self.assertGreater(changes[0][1], seq)
+        self.assertEqual(self._feed(changes[-1][1]), [])
+
+    def test_change_feed_pages(self):
+        """It should page through the changes without splitting a sequence number"""
+        ids = bulk.create_customers([CustomerFactory() for _ in range(5)], chunk_size=5)
+        bulk.delete_customers(ids[:2])
+        changes = self._feed(limit=2)
+        # the bulk INSERT may number its rows alike; those all come together
+        self.assertGreaterEqual(len(changes), 2)
+        self.assertTrue(all(seq > changes[0][1] or seq == changes[-1][1] for _, seq, _ in changes[1:]))
+        seen = list(changes)
+        while changes:
+            changes = self._feed(changes[-1][1], limit=2)
+            seen += changes
+        self.assertEqual(sorted(by_id for by_id, _, deleted in seen if deleted), sorted(ids[:2]))
+        self.assertEqual(sorted(by_id for by_id, _, deleted in seen if not deleted), sorted(ids[2:]))
+        self.assertEqual([seq for _, seq, _ in seen], sorted(seq for _, seq, _ in seen))
+
+    def test_change_feed_lets_writers_commit(self):
+        """It should not hold up writers while the change feed is read"""
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("only Postgres writers take the change feed lock")
+        customer = CustomerFactory()
+        customer.create()
+        changes_statement = feed._changes_statement  # pylint: disable=protected-access
+
+        def write_then_read(*args):
+            with db.engine.connect() as conn:
+                conn.execute(db.text("SET lock_timeout = '2s'"))
+                conn.execute(db.update(Customer).where(Customer.id == customer.id).values(last_name="Snow"))
+                conn.commit()
+            return changes_statement(*args)
+
+        with patch.object(feed, "_changes_statement", write_then_read):
+            self.assertEqual(self._feed(), [])
+        # the write that committed during the read is left to the next one
+        self.assertEqual([by_id for by_id, _, _ in self._feed()], [customer.id])
+
+    def test_bulk_create_bad_item(self):
+        """It should only fail the bad item of a chunk in a bulk create"""
+        customers = [CustomerFactory() for _ in range(3)]
+        customers[1].email = None
+        outcomes = bulk.create_customers(customers, chunk_size=3)
+        self.assertIsInstance(outcomes[1], SQLAlchemyError)
+        self.assertEqual(sorted(c.id for c in Customer.all()), sorted([outcomes[0], outcomes[2]]))
+
+    def test_find_cached_coalesced(self):
+        """It should share one query between concurrent misses until the Customer changes"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id = customer.id
+        release = threading.Event()
+
+        def lead():
+            with app.app_context():
+                Customer.lookups.do(str(customer_id), release.wait)
+
+        with patch.object(Customer, "lookups", SingleFlight("find")):
+            leader = threading.Thread(target=lead)
+            leader.start()
+            for _ in range(100):
+                if Customer.lookups.info()["in_flight"]:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(Customer.lookups.info()["in_flight"], 1)
+            Customer.invalidate(customer_id)
+            self.assertEqual(Customer.find_cached(customer_id)["id"], customer_id)
+            release.set()
+            leader.join(5)
+            self.assertFalse(leader.is_alive())
+            self.assertEqual(Customer.lookups.info(), {"queries": 2, "coalesced": 0, "in_flight": 0})
+
+    def test_find_cached_during_update(self):
+        """It should not cache a Customer read while an update commits"""
+        customer = CustomerFactory(first_name="Before")
+        customer.create()
+        customer_id = customer.id
+        find = Customer.find
+
+        def rename():
+            with app.app_context():
+                Customer.update_by_id(customer_id, {"first_name": "After"})
+
+        def find_then_rename(by_id):
+            found = find(by_id)
+            writer = threading.Thread(target=rename)
+            writer.start()
+            writer.join(5)
+            return found
+
+        with patch.object(Customer, "cache", LRUCache()):
+            with patch.object(Customer, "find", find_then_rename):
+                self.assertEqual(Customer.find_cached(customer_id)["first_name"], "Before")
+            self.assertIsNone(Customer.cache.get(str(customer_id)))
+            db.session.rollback()  # ends the reading request
+            self.assertEqual(Customer.find_cached(customer_id)["first_name"], "After")
+            self.assertIsNotNone(Customer.cache.get(str(customer_id)))
+
+    def test_dispose_engine(self):
+        """It should drop the inherited pooled connections without closing them"""
+        with patch("sqlalchemy.engine.Engine.dispose") as dispose:
+            dispose_engine()
+        dispose.assert_called_once_with(close=False)
+
+    def test_init_db_without_tables(self):
+        """It should leave creating the tables to flask db-init when asked to"""
+        with patch.dict(app.config, {"DB_CREATE_TABLES": False}):
+            with patch.object(db, "create_all") as create_all:
+                Customer.init_db(app)
+        create_all.assert_not_called()
+
+    def test_publish_events(self):
+        """It should publish an event for every committed change"""
+        with patch.object(Customer, "events", EventBroker()):
+            subscription = Customer.events.subscribe()
+            customer = CustomerFactory()
+            customer.create()
+            customer.first_name = "Renamed"
+            customer.update()
+            Customer.update_by_id(customer.id, {"active": False}, kind="deactivated")
+            others = [CustomerFactory() for _ in range(2)]
+            first_name = others[0].first_name
+            ids = bulk.create_customers(others)
+            found = bulk.update_customers([{"id": ids[0], "last_name": "Snow"}, {"id": 0, "last_name": "Snow"}])
+            bulk.delete_customers(ids)
+            customer.delete()
+            received = subscription.take()
+            changes = [(event["type"], event["id"], event["version"]) for event in received]
+        changes[6:8] = sorted(changes[6:8])  # DELETE ... RETURNING has no order
+        self.assertEqual(found, [True, False])
+        self.assertEqual(received[5]["customer"]["last_name"], "Snow")
+        self.assertEqual(received[5]["customer"]["first_name"], first_name)
+        self.assertEqual(
+            changes,
+            [
+                ("created", customer.id, 1),
+                ("updated", customer.id, 2),
+                ("deactivated", customer.id, 3),
+                ("created", ids[0], 1),
+                ("created", ids[1], 1),
+                ("updated", ids[0], 2),
+                ("deleted", ids[0], None),
+                ("deleted", ids[1], None),
+                ("deleted", customer.id, None),
+            ],
+        )
+
+    def test_rolled_back_events(self):
+        """It should not publish the events of a rolled back transaction"""
+        with patch.object(Customer, "events", EventBroker()):
+            subscription = Customer.events.subscribe()
+            customer = CustomerFactory(id=None)
+            db.session.add(customer)
+            db.session.flush()
+            Customer.publish("created", [customer.serialize()])
+            db.session.rollback()
+            db.session.commit()
+            self.assertEqual(subscription.take(), [])
+            Customer.events.unsubscribe(subscription)
+            Customer.publish("created", [{"id": 1, "version": 1}])
+            self.assertNotIn("customer_events", db.session.info)
+
+    def test_notify_triggers(self):
+        """It should NOTIFY the committed changes on Postgres while someone listens"""
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("the triggers are only made on Postgres")
+        listeners = db.text("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :key")
+        subscription = Customer.events.subscribe()
+        try:
+            for _ in range(200):
+                if db.session.execute(listeners, {"key": LISTEN_LOCK_KEY}).scalar():
+                    break
+                time.sleep(0.01)
+            db.session.commit()
+            customer = CustomerFactory()
+            customer.create()
+            customer.first_name = "Renamed"
+            customer.update()
+            Customer.update_by_id(customer.id, {"active": False}, kind="deactivated")
+            customer = Customer.find(customer.id)
+            customer.delete()
+            received = []
+            for _ in range(20):
+                received.extend(subscription.wait(0.25))
+                if len(received) >= 4:
+                    break
+        finally:
+            Customer.events.unsubscribe(subscription)
+        changes = [(event["type"], event["id"], event["version"]) for event in received]
+        self.assertEqual(
+            changes,
+            [
+                ("created", customer.id, 1),
+                ("updated", customer.id, 2),
+                ("deactivated", customer.id, 3),
+                ("deleted", customer.id, None),
+            ],
+        )
+        self.assertEqual(received[1]["customer"]["first_name"], "Renamed")
+        self.assertNotIn("password", received[1]["customer"])
+
+    def test_change_seq_postgres(self):
+        """It should draw change numbers from a sequence under the change feed lock"""
+        stmt = db.insert(Customer.__table__).values(first_name="Jon")
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        self.assertIn("nextval('customer_change_seq')", sql)
+        self.assertIn("pg_advisory_xact_lock_shared", sql)
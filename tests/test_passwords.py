@@ -0,0 +1,106 @@
+"""
+Test cases for password hashing
+"""
+import hashlib
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from service import config
+from service.common import passwords
+from service.common.passwords import (
+    UNUSABLE_PASSWORD,
+    PasswordHasher,
+    PasswordHasherBusy,
+    check_password,
+    create_hasher,
+    hash_password,
+)
+
+SALT = "6edcc0329c89cb56c6ddfb4dfe451887"
+
+
+def make_config(**overrides) -> dict:
+    """Returns the password settings of the configuration with overrides"""
+    settings = {name: getattr(config, name) for name in dir(config) if name.startswith("PASSWORD_")}
+    settings.update(overrides)
+    return settings
+
+
+######################################################################
+#  P A S S W O R D   T E S T   C A S E S
+######################################################################
+class TestPasswords(TestCase):
+    """Test Cases for password hashing"""
+
+    def test_hash_password(self):
+        """It should hash and check passwords with scrypt and PBKDF2"""
+        for algorithm, cost in (("scrypt", 16), ("pbkdf2_sha256", 1000)):
+            encoded = hash_password("secret", SALT, algorithm, cost)
+            self.assertTrue(encoded.startswith(f"{algorithm}${cost}$"))
+            self.assertNotIn("secret", encoded)
+            self.assertTrue(check_password("secret", SALT, encoded))
+            self.assertFalse(check_password("Secret", SALT, encoded))
+            self.assertFalse(check_password("secret", "00" * 16, encoded))
+        self.assertRaises(ValueError, hash_password, "secret", SALT, "md5", 1)
+
+    def test_check_legacy_password(self):
+        """It should check the sha256 digests stored by clients"""
+        encoded = hashlib.sha256(SALT.encode() + b"secret").hexdigest()
+        self.assertTrue(check_password("secret", SALT, encoded))
+        self.assertFalse(check_password("other", SALT, encoded))
+
+    def test_unusable_password(self):
+        """It should never match the password of a Customer imported without one"""
+        self.assertFalse(check_password("", "", UNUSABLE_PASSWORD))
+        self.assertFalse(check_password(UNUSABLE_PASSWORD, "", UNUSABLE_PASSWORD))
+
+    def test_hasher(self):
+        """It should hash with a new salt each time and spot outdated hashes"""
+        hasher = PasswordHasher("scrypt", 16, workers=1)
+        salt, encoded = hasher.hash("secret")
+        other_salt, other = hasher.hash("secret")
+        self.assertNotEqual(salt, other_salt)
+        self.assertNotEqual(encoded, other)
+        self.assertTrue(hasher.verify("secret", salt, encoded))
+        self.assertFalse(hasher.verify("secret", other_salt, encoded))
+        self.assertFalse(hasher.needs_rehash(encoded))
+        self.assertTrue(hasher.needs_rehash(hash_password("secret", salt, "scrypt", 32)))
+        self.assertTrue(hasher.needs_rehash(hash_password("secret", salt, "pbkdf2_sha256", 16)))
+        self.assertEqual(hasher.info(), {"algorithm": "scrypt", "cost": 16, "workers": 1})
+
+    def test_hasher_busy(self):
+        """It should turn away passwords beyond the workers and queue"""
+        hasher = PasswordHasher("scrypt", 16, workers=1, queue_size=0)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_hash(*args):
+            started.set()
+            release.wait(5)
+            return hash_password(*args)
+
+        with patch.object(passwords, "hash_password", slow_hash):
+            first = threading.Thread(target=hasher.hash, args=("secret",))
+            first.start()
+            started.wait(5)
+            self.assertRaises(PasswordHasherBusy, hasher.hash, "other")
+            release.set()
+            first.join()
+        # the slot is free again once the first hash is done
+        salt, encoded = hasher.hash("secret")
+        self.assertTrue(hasher.verify("secret", salt, encoded))
+
+    def test_hasher_timeout(self):
+        """It should give up on a hash that takes longer than the timeout"""
+        hasher = PasswordHasher("scrypt", 16, workers=1, timeout=0.01)
+        release = threading.Event()
+        with patch.object(passwords, "hash_password", lambda *args: release.wait(5)):
+            self.assertRaises(PasswordHasherBusy, hasher.hash, "secret")
+            release.set()
+
+    def test_create_hasher(self):
+        """It should build the hasher from the configuration"""
+        hasher = create_hasher(make_config(PASSWORD_HASH_ALGORITHM="pbkdf2_sha256", PASSWORD_PBKDF2_ITERATIONS=1000))
+        self.assertEqual(hasher.info()["algorithm"], "pbkdf2_sha256")
+        self.assertEqual(hasher.cost, 1000)
+        self.assertEqual(create_hasher(make_config(PASSWORD_SCRYPT_N=1024)).cost, 1024)
+        self.assertRaises(ValueError, create_hasher, make_config(PASSWORD_HASH_ALGORITHM="md5"))
@@ -0,0 +1,103 @@
+"""
+Test cases for the Server-Timing and request profiling hooks
+"""
+import os
+import pstats
+import re
+import tempfile
+import time
+from unittest import TestCase
+from flask import Flask
+from service import config
+from service.common import log_handlers, metrics
+from service.common.profiling import PROFILE_HEADER, init_profiling, server_timing
+
+TOKEN = "s3cr3t"
+
+
+def _make_app(**settings):
+    """Returns an app with the metrics, logging and profiling hooks"""
+    app = Flask("test_profiling")
+    app.config.from_object(config)
+    app.config.update(settings)
+    metrics.init_metrics(app)
+    log_handlers.init_logging(app, "test.profiling")
+    init_profiling(app)
+
+    @app.route("/slow")
+    def slow():
+        with metrics.serialization():
+            time.sleep(0.01)
+        return {"status": "OK"}
+
+    @app.route("/error")
+    def error():
+        raise ValueError("failed")
+
+    return app
+
+
+######################################################################
+#  P R O F I L I N G   T E S T   C A S E S
+######################################################################
+class TestProfiling(TestCase):
+    """Test Cases for the profiling hooks"""
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+
+    def test_no_hooks_when_off(self):
+        """It should not register any hook when timing and profiling are off"""
+        app = _make_app()
+        response = app.test_client().get("/slow", query_string={"_profile": "1"})
+        self.assertNotIn("Server-Timing", response.headers)
+        self.assertNotIn(PROFILE_HEADER, response.headers)
+        hooks = [hook.__module__ for hook in app.after_request_funcs[None]]
+        self.assertNotIn("service.common.profiling", hooks)
+
+    def test_server_timing(self):
+        """It should break a request into phases"""
+        app = _make_app(SERVER_TIMING=True)
+        response = app.test_client().get("/slow")
+        phases = dict(re.findall(r"(\w+);dur=([0-9.]+)", response.headers["Server-Timing"]))
+        self.assertEqual(list(phases), ["db", "serialize", "app", "total"])
+        self.assertGreaterEqual(float(phases["serialize"]), 10)
+        self.assertGreaterEqual(float(phases["total"]), float(phases["serialize"]))
+        self.assertEqual(server_timing({"db": 0.0015}), "db;dur=1.500")
+
+    def test_profile_request(self):
+        """It should profile a request sent with the token"""
+        app = _make_app(PROFILE_TOKEN=TOKEN, PROFILE_DIR=self.profile_dir)
+        response = app.test_client().get(
+            "/slow",
+            query_string={"_profile": "1"},
+            headers={"Authorization": f"Bearer {TOKEN}", "X-Request-ID": "../abc"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers[PROFILE_HEADER], "___abc.prof")
+        stats = pstats.Stats(os.path.join(self.profile_dir, "___abc.prof"))
+        self.assertTrue(any(function[2] == "slow" for function in stats.stats))
+
+    def test_profile_unauthorized(self):
+        """It should not profile a request without the token"""
+        app = _make_app(PROFILE_TOKEN=TOKEN, PROFILE_DIR=self.profile_dir)
+        client = app.test_client()
+        for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": TOKEN}):
+            response = client.get("/slow", query_string={"_profile": "1"}, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(PROFILE_HEADER, response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_profile_error(self):
+        """It should stop profiling a request that raised"""
+        app = _make_app(PROFILE_TOKEN=TOKEN, PROFILE_DIR=self.profile_dir)
+        app.config["PROPAGATE_EXCEPTIONS"] = False
+        response = app.test_client().get(
+            "/error", query_string={"_profile": "1"}, headers={"Authorization": f"Bearer {TOKEN}"}
+        )
+        self.assertEqual(response.status_code, 500)
+        # another request can be profiled, so the profiler was disabled
+        response = app.test_client().get(
+            "/slow", query_string={"_profile": "1"}, headers={"Authorization": f"Bearer {TOKEN}"}
+        )
+        self.assertIn(PROFILE_HEADER, response.headers)
@@ -9,13 +9,20 @@ import json
 
 # import os
 import logging
+from types import SimpleNamespace
 from unittest import TestCase
+from unittest.mock import patch
 from urllib.parse import quote_plus
+from sqlalchemy import event
 
-from service import app, config
+from service import app, config, create_app
+from service.routes import CustomerResource
 from service.common import status  # HTTP Status Codes
-from service.models import Customer, db, init_db
-from tests.factories import CustomerFactory
+from service.models import Customer, Job, Tombstone, db, init_db
+from service.common import feed, jobs
+from service.common.metrics import QueryBudgetExceeded
+from service.common.passwords import PasswordHasherBusy
+from tests.factories import PASSWORD, CustomerFactory, customer_payload
 
 # from flask import url_for
 # from flask import jsonify
@@ -25,11 +32,10 @@ BASE_URL = "/api/customers"
 
 
 ######################################################################
-#  T E S T   C A S E S
+#  T E S T   F I X T U R E S
 ######################################################################
-# pylint: disable=too-many-public-methods
-class TestCustomerServer(TestCase):
-    """REST API Server Tests"""
+class CustomerServerCase(TestCase):
+    """Sets up the app and an empty database for REST API tests"""
 
     @classmethod
     def setUpClass(cls):
@@ -39,20 +45,29 @@ class TestCustomerServer(TestCase):
         app.config["DEBUG"] = False
         # Set up the test database
         app.config["SQLALCHEMY_DATABASE_URI"] = config.DATABASE_URI
+        app.config["JOB_WORKERS"] = 0  # the tests run the jobs themselves
+        # A request over the query budget of its endpoint fails its test
+        app.config["DB_QUERY_BUDGET_ENFORCE"] = True
         app.logger.setLevel(logging.CRITICAL)
         init_db(app)
+        cls.context = app.app_context()
+        cls.context.push()
 
     @classmethod
     def tearDownClass(cls):
         """This runs once after the entire test suite"""
 
         db.session.close()
+        cls.context.pop()
 
     def setUp(self):
         """This runs before each test"""
         self.client = app.test_client()
         db.session.query(Customer).delete()  # clean up the last tests
+        db.session.query(Job).delete()
+        db.session.query(Tombstone).delete()
         db.session.commit()
+        Customer.cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -63,7 +78,7 @@ class TestCustomerServer(TestCase):
         customers = []
         for _ in range(count):
             test_customer = CustomerFactory()
-            response = self.client.post(BASE_URL, json=test_customer.serialize())
+            response = self.client.post(BASE_URL, json=customer_payload(test_customer))
             self.assertEqual(
                 response.status_code,
                 status.HTTP_201_CREATED,
@@ -74,6 +89,14 @@ class TestCustomerServer(TestCase):
             customers.append(test_customer)
         return customers
 
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+# pylint: disable=too-many-public-methods
+class TestCustomerServer(CustomerServerCase):
+    """REST API Server Tests"""
+
     ######################################################################
     #  P L A C E   T E S T   C A S E S   H E R E
     ######################################################################
@@ -104,8 +127,7 @@ class TestCustomerServer(TestCase):
                 "last_name": fake_customer.last_name,
                 "email": fake_customer.email,
                 "address": fake_customer.address,
-                "salt": fake_customer.salt,
-                "password": fake_customer.password,
+                "password": PASSWORD,
                 "active": fake_customer.active,
             }
         )
@@ -124,10 +146,26 @@ class TestCustomerServer(TestCase):
         self.assertEqual(new_json["last_name"], fake_customer.last_name)
         self.assertEqual(new_json["email"], fake_customer.email)
         self.assertEqual(new_json["address"], fake_customer.address)
-        self.assertEqual(new_json["salt"], fake_customer.salt)
-        self.assertEqual(new_json["password"], fake_customer.password)
+        self.assertNotIn("salt", new_json)
+        self.assertNotIn("password", new_json)
         self.assertEqual(new_json["active"], fake_customer.active)
 
+        # only the hash of the password is stored
+        customer = Customer.find(int(new_json["id"]))
+        self.assertNotIn(PASSWORD, customer.password)
+        self.assertTrue(Customer.hasher.verify(PASSWORD, customer.salt, customer.password))
+
+    def test_password_not_logged(self):
+        """It should not log the passwords posted to create or update a Customer"""
+        payload = customer_payload(CustomerFactory())
+        with self.assertLogs(app.logger, level="DEBUG") as logs:
+            response = self.client.post(BASE_URL, json=payload)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            customer_id = response.get_json()["id"]
+            response = self.client.put(f"{BASE_URL}/{customer_id}", json=payload)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([line for line in logs.output if payload["password"] in line])
+
     def test_create_customer_wrong_field(self):
         """Create a new Customer with wrong field"""
         # Arrange
@@ -242,7 +280,7 @@ class TestCustomerServer(TestCase):
             "active": fake_customer.active,
         }
 
-        required_fields = ["first_name", "last_name", "email", "address", "active"]
+        required_fields = ["first_name", "last_name", "email", "address", "active", "password"]
 
         for key in required_fields:
             bad_data = data_dict.copy()
@@ -281,10 +319,162 @@ class TestCustomerServer(TestCase):
         self.assertEqual(new_json["last_name"], customer.last_name)
         self.assertEqual(new_json["email"], customer.email)
         self.assertEqual(new_json["address"], customer.address)
-        self.assertEqual(new_json["salt"], customer.salt)
-        self.assertEqual(new_json["password"], customer.password)
+        self.assertNotIn("salt", new_json)
+        self.assertNotIn("password", new_json)
         self.assertEqual(new_json["active"], customer.active)
 
+    def test_get_customer_cached(self):
+        """It should serve repeated reads from the cache until the Customer changes"""
+        customer = self._create_customers(1)[0]
+        stats = Customer.cache.stats
+        hits = stats.hits
+        self.client.get(f"{BASE_URL}/{customer.id}")
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(stats.hits, hits + 1)
+
+        response = self.client.put(f"{BASE_URL}/{customer.id}/deactivate")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.get_json()["active"], False)
+
+        data = response.get_json()
+        data["last_name"] = "Snow"
+        self.client.put(f"{BASE_URL}/{customer.id}", json=data)
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.get_json()["last_name"], "Snow")
+
+        self.client.delete(f"{BASE_URL}/{customer.id}")
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_customer_fields(self):
+        """It should Get only the requested fields of a Customer"""
+        customer = self._create_customers(1)[0]
+        Customer.cache.clear()
+        statements = []
+
+        def capture(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            response = self.client.get(f"{BASE_URL}/{customer.id}", query_string="fields=id,email")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"id": str(customer.id), "email": customer.email})
+        self.assertEqual(response.headers["ETag"], f'"{customer.id}-1"')
+        self.assertNotIn("address", statements[-1])
+
+        # a cached Customer is projected from the cache
+        self.client.get(f"{BASE_URL}/{customer.id}")
+        response = self.client.get(f"{BASE_URL}/{customer.id}", query_string="fields=active")
+        self.assertEqual(response.get_json(), {"active": True})
+
+        response = self.client.get(f"{BASE_URL}/{customer.id}", query_string="fields=id,password")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Unknown fields: password", response.get_json()["message"])
+        response = self.client.get(f"{BASE_URL}/0", query_string="fields=id")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_customer_etag(self):
+        """It should return an ETag and answer If-None-Match with 304"""
+        customer = self._create_customers(1)[0]
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, f'"{customer.id}-1"')
+
+        response = self.client.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        # a cold cache answers from the version column alone
+        Customer.cache.clear()
+        response = self.client.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(f"{BASE_URL}/{customer.id}/deactivate")
+        response = self.client.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_get_missing_customer_with_etag(self):
+        """It should return 404 for a missing Customer even with If-None-Match"""
+        response = self.client.get(f"{BASE_URL}/0", headers={"If-None-Match": '"0-1"'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_customers_etag(self):
+        """It should answer an unchanged list with 304"""
+        customers = self._create_customers(2)
+        response = self.client.get(BASE_URL)
+        etag = response.headers["ETag"]
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(f"{BASE_URL}/{customers[0].id}/deactivate")
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        # a sorted page past a cursor selects the cursor's sort key once
+        app.config["DB_QUERY_HEADERS"] = True
+        try:
+            response = self.client.get(
+                f"{BASE_URL}?sort=last_name&after={customers[0].id}", headers={"If-None-Match": etag}
+            )
+        finally:
+            app.config["DB_QUERY_HEADERS"] = False
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-DB-Queries"], "3")
+
+    def test_update_customer_if_match(self):
+        """It should only Update a Customer that matches If-Match"""
+        customer = self._create_customers(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{customer.id}").headers["ETag"]
+        data = customer.serialize()
+        data["last_name"] = "Snow"
+
+        response = self.client.put(f"{BASE_URL}/{customer.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_etag = response.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+
+        # the old ETag is now stale
+        response = self.client.put(f"{BASE_URL}/{customer.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.put(f"{BASE_URL}/{customer.id}/deactivate", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        response = self.client.put(f"{BASE_URL}/{customer.id}/deactivate", headers={"If-Match": new_etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["active"], False)
+
+    def test_update_customer_if_match_other_etag(self):
+        """It should tell a stale If-Match ETag (412) from a missing Customer (404)"""
+        customer = self._create_customers(1)[0]
+        response = self.client.put(f"{BASE_URL}/{customer.id}/deactivate", headers={"If-Match": '"0-1"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.put(f"{BASE_URL}/{customer.id}/deactivate", headers={"If-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(f"{BASE_URL}/0/deactivate", headers={"If-Match": '"0-1"'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_update_customer_without_reading_it(self):
+        """It should Update, Deactivate and Delete without loading the Customer"""
+        customer = self._create_customers(1)[0]
+        with patch.object(Customer, "find", side_effect=AssertionError("row was loaded")):
+            response = self.client.put(f"{BASE_URL}/{customer.id}", json=customer.serialize())
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.put(f"{BASE_URL}/{customer.id}/deactivate")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.get_json()["version"], 3)
+            response = self.client.delete(f"{BASE_URL}/{customer.id}")
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(Customer.find(int(customer.id)))
+
     def test_list_customers(self):
         """Test listing all customers"""
         # Get the current number of customers before creating new ones
@@ -297,11 +487,125 @@ class TestCustomerServer(TestCase):
 
         customers_data = response.get_json()
         self.assertIsInstance(customers_data, list)
+        self.assertNotIn("password", customers_data[0])
+        self.assertNotIn("salt", customers_data[0])
 
         expected_length = initial_customer_count + 3
 
         self.assertEqual(len(customers_data), expected_length)
 
+    def test_list_customers_paginated(self):
+        """It should page through Customers with limit and after"""
+        customers = self._create_customers(5)
+        ids = sorted(int(customer.id) for customer in customers)
+
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([int(c["id"]) for c in data], ids[:2])
+        self.assertEqual(response.headers["X-Next-Cursor"], str(ids[1]))
+        self.assertIn('rel="next"', response.headers["Link"])
+        self.assertIn(f"after={ids[1]}", response.headers["Link"])
+
+        response = self.client.get(BASE_URL, query_string=f"limit=2&after={ids[1]}")
+        data = response.get_json()
+        self.assertEqual([int(c["id"]) for c in data], ids[2:4])
+
+        # the last page is short and has no next link
+        response = self.client.get(BASE_URL, query_string=f"limit=2&after={ids[3]}")
+        data = response.get_json()
+        self.assertEqual([int(c["id"]) for c in data], ids[4:])
+        self.assertNotIn("Link", response.headers)
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+    def test_list_customers_fields(self):
+        """It should list and stream only the requested fields of the Customers"""
+        customers = self._create_customers(3)
+        response = self.client.get(BASE_URL, query_string="fields=email,active&limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data, [{"email": c.email, "active": c.active} for c in customers[:2]])
+        self.assertIn("fields=email,active", response.headers["Link"])
+        self.assertEqual(response.headers["X-Next-Cursor"], str(customers[1].id))
+
+        response = self.client.get(BASE_URL, query_string="fields=id&stream=true")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"id": str(c.id)} for c in customers])
+
+        response = self.client.get(BASE_URL, query_string="fields=")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, query_string="fields=salt")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_customers(self):
+        """It should filter Customers by name, active and id range in the database"""
+        names = (("Jane", "Doe", True), ("John", "Doe", False), ("Jane", "Smith", True))
+        ids = []
+        for first_name, last_name, active in names:
+            customer = CustomerFactory(first_name=first_name, last_name=last_name, active=active)
+            response = self.client.post(BASE_URL, json=customer_payload(customer))
+            ids.append(response.get_json()["id"])
+
+        def found(query_string):
+            response = self.client.get(BASE_URL, query_string=query_string)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [c["id"] for c in response.get_json()]
+
+        self.assertEqual(found("last_name=doe"), ids[:2])
+        self.assertEqual(found("last_name=doe&active=false"), [ids[1]])
+        self.assertEqual(found("first_name=JANE&active=true"), [ids[0], ids[2]])
+        self.assertEqual(found(f"min_id={ids[1]}&max_id={ids[2]}"), ids[1:])
+        response = self.client.get(BASE_URL, query_string="active=maybe")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sort_customers(self):
+        """It should sort Customers and page through them in that order"""
+        for last_name in ("Brown", "adams", "Clark"):
+            self.client.post(BASE_URL, json=customer_payload(CustomerFactory(last_name=last_name)))
+        response = self.client.get(BASE_URL, query_string="sort=last_name&limit=2")
+        self.assertEqual([c["last_name"] for c in response.get_json()], ["adams", "Brown"])
+        self.assertIn("sort=last_name", response.headers["Link"])
+        cursor = response.headers["X-Next-Cursor"]
+        response = self.client.get(BASE_URL, query_string=f"sort=last_name&limit=2&after={cursor}")
+        self.assertEqual([c["last_name"] for c in response.get_json()], ["Clark"])
+        response = self.client.get(BASE_URL, query_string="sort=-last_name")
+        self.assertEqual([c["last_name"] for c in response.get_json()], ["Clark", "Brown", "adams"])
+        response = self.client.get(BASE_URL, query_string="sort=password")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_count_customers(self):
+        """It should count the matching Customers with HEAD or ?count=true"""
+        customers = self._create_customers(3)
+        response = self.client.head(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "3")
+        self.assertEqual(response.data, b"")
+        query_string = f"count=true&email={quote_plus(customers[0].email)}"
+        response = self.client.get(BASE_URL, query_string=query_string)
+        self.assertEqual(response.get_json(), {"count": 1})
+        self.assertEqual(response.headers["X-Total-Count"], "1")
+        response = self.client.get(BASE_URL, query_string="count=true&q=jon")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_customers_bad_limit(self):
+        """It should not list Customers with a bad limit"""
+        response = self.client.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, query_string="after=-1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_customers(self):
+        """It should stream Customers as NDJSON"""
+        customers = self._create_customers(3)
+        ids = sorted(int(customer.id) for customer in customers)
+        response = self.client.get(BASE_URL, query_string=f"stream=true&after={ids[0]}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        data = [json.loads(line) for line in lines]
+        self.assertEqual([int(c["id"]) for c in data], ids[1:])
+        self.assertEqual(data[0]["email"], customers[1].email)
+
     def test_query_by_email(self):
         """It should Query Customers by Email"""
         customers = self._create_customers(10)
@@ -319,6 +623,33 @@ class TestCustomerServer(TestCase):
         for customer in data:
             self.assertEqual(customer["email"], test_email)
 
+    def test_search_customers(self):
+        """It should Search Customers with ?q=, best matches first"""
+        for first_name, last_name in (("Jonathan", "Richard"), ("Megan", "Chang"), ("Jon", "Snow")):
+            customer = CustomerFactory(
+                first_name=first_name, last_name=last_name, email=f"{first_name}@example.com", address="1 Main St"
+            )
+            response = self.client.post(BASE_URL, json=customer_payload(customer))
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(BASE_URL, query_string="q=jon")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c["first_name"] for c in response.get_json()], ["Jon", "Jonathan"])
+        self.assertIn("ETag", response.headers)
+        self.assertNotIn("Link", response.headers)
+        response = self.client.get(BASE_URL, query_string="q=jon&limit=1")
+        self.assertEqual(len(response.get_json()), 1)
+        response = self.client.get(BASE_URL, query_string="q=chnag")
+        self.assertEqual(response.get_json(), [])
+        response = self.client.get(BASE_URL, query_string="q=Megan Chan")
+        self.assertEqual([c["last_name"] for c in response.get_json()], ["Chang"])
+
+    def test_search_customers_bad_arguments(self):
+        """It should not Search with an empty query or with paging arguments"""
+        response = self.client.get(BASE_URL, query_string="q=%40%21")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, query_string="q=jon&after=1")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_update_existing_customer(self):
         """Test updating an existing customer should return 200_OK"""
         original_customer = self._create_customers(1)[0]
@@ -337,7 +668,7 @@ class TestCustomerServer(TestCase):
         self.assertEqual(updated_customer_data["last_name"], updated_customer.last_name)
         self.assertEqual(updated_customer_data["email"], updated_customer.email)
         self.assertEqual(updated_customer_data["address"], updated_customer.address)
-        self.assertEqual(updated_customer_data["password"], updated_customer.password)
+        self.assertNotIn("password", updated_customer_data)
         self.assertEqual(updated_customer_data["active"], updated_customer.active)
 
     def test_update_non_existing_customer(self):
@@ -377,6 +708,60 @@ class TestCustomerServer(TestCase):
         response = self.client.put(f"{BASE_URL}/{int(customer.id) + 1}/deactivate")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_customer_password(self):
+        """It should keep the password unless an update sends a new one"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer.id}/verify-password"
+        data = customer.serialize()
+        self.client.put(f"{BASE_URL}/{customer.id}", json=data)
+        self.assertEqual(self.client.post(url, json={"password": PASSWORD}).status_code, status.HTTP_200_OK)
+
+        self.client.put(f"{BASE_URL}/{customer.id}", json=dict(data, password="n3w-Secret"))
+        response = self.client.post(url, json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(url, json={"password": "n3w-Secret"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.put(f"{BASE_URL}/{customer.id}", json=dict(data, password=""))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_verify_password(self):
+        """It should Verify a Customer's password"""
+        customer = self._create_customers(1)[0]
+        url = f"{BASE_URL}/{customer.id}/verify-password"
+        response = self.client.post(url, json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"id": customer.id, "verified": True})
+
+        response = self.client.post(url, json={"password": "wrong"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(url, json={})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/0/verify-password", json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_verify_password_upgrades_hash(self):
+        """It should rehash a password made with an old cost once it is verified"""
+        customer = CustomerFactory()
+        customer.create()
+        self.assertTrue(Customer.hasher.needs_rehash(customer.password))
+        response = self.client.post(f"{BASE_URL}/{customer.id}/verify-password", json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stored = Customer.find(customer.id)
+        db.session.refresh(stored)
+        self.assertFalse(Customer.hasher.needs_rehash(stored.password))
+        self.assertEqual(stored.version, 1)
+        response = self.client.post(f"{BASE_URL}/{customer.id}/verify-password", json={"password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_password_hasher_busy(self):
+        """It should answer 503 when too many passwords are being hashed"""
+        busy = PasswordHasherBusy("Too many passwords are being hashed")
+        with patch.object(Customer.hasher, "hash", side_effect=busy):
+            response = self.client.post(BASE_URL, json=customer_payload(CustomerFactory()))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
     def test_method_not_supported(self):
         """It should return a HTTP_405_METHOD_NOT_ALLOWED when an unsupported method is called on an endpoint"""
         response = self.client.post("/")
@@ -391,9 +776,128 @@ class TestCustomerServer(TestCase):
         response = self.client.delete(BASE_URL)
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def test_stats(self):
+        """It should return the cache counters"""
+        response = self.client.get("/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertIn("hits", data["cache"])
+        self.assertIn("evictions", data["cache"])
+        self.assertIn("pool", data["pool"])
+        self.assertCountEqual(data["startup"]["phases"], ["imports", "app", "database", "jobs"])
+        self.assertGreater(data["startup"]["total"], 0)
+
+    def test_create_app(self):
+        """It should make another app with every route and command from a configuration"""
+        settings = SimpleNamespace(**{name: getattr(config, name) for name in dir(config) if name.isupper()})
+        settings.SQLALCHEMY_DATABASE_URI = config.DATABASE_URI
+        settings.JOB_WORKERS = 0
+        try:
+            other = create_app(settings)
+            self.assertIsNot(other, app)
+            client = other.test_client()
+            self.assertEqual(client.get("/health").status_code, status.HTTP_200_OK)
+            self.assertEqual(client.get(BASE_URL).status_code, status.HTTP_200_OK)
+            self.assertEqual(client.get("/api/swagger.json").status_code, status.HTTP_200_OK)
+            self.assertIn("db-init", other.cli.commands)
+        finally:
+            init_db(app)
+            jobs.init_jobs(app)
+
+    def test_request_id(self):
+        """It should return the id a request was sent with, or a new one"""
+        response = self.client.get("/health", headers={"X-Request-ID": "abc-123"})
+        self.assertEqual(response.headers["X-Request-ID"], "abc-123")
+        response = self.client.get("/health")
+        self.assertEqual(len(response.headers["X-Request-ID"]), 32)
+
+    def test_access_log(self):
+        """It should log one access line per request when asked to"""
+        customer = self._create_customers(1)[0]
+        app.config["ACCESS_LOG"] = True
+        try:
+            with self.assertLogs("service.access", level="INFO") as logs:
+                self.client.get(f"{BASE_URL}/{customer.id}", headers={"X-Request-ID": "abc-123"})
+        finally:
+            app.config["ACCESS_LOG"] = False
+        self.assertEqual(len(logs.records), 1)
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), f"GET {BASE_URL}/{customer.id} 200")
+        self.assertEqual(record.request_id, "abc-123")
+        self.assertEqual(record.route, "CustomerResource")
+        self.assertEqual(record.status, 200)
+        self.assertGreater(record.duration_ms, 0)
+        self.assertGreaterEqual(record.db_queries, 0)
+
     def test_health(self):
         """Send Request and Test status_code as 200_OK, JSON content as status: OK"""
         response = self.client.get("/health")
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.json, {"status": "OK"})
+
+    def test_query_budget(self):
+        """It should fail a request that executes more statements than its budget"""
+        customer = self._create_customers(1)[0]
+        Customer.cache.clear()
+        with patch.object(CustomerResource.get, "query_budget", 0):
+            with self.assertRaises(QueryBudgetExceeded) as context:
+                self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertIn("over its budget of 0", str(context.exception))
+        app.config["DB_QUERY_BUDGET_ENFORCE"] = False
+        try:
+            with patch.object(CustomerResource.get, "query_budget", 0):
+                Customer.cache.clear()
+                with self.assertLogs("flask.app", level="WARNING"):
+                    response = self.client.get(f"{BASE_URL}/{customer.id}")
+        finally:
+            app.config["DB_QUERY_BUDGET_ENFORCE"] = True
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_repeated_queries(self):
+        """It should fail a request that executes the same statement too many times"""
+        customers = self._create_customers(3)
+
+        def changes_since(*_):
+            for customer in customers:  # an N+1 query: one statement per Customer
+                Customer.query.filter_by(id=int(customer.id)).first()
+            return []
+
+        app.config["DB_QUERY_REPEAT_LIMIT"] = 2
+        try:
+            with patch.object(feed, "changes_since", side_effect=changes_since):
+                with self.assertRaises(QueryBudgetExceeded) as context:
+                    self.client.get(f"{BASE_URL}/changes")
+        finally:
+            app.config["DB_QUERY_REPEAT_LIMIT"] = config.DB_QUERY_REPEAT_LIMIT
+        self.assertIn("the same statement 3 times (N+1?)", str(context.exception))
+
+    def test_query_headers(self):
+        """It should return the number of statements of a request when asked to"""
+        customer = self._create_customers(1)[0]
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertNotIn("X-DB-Queries", response.headers)
+        app.config["DB_QUERY_HEADERS"] = True
+        try:
+            Customer.cache.clear()
+            response = self.client.get(f"{BASE_URL}/{customer.id}")
+        finally:
+            app.config["DB_QUERY_HEADERS"] = False
+        self.assertEqual(response.headers["X-DB-Queries"], "1")
+
+    def test_metrics(self):
+        """It should return request, SQL and serialization metrics"""
+        customer = self._create_customers(1)[0]
+        self.client.get(f"{BASE_URL}/{customer.id}")
+        self.client.get(BASE_URL)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        self.assertIn(
+            'customer_http_requests_total{method="GET",resource="CustomerResource",status="200"}',
+            text,
+        )
+        self.assertIn('customer_http_request_duration_seconds_count{method="POST",resource="CustomerCollection"}', text)
+        self.assertIn('customer_db_queries_per_request_count{method="GET",resource="CustomerCollection"}', text)
+        self.assertIn('customer_serialization_duration_seconds_sum{method="GET",resource="CustomerCollection"}', text)
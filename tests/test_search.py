@@ -0,0 +1,53 @@
+"""
+Test cases for the in-process search index
+"""
+from unittest import TestCase
+from service.common.search import NgramIndex, search_words, trigrams
+
+DOCUMENTS = [
+    (1, "william dixon will.dixon@hotmail.com psc 4115, box 7815"),
+    (2, "jonathan richard jrich@yahoo.com 778 brown plaza"),
+    (3, "megan chang mchang@gmail.com 398 wallace ranch"),
+]
+
+
+######################################################################
+#  S E A R C H   T E S T   C A S E S
+######################################################################
+class TestNgramIndex(TestCase):
+    """Test Cases for the n-gram index"""
+
+    def test_search_words(self):
+        """It should split text into lower case words"""
+        self.assertEqual(search_words("Will.Dixon@Hotmail.com"), ["will", "dixon", "hotmail", "com"])
+        self.assertEqual(search_words("snake_case -- 42"), ["snake", "case", "42"])
+        self.assertEqual(search_words("@!"), [])
+
+    def test_trigrams(self):
+        """It should cut words into padded trigrams like pg_trgm"""
+        self.assertEqual(trigrams(["cat"]), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams([]), set())
+
+    def test_prefix_search(self):
+        """It should find documents with words that start with every query word"""
+        index = NgramIndex(DOCUMENTS)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search("dix", 10, 0.6), [1])
+        self.assertEqual(index.search("Brown Jon", 10, 0.6), [2])
+        self.assertEqual(index.search("gmail", 10, 0.6), [3])
+
+    def test_fuzzy_search(self):
+        """It should find misspelled words and rank prefix matches first"""
+        index = NgramIndex(DOCUMENTS + [(4, "jon dixen jd@example.com")])
+        self.assertEqual(index.search("dixen", 10, 0.5), [4, 1])
+        self.assertEqual(index.search("richart", 10, 0.6), [2])
+        self.assertEqual(index.search("richart", 10, 0.9), [])
+
+    def test_search_limit(self):
+        """It should return at most limit ids"""
+        index = NgramIndex(DOCUMENTS)
+        self.assertEqual(index.search("com", 10, 0.6), [1, 2, 3])
+        self.assertEqual(index.search("com", 2, 0.6), [1, 2])
+        self.assertEqual(index.search("", 10, 0.6), [])
+        self.assertEqual(NgramIndex().search("com", 10, 0.6), [])
+        self.assertIsNone(NgramIndex().key)
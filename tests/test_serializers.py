@@ -0,0 +1,55 @@
+"""
+Test cases for the row serializers
+"""
+import json
+from unittest import TestCase
+from unittest.mock import patch
+from flask_restx import marshal
+from service.common import serializers
+from service.models import Customer
+from service.routes import customer_model, customer_rows
+from tests.factories import CustomerFactory
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestRowSerializer(TestCase):
+    """Test Cases for RowSerializer"""
+
+    def _row(self, customer: Customer) -> tuple:
+        return tuple(getattr(customer, name) for name in customer_rows.names) + (1,)
+
+    def test_matches_marshal(self):
+        """It should produce the same Customer as marshal()"""
+        customer = CustomerFactory(id=7)
+        expected = marshal(customer.serialize(), customer_model)
+        self.assertEqual(customer_rows.to_dict(self._row(customer)), dict(expected))
+        self.assertEqual(customer_rows.to_dict(self._row(customer))["id"], "7")
+
+    def test_dumps(self):
+        """It should encode rows as a JSON array and as NDJSON lines"""
+        customers = CustomerFactory.build_batch(2)
+        rows = [self._row(customer) for customer in customers]
+        data = json.loads(customer_rows.dumps(rows))
+        self.assertEqual([c["email"] for c in data], [c.email for c in customers])
+        line = customer_rows.dumps_line(rows[0])
+        self.assertTrue(line.endswith(b"\n"))
+        self.assertEqual(json.loads(line)["email"], customers[0].email)
+
+    def test_dumps_without_orjson(self):
+        """It should fall back to the standard json module"""
+        with patch.object(serializers, "orjson", None):
+            self.assertEqual(serializers.dumps({"a": [1, None]}), b'{"a":[1,null]}')
+
+    def test_subset(self):
+        """It should serialize a sparse fieldset in model order"""
+        customer = CustomerFactory(id=7)
+        subset = customer_rows.subset(["active", " id", "email"])
+        self.assertEqual(subset.names, ["email", "active", "id"])
+        self.assertIs(customer_rows.subset(["id", "email", "active"]), subset)
+        row = tuple(getattr(customer, name) for name in subset.names)
+        self.assertEqual(subset.to_dict(row), {"email": customer.email, "active": True, "id": "7"})
+        self.assertEqual(subset.from_mapping(customer.serialize()), subset.to_dict(row))
+        self.assertRaises(ValueError, customer_rows.subset, ["id", "salt"])
+        self.assertRaises(ValueError, customer_rows.subset, ["", " "])
@@ -0,0 +1,112 @@
+"""
+Test cases for the single flight query coalescing
+"""
+import asyncio
+import threading
+import time
+from unittest import TestCase
+from service.common.metrics import COALESCED_QUERIES
+from service.common.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def _wait_for(condition):
+    """Waits until a condition holds"""
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """Test Cases for SingleFlight and AsyncSingleFlight"""
+
+    def test_coalesce_threads(self):
+        """It should run one query for the threads that ask for the same key at once"""
+        flight = SingleFlight("test")
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return {"id": 1}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("1", load))) for _ in range(5)]
+        before = COALESCED_QUERIES.labels("test")._value.get()  # pylint: disable=protected-access
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: flight.coalesced == 4)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"id": 1}] * 5)
+        self.assertEqual(flight.info(), {"queries": 1, "coalesced": 4, "in_flight": 0})
+        self.assertEqual(COALESCED_QUERIES.labels("test")._value.get() - before, 4)  # pylint: disable=protected-access
+        self.assertEqual(flight.do("1", lambda: {"id": 2}), {"id": 2})
+
+    def test_share_errors(self):
+        """It should raise the error of the query in every thread that shared it"""
+        flight = SingleFlight("test")
+        release = threading.Event()
+        errors = []
+
+        def load():
+            release.wait(5)
+            raise ValueError("failed")
+
+        def ask():
+            try:
+                flight.do("1", load)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=ask) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: flight.coalesced == 2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flight.info()["in_flight"], 0)
+
+    def test_forget(self):
+        """It should not let a request join a query that started before a write"""
+        flight = SingleFlight("test")
+        release = threading.Event()
+        thread = threading.Thread(target=lambda: flight.do("1", lambda: release.wait(5)))
+        thread.start()
+        _wait_for(lambda: flight.info()["in_flight"] == 1)
+        flight.forget("1")
+        self.assertEqual(flight.do("1", lambda: "fresh"), "fresh")
+        release.set()
+        thread.join(5)
+        self.assertEqual(flight.coalesced, 0)
+
+    def test_coalesce_coroutines(self):
+        """It should run one query for the coroutines that ask for the same key at once"""
+        flight = AsyncSingleFlight("test")
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"id": 1}
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do("1", load))
+            await asyncio.sleep(0)
+            others = [asyncio.ensure_future(flight.do("1", load)) for _ in range(3)]
+            await asyncio.sleep(0)
+            leader.cancel()  # the others still get the result
+            return await asyncio.gather(*others)
+
+        self.assertEqual(asyncio.run(main()), [{"id": 1}] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.info(), {"queries": 1, "coalesced": 3, "in_flight": 0})
@@ -0,0 +1,25 @@
+"""
+Test cases for the startup report
+"""
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import startup
+from service.common.startup import StartupReport
+
+
+######################################################################
+#  S T A R T U P   T E S T   C A S E S
+######################################################################
+class TestStartup(TestCase):
+    """Test Cases for StartupReport"""
+
+    def test_phases(self):
+        """It should time each phase from the end of the one before"""
+        with patch.object(startup.time, "perf_counter", side_effect=[10.0, 10.5, 12.0]):
+            report = StartupReport()
+            report.mark("imports")
+            report.mark("database")
+        self.assertEqual(report.phases, {"imports": 0.5, "database": 1.5})
+        self.assertEqual(report.total, 2.0)
+        self.assertEqual(report.summary(), "Started in 2.000s (imports 0.500s, database 1.500s)")
+        self.assertEqual(report.info(), {"phases": {"imports": 0.5, "database": 1.5}, "total": 2.0})